@@ -0,0 +1,26 @@
+#
+# Description: Helpers shared by the scripts which keep computed products on disk between runs, so that repeated runs
+# of the pipeline can skip expensive steps. Everything is kept in the cache/ directory next to these scripts, which
+# is safe to delete at any time.
+#
+
+import os
+import json
+import hashlib
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+
+# Return the full path to a file in the cache directory, creating the directory if needed
+def cache_path(filename):
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        if not os.path.isdir(cache_dir):
+            raise
+    return os.path.join(cache_dir, filename)
+
+
+# Short, stable hash of a configuration (anything json can serialize), used to key cache files
+def config_hash(config):
+    return hashlib.md5(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:16]
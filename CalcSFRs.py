@@ -6,20 +6,60 @@
 # This code uses equations given in Murphy et. al (2011), and Condon & Matthews (2018).
 #
 
+import os
+import json
 import numpy as np
-from sympy import *
+import Cache
+import Distances
 
+#######################################################################
+# parameters
 allowthermal = True
 
+Hubble = 70     # km/s/Mpc
+Hubble_unc = 2
+freqs = 1.51976491105  # GHz
+freqsigs = 0
+alphas = -0.8
+alphasig = 0.05
+
+# keep compiled expressions on disk so later runs never need to import sympy
+disk_cache = True
+
+# look up the Condon & Matthews comoving distance in the shared Distances table instead of evaluating it
+use_distance_table = False
+
+# Monte Carlo error propagation: samples per galaxy, and the most samples held in memory at once
+mc_samples = 100000
+mc_max_elements = 4000000
+#######################################################################
+
+# speed of light in km/s, and Mpc in cm
+c_kms = 299792.458
+mpc_to_cm = 3.08567758128*(10**24)
+
 
 def tabatabaei(nu, al, z):
     thermal_frac = 1./(1.+13.*((nu*(1+z)) ** (0.1 + al)))
     return(thermal_frac)
 
-# Calculate a luminosity, star formation rate, and uncertainties given a flux density
-# Using equation relating synchrotron emission to star formation rate given in Murphy et. al (2011)
-# Also using Condon & Matthews (2018) to calculate spectral luminosity distance
-def calc_params(flux, flux_error, redshift, redshift_error):
+# bump when the symbolic formulas below change, so stale compiled expressions on disk are not reused
+derivation_version = 1
+
+# names of the compiled expressions, and the variables left free in each of them
+expression_names = ['Lum', 'Lum_stat', 'Lum_syst', 'SF', 'SF_stat', 'SF_syst']
+free_symbols = ['f', 'f_unc', 'z', 'zunc']
+
+# in-process cache of compiled expressions, keyed by the configuration hash
+_compiled = {}
+
+
+# Derive the luminosity, star formation rate, and uncertainty formulas symbolically, then substitute the constants of
+# the given configuration. Using equation relating synchrotron emission to star formation rate given in
+# Murphy et. al (2011), and Condon & Matthews (2018) to calculate spectral luminosity distance
+# Returns a dictionary of python source strings in the free symbols (flux, redshift and their uncertainties)
+def derive_expressions(config):
+    from sympy import Symbol, diff
 
     # Defining symbols (sympy)
     z = Symbol('z')     # redshift
@@ -52,7 +92,7 @@ def calc_params(flux, flux_error, redshift, redshift_error):
     # SFR formula in solar masses/yr (Murphy et. al)
     kroupa_to_salpeter = 1.5
     #SFRform = kroupa_to_salpeter*(6.64e-29*(nu**(-al))*Lumform)
-    if allowthermal:
+    if config['allowthermal']:
         L_NT = Lumform/(1+1/13.*((1+z)*nu)**(-0.1-al))
         SFRform = 6.64e-29 * (nu ** (-al)) * L_NT
     else:
@@ -64,36 +104,174 @@ def calc_params(flux, flux_error, redshift, redshift_error):
     SFR_stat_uncertainty = ((diff(SFRform, f)*f_unc)**2)**.5
     SFR_syst_uncertainty = ((diff(SFRform, z) * zunc) ** 2 + (diff(SFRform, Ho) * Ho_unc)**2 + (diff(SFRform, al) * alunc)**2) ** .5
 
-    # Define constants
-    Hubble = 70     # km/s/Mpc
-    Hubble_unc = 2
-    freqs = 1.51976491105  # GHz
-    freqsigs = 0
-    alphas = -0.8
-    alphasig = 0.05
+    # substitute in the constants, leaving flux, redshift and their uncertainties free
+    constants = {nu: config['freqs'], al: config['alphas'], alunc: config['alphasig'], Ho: config['Hubble'],
+                 Ho_unc: config['Hubble_unc']}
+    expressions = [Lumform, Lum_stat_unc, Lum_syst_unc, SFRform, SFR_stat_uncertainty, SFR_syst_uncertainty]
+
+    return dict((expression_names[i], str(expressions[i].subs(constants))) for i in range(len(expressions)))
+
+
+# Turn the python source of an expression into a function of numpy arrays
+def _compile(source):
+    namespace = {'sqrt': np.sqrt, 'log': np.log, 'exp': np.exp, 'Abs': np.abs, 'pi': np.pi}
+    return eval('lambda %s: %s' % (', '.join(free_symbols), source), namespace)
+
+
+# Current parameter configuration, the key of the compiled expression cache
+def current_config():
+    return {'Hubble': Hubble, 'Hubble_unc': Hubble_unc, 'freqs': freqs, 'alphas': alphas, 'alphasig': alphasig,
+            'allowthermal': bool(allowthermal), 'version': derivation_version}
+
+
+# Return the compiled expressions for the current configuration. Each configuration is derived and differentiated
+# with sympy exactly once, then kept in memory and optionally on disk as source strings keyed by its hash
+def compiled_expressions():
+    config = current_config()
+    key = Cache.config_hash(config)
+    if key in _compiled:
+        return _compiled[key]
+
+    sources = None
+    cache_file = Cache.cache_path('calcsfrs_%s.json' % key) if disk_cache else None
+    if disk_cache and os.path.exists(cache_file):
+        with open(cache_file, 'r') as f_cache:
+            stored = json.load(f_cache)
+        if stored.get('config') == config:
+            sources = stored['expressions']
+
+    if sources is None:
+        sources = derive_expressions(config)
+        if disk_cache:
+            tmp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+            with open(tmp_file, 'w') as f_cache:
+                json.dump({'config': config, 'expressions': sources}, f_cache)
+            os.rename(tmp_file, cache_file)
+
+    _compiled[key] = dict((name, _compile(sources[name])) for name in expression_names)
+    return _compiled[key]
 
-    output = []
 
-    # substitute in values into symbolic expressions
-    # SFR values
-    SF = SFRform.subs({nu: freqs, al: alphas, f: flux, z: redshift, Ho: Hubble})
-    SF_stat = SFR_stat_uncertainty.subs({nu: freqs, al: alphas, f: flux, z: redshift,
-                                            f_unc: flux_error, Ho: Hubble})
-    SF_syst = SFR_syst_uncertainty.subs({nu: freqs, al: alphas, f: flux, z: redshift, zunc: redshift_error,
-                                         alunc: alphasig, f_unc: flux_error, Ho: Hubble, Ho_unc: Hubble_unc})
-    # luminosity values
-    Lum = Lumform.subs({f: flux, z: redshift, al: alphas, Ho: Hubble})
-    Lum_stat = Lum_stat_unc.subs({f: flux, z: redshift, f_unc: flux_error, Ho: Hubble, al: alphas})
-    Lum_syst = Lum_syst_unc.subs({f: flux, z: redshift, f_unc: flux_error, zunc: redshift_error,
-                                  Ho: Hubble, Ho_unc: Hubble_unc})
-
-    output.append(Lum)
-    output.append(Lum_stat)
-    output.append(SF)
-    output.append(SF_stat)
+# Calculate a luminosity, star formation rate, and uncertainties given a flux density
+# Using equation relating synchrotron emission to star formation rate given in Murphy et. al (2011)
+# Also using Condon & Matthews (2018) to calculate spectral luminosity distance
+# Evaluates the compiled symbolic expressions, so accepts scalars or numpy arrays
+def calc_params(flux, flux_error, redshift, redshift_error):
+
+    exprs = compiled_expressions()
+    args = (flux, flux_error, redshift, redshift_error)
+
+    output = []
+    output.append(exprs['Lum'](*args))
+    output.append(exprs['Lum_stat'](*args))
+    output.append(exprs['SF'](*args))
+    output.append(exprs['SF_stat'](*args))
 
     return output
 
 
+# Numeric version of the symbolic luminosity and SFR formulas in calc_params(), evaluated for arrays of galaxies
+# Returns luminosity (erg/s/Hz), SFR (solar masses/yr), and unless derivatives is False, the logarithmic derivatives
+# of each with respect to redshift, the Hubble constant and alpha, which are all that is needed to propagate
+# uncertainties
+def _lum_sfr(flux, z, Ho, al, nu, derivatives=True):
+    # comoving distance in units of the Hubble distance, and d ln(Dc)/dz
+    if use_distance_table:
+        table = Distances.get_table('condon')
+        dc = table.hubble_comoving_distance(z)
+        dlnDc_dz = table.dln_comoving_dz(z)
+    else:
+        a = 1./(1.+z)
+        inv, dinv_da = Distances.condon_inverse_distance(a)
+        dc = 1./inv
+        # using d(inv)/dz = d(inv)/da * -a^2
+        dlnDc_dz = dinv_da*(a**2)/inv
+
+    # comoving, luminosity and spectral luminosity distances in cm
+    Dc = (c_kms/Ho)*dc*mpc_to_cm
+    Dl_nu = (1+z)*Dc*((1+z)**(-(al+1)/2.))
+    Lum = 4*np.pi*flux*(10**-23)*Dl_nu**2
+
+    if not derivatives:
+        SFR = 6.64e-29*(nu**(-al))*Lum
+        if allowthermal:
+            SFR = SFR/(1+1/13.*((1+z)*nu)**(-0.1-al))
+        return Lum, SFR
+
+    dlnL_dz = (1-al)/(1+z) + 2*dlnDc_dz
+    dlnL_dHo = -2./Ho
+    dlnL_dal = -np.log(1+z)
+
+    # SFR formula in solar masses/yr (Murphy et. al), optionally removing the thermal fraction (Tabatabaei et al.)
+    SFR = 6.64e-29*(nu**(-al))*Lum
+    dlnSFR_dz = dlnL_dz
+    dlnSFR_dal = dlnL_dal - np.log(nu)
+    if allowthermal:
+        x = (1+z)*nu
+        thermal = 1/13.*x**(-0.1-al)
+        SFR = SFR/(1+thermal)
+        dlnSFR_dz = dlnSFR_dz - thermal*(-0.1-al)/(1+z)/(1+thermal)
+        dlnSFR_dal = dlnSFR_dal + thermal*np.log(x)/(1+thermal)
+
+    return Lum, SFR, dlnL_dz, dlnL_dHo, dlnL_dal, dlnSFR_dz, dlnL_dHo, dlnSFR_dal
+
+
+# Vectorized equivalent of calc_params(). Takes arrays (or scalars) of flux densities in Jy, flux errors, redshifts and
+# redshift errors for a whole catalog and evaluates the same physics without sympy
+# Returns the luminosity, luminosity stat. error, SFR, SFR stat. error (the same order as calc_params), followed by
+# the luminosity syst. error and the SFR syst. error
+def calc_params_array(flux, flux_error, redshift, redshift_error):
+    flux = np.asarray(flux, dtype=float)
+    flux_error = np.asarray(flux_error, dtype=float)
+    z = np.asarray(redshift, dtype=float)
+    zunc = np.asarray(redshift_error, dtype=float)
+
+    # luminosity and SFR per Jy, which are also the derivatives with respect to flux
+    Lum_per_jy, SF_per_jy, dlnL_dz, dlnL_dHo, dlnL_dal, dlnSFR_dz, dlnSFR_dHo, dlnSFR_dal = _lum_sfr(1., z, Hubble, alphas, freqs)
+    Lum = Lum_per_jy*flux
+    SF = SF_per_jy*flux
+
+    # simple error propagation
+    Lum_stat = np.abs(Lum_per_jy*flux_error)
+    Lum_syst = np.abs(Lum)*np.sqrt((dlnL_dz*zunc)**2 + (dlnL_dHo*Hubble_unc)**2)
+    SF_stat = np.abs(SF_per_jy*flux_error)
+    SF_syst = np.abs(SF)*np.sqrt((dlnSFR_dz*zunc)**2 + (dlnSFR_dHo*Hubble_unc)**2 + (dlnSFR_dal*alphasig)**2)
+
+    return [Lum, Lum_stat, SF, SF_stat, Lum_syst, SF_syst]
+
+
+# Monte Carlo alternative to the first-order error propagation above, which breaks down for faint sources.
+# For each galaxy, draws nsamples values of flux, redshift, Hubble constant and alpha from normal distributions, and
+# evaluates the same formulas as calc_params_array() on all of them at once. Galaxies are processed in chunks so that
+# no more than mc_max_elements samples are held in memory. NaN errors (e.g. upper limits) are treated as zero
+# Returns arrays of the luminosity and SFR at the requested percentiles, each with shape (galaxies, percentiles)
+def calc_params_mc(flux, flux_error, redshift, redshift_error, nsamples=None, percentiles=(16., 50., 84.),
+                   seed=None):
+    if nsamples is None:
+        nsamples = mc_samples
+    flux = np.atleast_1d(np.asarray(flux, dtype=float))
+    flux_error = np.nan_to_num(np.atleast_1d(np.asarray(flux_error, dtype=float)) * np.ones_like(flux))
+    z = np.atleast_1d(np.asarray(redshift, dtype=float)) * np.ones_like(flux)
+    zunc = np.nan_to_num(np.atleast_1d(np.asarray(redshift_error, dtype=float)) * np.ones_like(flux))
+
+    random = np.random.RandomState(seed)
+    lum_pct = np.empty((len(flux), len(percentiles)))
+    sfr_pct = np.empty((len(flux), len(percentiles)))
+
+    per_chunk = max(1, int(mc_max_elements // nsamples))
+    for start in range(0, len(flux), per_chunk):
+        chunk = slice(start, start + per_chunk)
+        shape = (len(flux[chunk]), nsamples)
+
+        # draw every sample for the chunk in one go, galaxies along the first axis
+        f_draw = flux[chunk][:, None] + flux_error[chunk][:, None]*random.standard_normal(shape)
+        z_draw = z[chunk][:, None] + zunc[chunk][:, None]*random.standard_normal(shape)
+        Ho_draw = Hubble + Hubble_unc*random.standard_normal(shape)
+        al_draw = alphas + alphasig*random.standard_normal(shape)
+
+        Lum, SFR = _lum_sfr(f_draw, z_draw, Ho_draw, al_draw, freqs, derivatives=False)
 
+        lum_pct[chunk] = np.transpose(np.percentile(Lum, percentiles, axis=1))
+        sfr_pct[chunk] = np.transpose(np.percentile(SFR, percentiles, axis=1))
 
+    return lum_pct, sfr_pct
@@ -7,7 +7,10 @@
 
 
 import os
+import argparse
+import multiprocessing
 import numpy as np
+from multiprocessing.pool import ThreadPool
 from astropy.table import Table, Column
 from astropy.io import fits
 import CalcSFRs
@@ -25,6 +28,13 @@ import WISE
 reload(WISE)
 import Templates
 reload(Templates)
+import GaussFit
+reload(GaussFit)
+import ImageAccess
+import Measurements
+import Cache
+import TemplateLibrary
+import WiseGrid
 
 #######################################################################
 # parameters
@@ -32,6 +42,9 @@ reload(Templates)
 # Toggle whether to use aperture photometry or to retrieve imfit results for flux measurements
 get_imfits = True
 
+# Fit the sources in-process with GaussFit rather than reading the CASA imfit summary logs
+native_fit = False
+
 # Name of data table containing source list with RAs, Decs, IR SFRs, etc. Might need to delete columns by hand prior
 table_name = 'VLAsample.csv'
 
@@ -40,251 +53,426 @@ table_name = 'VLAsample.csv'
 wise_colors = True
 
 template_colors = True
+
+# Add 16th/84th percentile SFRs from Monte Carlo error propagation (CalcSFRs.calc_params_mc) for detections
+mc_errors = False
+
+# Number of galaxies measured at once in a pool of threads (1 measures them one after another)
+threads = 1
+
+# Number of worker processes measuring galaxies (1 measures them in this process, with the threads above)
+jobs = 1
+
+# Reuse the rows of galaxies whose inputs haven't changed since the last build, instead of measuring them again
+incremental = True
+
+# Signal to noise a source needs to count as a detection (geometric mean of the imfit flux and peak over the rms, or
+# the aperture flux over its error and the maximum pixel over the rms)
+detection_sigma = 3.
+
+# Upper limits of non-detections, in units of the image rms
+upper_limit_sigma = 3.
 #######################################################################
 
-start_dir = os.getcwd()
-
-# Read in data table given to me by collaboration
-t = Table.read(table_name)
-
-# Append columns to table for new data
-a = np.empty(len(t))
-a[:] = np.nan
-b = np.zeros(len(t))
-t['data'], t['21 cm Flux'], t['21 cm Flux Error'], t['Luminosity'], t['Luminosity Error (stat.)'], \
-t['21 cm SFR'], t['21 cm SFR Error (stat.)'],  t['RMS'], t['w1-w2'], \
-t['w3-w4'], t['w2-w3'], t['MySFR'], t['MySFR Err'], \
-t['q'], t['W3'], t['W3_err'], t['W4'], t['W4_err'] = b, a, a, a, a, a, a, a, a, a, a, a, a, a, a, a, a, a
-
-# Optional toggle to retrieve data from imfit logs
-if get_imfits:
-	t['imfit max'], t['imfit max_err'], t['aper flux err/imfit err'], t['geo_mean/rms'], t['detect'] = a, a, a, a, a
-	t['imfit max'].unit = 'Jy/beam'
-	t['imfit max_err'].unit = 'Jy/beam'
-else:
-	t['detect_aper'], t['detect_pix'], t['Max/noise aper'], t['Flux/error aper'], \
-	t['Npixperbeam'], t['Nbeams'], t['MaxValue aper'] = a, a, a, a, a, a, a
-	t['MaxValue aper'].unit = 'Jy/beam'
-
-# Defining units of each column
-t['RA (J2000)'].unit = 'deg'
-t['Dec (J2000)'].unit = 'deg'
-t['IR SFR'].unit = 'solMass/yr'
-t['IR Luminosity'].unit = 'solLum'
-t['21 cm Flux'].unit = 'Jy'
-t['21 cm Flux Error'].unit = 'Jy'
-t['Luminosity'].unit = 'erg/(s*Hz)'
-t['Luminosity Error (stat.)'].unit = 'erg/(s*Hz)'
-t['21 cm SFR'].unit = 'solMass/yr'
-t['21 cm SFR Error (stat.)'].unit = 'solMass/yr'
-t['RMS'].unit = 'Jy/beam'
-t['W3'].unit = 'Jy'
-t['W4'].unit = 'Jy'
-t['W3_err'].unit = 'Jy'
-t['W4_err'].unit = 'Jy'
-
-
-names = GetGalaxyList.return_galaxy_list()
-templateSFRratio = []
-
-# Go to each galaxy, call photometry and calculate SFRs scripts, and add the outputs to the table
-for name in names:
-
-	# If the name exists in my directory, set data flag to true, get index in table
-	idx = np.where(t['Name'] == name)[0]
-	t['data'][idx] = True
-
-
-	"""if test_temps:
-		#short_name = name[:5]
-		#wisefluxes = WISE.mag_to_flux(short_name)
-		#twelve_lum = (CalcSFRs.calc_params(wisefluxes[0], 0, t['Z'][idx], 0)[0])/(10**7)
-		#twent_lum = (CalcSFRs.calc_params(wisefluxes[1], 0, t['Z'][idx], 0)[0])/(10**7)
-		lum_syst = Templates.test_templates(t['Z'][idx])
-		#t['IR Error syst.'][idx] = lum_syst
-		#t['IR Error Chary'][idx] = Templates.chary_elbaz(t['Z'][idx])"""
+
+# Read in data table given to me by collaboration, and append empty columns for new data
+def new_table(table_name):
+	t = Table.read(table_name)
+
+	# Append columns to table for new data
+	a = np.empty(len(t))
+	a[:] = np.nan
+	b = np.zeros(len(t))
+	t['data'], t['21 cm Flux'], t['21 cm Flux Error'], t['Luminosity'], t['Luminosity Error (stat.)'], \
+	t['21 cm SFR'], t['21 cm SFR Error (stat.)'],  t['RMS'], t['w1-w2'], \
+	t['w3-w4'], t['w2-w3'], t['MySFR'], t['MySFR Err'], \
+	t['q'], t['W3'], t['W3_err'], t['W4'], t['W4_err'] = b, a, a, a, a, a, a, a, a, a, a, a, a, a, a, a, a, a
+
+	# Optional toggle to retrieve data from imfit logs
+	if get_imfits:
+		t['imfit max'], t['imfit max_err'], t['aper flux err/imfit err'], t['geo_mean/rms'], t['detect'] = a, a, a, a, a
+		# whether the fit succeeded, used by finish_table and then removed
+		t['fitted'] = b
+		t['imfit max'].unit = 'Jy/beam'
+		t['imfit max_err'].unit = 'Jy/beam'
+	else:
+		t['detect_aper'], t['detect_pix'], t['Max/noise aper'], t['Flux/error aper'], \
+		t['Npixperbeam'], t['Nbeams'], t['MaxValue aper'] = a, a, a, a, a, a, a
+		t['MaxValue aper'].unit = 'Jy/beam'
+
+	# Defining units of each column
+	t['RA (J2000)'].unit = 'deg'
+	t['Dec (J2000)'].unit = 'deg'
+	t['IR SFR'].unit = 'solMass/yr'
+	t['IR Luminosity'].unit = 'solLum'
+	t['21 cm Flux'].unit = 'Jy'
+	t['21 cm Flux Error'].unit = 'Jy'
+	t['Luminosity'].unit = 'erg/(s*Hz)'
+	t['Luminosity Error (stat.)'].unit = 'erg/(s*Hz)'
+	t['21 cm SFR'].unit = 'solMass/yr'
+	t['21 cm SFR Error (stat.)'].unit = 'solMass/yr'
+	t['RMS'].unit = 'Jy/beam'
+	t['W3'].unit = 'Jy'
+	t['W4'].unit = 'Jy'
+	t['W3_err'].unit = 'Jy'
+	t['W4_err'].unit = 'Jy'
+	return t
+
+
+# Call photometry and fitting scripts for one galaxy, given its redshift and error as selected from the table.
+# Returns a dictionary of column name: value for the galaxy's row, holding the measured fluxes; detections, upper
+# limits, SFRs and rounding are applied to the whole table afterwards by finish_table. Keys starting with an underscore
+# are kept with the row but are not table columns. Only the galaxy's own directory is touched, so galaxies can be
+# measured concurrently
+def measure_galaxy(name, z, z_err, galaxy_dir=None):
+
+	if galaxy_dir is None:
+		galaxy_dir = GetGalaxyList.galaxy_dir(name)
+
+	# The name exists in my directory, set data flag to true
+	row = {'data': True}
 
 	WISEfluxes = WISE.mag_to_flux(name[:5])
-	t['W3'][idx] = round(WISEfluxes[0], 6)
-	t['W4'][idx] = round(WISEfluxes[1], 5)
-	t['W3_err'][idx] = round(WISEfluxes[2], 7)
-	t['W4_err'][idx] = round(WISEfluxes[3], 6)
+	row['W3'] = WISEfluxes[0]
+	row['W4'] = WISEfluxes[1]
+	row['W3_err'] = WISEfluxes[2]
+	row['W4_err'] = WISEfluxes[3]
 
 	if wise_colors:
 		colors = WISE.colors(name[:5])
-	t['w1-w2'][idx] = colors[0]
-	t['w3-w4'][idx] = colors[1]
-	t['w2-w3'][idx] = colors[2]
+		row['w1-w2'] = colors[0]
+		row['w3-w4'] = colors[1]
+		row['w2-w3'] = colors[2]
 
 	# Call photometry script, returning flux and error, as well as other parameters
-	flux_measured = MeasureFluxes.photometry(name, True)
+	flux_measured = MeasureFluxes.photometry(name, True, galaxy_dir)
 
-	Flux = 0
-	Flux_error = 0
 	img_rms = flux_measured[2]
-
-	t['RMS'][idx] = round(img_rms, 8)
+	row['RMS'] = img_rms
 
 	# Retrieve parameters derived by imfit to compare to our estimates
 	if get_imfits:
 		try:
-			imfitpars = ReturnImfitPars.get_imfit(name)
-			Flux = float(imfitpars[0])
-			Flux_error = float(imfitpars[1])
-
-			t['imfit max'][idx] = imfitpars[2]
-			t['imfit max_err'][idx] = imfitpars[3]
-			t['aper flux err/imfit err'][idx] = float(flux_measured[1]) / float(imfitpars[1])
-			t['geo_mean/rms'][idx] = np.sqrt(Flux * float(imfitpars[2])) / img_rms
-
-			if t['geo_mean/rms'][idx] > 3 and Flux > 0:
-				t['detect'][idx] = True
+			if native_fit:
+				imfitpars = GaussFit.get_fit(name, galaxy_dir)
 			else:
-				t['detect'][idx] = False
-
-
-			if t['detect'][idx]:
-				t['21 cm Flux'][idx] = round(Flux, 6)
-				t['21 cm Flux Error'][idx] = round(Flux_error, 7)
-			else:
-				t['21 cm Flux'][idx] = round(3*img_rms, 6)
-				t['21 cm Flux Error'][idx] = np.nan
-
-		except:
-			print('failed')
-			os.chdir('..')
-	else:
-		# Set elements in table equal to results from photometry. Apply sig figs if desired
-		Flux = flux_measured[0]
-		Flux_error = flux_measured[1]
-		t['Npixperbeam'][idx] = flux_measured[3]
-		t['Nbeams'][idx] = flux_measured[4]
-		t['MaxValue aper'][idx] = flux_measured[5]
-
-		t['21 cm Flux'][idx] = Flux
-		t['21 cm Flux Error'][idx] = Flux_error
-
-	with open((name + '/text/max.txt'), 'w') as f_max:
-		f_max.write('%s' % float(flux_measured[5]))
-
-	if not get_imfits:
-		t['Max/noise aper'][idx] = flux_measured[6]
-		t['Flux/error aper'][idx] = flux_measured[7]
-
-		# If flux is a 3 sigma result, count as detection
-		if flux_measured[0] > 3*flux_measured[1]:
-			t['detect_aper'][idx] = True
-		else: t['detect_aper'][idx] = False
-
-		# If maximum pixel value is a 3 sigma result, count as detection
-		if flux_measured[6] > 3:
-			t['detect_pix'][idx] = True
-		else: t['detect_pix'][idx] = False
-		detection = t['detect_aper'][idx] and t['detect_pix'][idx]
-	else:
-		detection = t['detect'][idx]
+				imfitpars = ReturnImfitPars.get_imfit(name, galaxy_dir)
+			Flux = float(imfitpars[0])
 
-	# If both previous detection criteria are met, the galaxy is deemed a detection, calculate a SFR and Luminosity
-	if detection:
-		params_measured = CalcSFRs.calc_params(Flux, Flux_error, t['Z'][idx], t['Z_err'][idx])
-		os.chdir(name)
-		with open('text/detect.txt', 'w') as f:
-			f.write('%s' % 1)
-		os.chdir('..')
+			row['21 cm Flux'] = Flux
+			row['21 cm Flux Error'] = float(imfitpars[1])
+			row['imfit max'] = imfitpars[2]
+			row['imfit max_err'] = imfitpars[3]
+			row['aper flux err/imfit err'] = float(flux_measured[1]) / float(imfitpars[1])
+			row['geo_mean/rms'] = np.sqrt(Flux * float(imfitpars[2])) / img_rms
+			row['fitted'] = 1
 
-	# If galaxy is not detected, calculate a SFR and luminosity with 3x the image rms to give an upper limit
+		except (IOError, OSError, KeyError, ValueError) as e:
+			print('%s failed: %s' % (name, e))
 	else:
-		params_measured = CalcSFRs.calc_params(3*img_rms, np.nan, t['Z'][idx], t['Z_err'][idx])
-		os.chdir(name)
-		with open('text/detect.txt', 'w') as f:
-			f.write('%s' % 0)
-		os.chdir('..')
-
-	# Enter calculated SFRs and luminosities to table
-	lumin = float(params_measured[0])
-	t['Luminosity'][idx] = round(params_measured[0], -28)
-	t['Luminosity Error (stat.)'][idx] = round(params_measured[1], -28)
-	t['21 cm SFR'][idx] = round(params_measured[2], 1)
-	t['21 cm SFR Error (stat.)'][idx] = round(params_measured[3], 1)
-
-	newSFR = Templates.IR_SFRs(t['Z'][idx], name[:5])
-	t['MySFR'][idx] = round(float(newSFR[0]), 1)
-	t['MySFR Err'][idx] = round(float(newSFR[1]), 1)
-	sfr_to_lum = 1/(3.88e-37)
-	irlum = float(newSFR[0])*sfr_to_lum
-	# extrapolates our 1.519GHz observation to 1.4 GHz using alphaNT = -0.8
-	lum_14 = lumin*1.0674
-	q = np.log10((irlum/3.75e12)/(lum_14/1.e7))
-	t['q'][idx] = round(q, 3)
+		# Set elements in table equal to results from photometry
+		row['Npixperbeam'] = flux_measured[3]
+		row['Nbeams'] = flux_measured[4]
+		row['MaxValue aper'] = flux_measured[5]
+		row['Max/noise aper'] = flux_measured[6]
+		row['Flux/error aper'] = flux_measured[7]
 
+		row['21 cm Flux'] = flux_measured[0]
+		row['21 cm Flux Error'] = flux_measured[1]
 
+	# stored as the galaxy's max measurement by store_maxima, for reused rows as well as measured ones
+	row['_max'] = float(flux_measured[5])
 
+	newSFR = Templates.IR_SFRs(z, name[:5])
+	row['MySFR'] = float(newSFR[0])
+	row['MySFR Err'] = float(newSFR[1])
 
+	return row
 
 
+# Whether each galaxy of a finished table counts as a detection (a galaxy whose imfit failed has no detect value, NaN
+# in the table, which counts as one)
+def detections(t):
+	if get_imfits:
+		return np.array(t['detect'] != 0)
+	return np.array((t['detect_aper'] == 1) & (t['detect_pix'] == 1))
+
+
+# Decide which galaxies of a table of measurements (rows entered by fill_table) are detections, replace the fluxes of
+# the rest with upper limits, and fill in the luminosities, SFRs and q of all of them, then round the columns, each a
+# whole column at a time
+def finish_table(t):
+	rms = np.array(t['RMS'], dtype=float)
+	flux = np.array(t['21 cm Flux'], dtype=float)
+	flux_err = np.array(t['21 cm Flux Error'], dtype=float)
+	limit = upper_limit_sigma*rms
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		if get_imfits:
+			fitted = np.array(t['fitted']) == 1
+			detect = fitted & (np.array(t['geo_mean/rms'], dtype=float) > detection_sigma) & (flux > 0)
+			t['detect'][:] = np.where(fitted, detect, np.nan)
+			t['21 cm Flux'][:] = np.where(detect, np.round(flux, 6), np.where(fitted, np.round(limit, 6), np.nan))
+			t['21 cm Flux Error'][:] = np.where(detect, np.round(flux_err, 7), np.nan)
+			# the SFR of a galaxy whose fit failed is computed from a flux of zero
+			flux = np.where(fitted, flux, 0.)
+			flux_err = np.where(fitted, flux_err, 0.)
+			t.remove_column('fitted')
+		else:
+			# If flux is a detection_sigma result, count as detection
+			t['detect_aper'][:] = flux > detection_sigma*flux_err
+			# If maximum pixel value is a detection_sigma result, count as detection
+			t['detect_pix'][:] = np.array(t['Max/noise aper'], dtype=float) > detection_sigma
+		detection = detections(t)
+
+		# Detections get a SFR and luminosity from their flux, the rest an upper limit from upper_limit_sigma x rms
+		params_measured = CalcSFRs.calc_params_array(np.where(detection, flux, limit),
+													np.where(detection, flux_err, np.nan), t['Z'], t['Z_err'])
+
+		sfr_to_lum = 1/(3.88e-37)
+		irlum = np.array(t['MySFR'], dtype=float)*sfr_to_lum
+		# extrapolates our 1.519GHz observation to 1.4 GHz using alphaNT = -0.8
+		lum_14 = params_measured[0]*1.0674
+		t['q'][:] = np.round(np.log10((irlum/3.75e12)/(lum_14/1.e7)), 3)
+
+	t['Luminosity'][:] = np.round(params_measured[0], -28)
+	t['Luminosity Error (stat.)'][:] = np.round(params_measured[1], -28)
+	t['21 cm SFR'][:] = np.round(params_measured[2], 1)
+	t['21 cm SFR Error (stat.)'][:] = np.round(params_measured[3], 1)
+
+	for col, decimals in [('W3', 6), ('W4', 5), ('W3_err', 7), ('W4_err', 6), ('RMS', 8), ('MySFR', 1),
+							('MySFR Err', 1)]:
+		t[col][:] = np.round(np.array(t[col], dtype=float), decimals)
+	return t
+
+
+# Record whether each galaxy of a finished table was detected, as its detect measurement (only those that changed)
+def store_detections(t):
+	stored = Measurements.load_sample(list(t['Name']))
+	for name, detected in zip(t['Name'], detections(t)):
+		if stored.get(name, {}).get('detect') != [int(detected)]:
+			Measurements.put(name, 'detect', int(detected))
+
+
+# Record the maximum of each galaxy's row, as its max measurement (only those that changed)
+def store_maxima(names, rows):
+	stored = Measurements.load_sample(list(names))
+	for name, row in zip(names, rows):
+		if stored.get(name, {}).get('max') != [row['_max']]:
+			Measurements.put(name, 'max', row['_max'])
+
+
+# Parameters measure_galaxy depends on, handed to worker processes so they measure the same way as this one
+def _settings():
+	return {'get_imfits': get_imfits, 'native_fit': native_fit, 'wise_colors': wise_colors}
+
+
+# Measure one galaxy in a worker process. task is (name, z, z_err, settings)
+def _measure_task(task):
+	name, z, z_err, settings = task
+	globals().update(settings)
+	return measure_galaxy(name, z, z_err)
+
+
+# bump when the way a row is computed changes, so that every galaxy is measured again
+row_version = 3
+
+
+def _file_stamp(path):
+	if not os.path.exists(path):
+		return None
+	return [path, os.path.getmtime(path), os.path.getsize(path)]
+
+
+# Configuration every row depends on besides the galaxy's own inputs: the settings of this script, of the photometry
+# and Gaussian fitting, of the radio SFR calculation, and the template library and WISE grid
+def _shared_config():
+	return {'version': row_version, 'settings': _settings(), 'sfr': CalcSFRs.current_config(),
+			'photometry': [MeasureFluxes.cell_size, MeasureFluxes.aperture_size, MeasureFluxes.bkgd_subtract,
+							MeasureFluxes.make_growth_curves],
+			'fit': [list(GaussFit.box), GaussFit.fix_width, GaussFit.find_source, GaussFit.allow_resolved,
+					list(GaussFit.resolved_list)],
+			'templates': [TemplateLibrary.get_library().fingerprint, Templates.use_wise_grid, WiseGrid.grid_version,
+							WiseGrid.z_min, WiseGrid.z_max, WiseGrid.z_step,
+							[_file_stamp(path) for path in WiseGrid.bandpass_files]]}
+
+
+# Fingerprint of everything a galaxy's row is computed from: its cutout and HST images, the noise and beam measured
+# from the cutout, its imfit summary, its unWISE photometry, its redshift, and the shared configuration
+def row_fingerprint(name, z, z_err, shared, galaxy_dir=None):
+	if galaxy_dir is None:
+		galaxy_dir = GetGalaxyList.galaxy_dir(name)
+	files = [ImageAccess.cutout_path(name, galaxy_dir), ImageAccess.hst_path(name, galaxy_dir),
+			Measurements.text_path(name, 'stdev', galaxy_dir), Measurements.text_path(name, 'beamarea', galaxy_dir),
+			WISE.unwise_path(name[:5])]
+	if get_imfits and not native_fit:
+		files.append(os.path.join(galaxy_dir, 'summary.log'))
+	return Cache.config_hash({'shared': shared, 'z': [float(v) for v in z], 'z_err': [float(v) for v in z_err],
+							'files': [_file_stamp(path) for path in files]})
+
+
+# Rows of previous builds, keyed by galaxy name: (fingerprint, row)
+def _load_rows():
+	cache_file = Cache.cache_path('construct_rows.pkl')
+	if not os.path.exists(cache_file):
+		return {}
+	with open(cache_file, 'rb') as f:
+		return pickle.load(f)
+
+
+def _save_rows(rows):
+	cache_file = Cache.cache_path('construct_rows.pkl')
+	tmp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+	with open(tmp_file, 'wb') as f:
+		pickle.dump(rows, f, protocol=2)
+	os.rename(tmp_file, cache_file)
+
+
+# Measure every galaxy in names, n_jobs processes or n_threads threads at a time, entering the results into their rows
+# of the table. The rows are entered in the order of names whatever order the galaxies finish in, so the table is the
+# same however it was built. With reuse, galaxies whose inputs have the same fingerprint as when they were last
+# measured get their previous row instead
+def fill_table(t, names, n_threads=1, n_jobs=1, reuse=None):
+	if reuse is None:
+		reuse = incremental
+	idxs = [np.where(t['Name'] == name)[0] for name in names]
+
+	shared = _shared_config()
+	fingerprints = [row_fingerprint(names[i], t['Z'][idxs[i]], t['Z_err'][idxs[i]], shared) for i in range(len(names))]
+	previous = _load_rows()
+	todo = [i for i in range(len(names)) if not reuse or previous.get(names[i], (None,))[0] != fingerprints[i]]
+	print('Measuring %s of %s galaxies, the rest are unchanged' % (len(todo), len(names)))
+
+	def measure(i):
+		return measure_galaxy(names[i], t['Z'][idxs[i]], t['Z_err'][idxs[i]])
+
+	if n_jobs > 1 and len(todo) > 1:
+		tasks = [(names[i], t['Z'][idxs[i]], t['Z_err'][idxs[i]], _settings()) for i in todo]
+		pool = multiprocessing.Pool(n_jobs)
+		try:
+			measured = pool.map(_measure_task, tasks, chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+	elif n_threads > 1 and len(todo) > 1:
+		pool = ThreadPool(n_threads)
+		try:
+			measured = pool.map(measure, todo, chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		measured = [measure(i) for i in todo]
 
-# Filter table to contain only sources with associated data presently
-t_data = t[np.where(t['data'])[0]]
+	measured = dict(zip(todo, measured))
+	rows = [measured[i] if i in measured else previous[names[i]][1] for i in range(len(names))]
+	for i in todo:
+		previous[names[i]] = (fingerprints[i], measured[i])
+	_save_rows(previous)
+	store_maxima(names, rows)
 
-print(t_data['Name', 'Z', 'IR SFR', 'IR SFR Err', '21 cm Flux', '21 cm Flux Error', 'Luminosity', 'Luminosity Error (stat.)', '21 cm SFR', '21 cm SFR Error (stat.)'])
+	for idx, row in zip(idxs, rows):
+		for col in row:
+			if not col.startswith('_'):
+				t[col][idx] = row[col]
+	return t
 
-t_non_agn = t_data[np.where(t_data['21 cm SFR'] < 1000.)[0]]
-print(np.median(t_non_agn['21 cm SFR']))
-print(np.mean(t_non_agn['21 cm SFR']))
 
-os.chdir(start_dir)
-t_data.write('table.csv', format='csv', overwrite=True)
-# write out table in tex format
-t_data['Name', 'Z', '21 cm Flux', '21 cm Flux Error', 'Luminosity', 'Luminosity Error (stat.)', '21 cm SFR', '21 cm SFR Error (stat.)', 'W3', 'W3_err', 'W4', 'W4_err', 'MySFR', 'MySFR Err'].write('textable', format='aastex', overwrite=True)
+# Noise and beam of one galaxy's image, as entered in the observation table
+def obs_stats(name, galaxy_dir=None):
+	std_dev = Measurements.get_value(name, 'stdev', galaxy_dir=galaxy_dir)  # Jy/beam
+	bmaj, bmin, angle = ImageAccess.beam(ImageAccess.cutout_path(name, galaxy_dir))
 
+	std_dev = round((std_dev*(10**6)), 1)
+	bmaj = round((bmaj*3600), 1)
+	bmin = round((bmin*3600), 1)
+	angle = round(angle, 1)
+	return std_dev, bmaj, bmin, angle
+
+
+# Build the table of every galaxy in names (default, all in the data directory) from the sample table, keeping only
+# the galaxies with data
+def build_table(sample_table=None, names=None, n_threads=None, n_jobs=None, reuse=None):
+	if sample_table is None:
+		sample_table = table_name
+	if names is None:
+		names = GetGalaxyList.return_galaxy_list()
+	# pick up the noise and beam measurements CASA has written since the last build
+	Measurements.import_sample(names)
+	t = new_table(sample_table)
+
+	# Go to each galaxy, call photometry and calculate SFRs scripts, and add the outputs to the table
+	fill_table(t, names, threads if n_threads is None else n_threads, jobs if n_jobs is None else n_jobs, reuse)
+
+	# Filter table to contain only sources with associated data presently
+	t_data = t[np.where(t['data'])[0]]
+
+	# Detections, upper limits and SFRs of every galaxy at once
+	finish_table(t_data)
+	store_detections(t_data)
+
+	# Percentile SFR intervals from Monte Carlo sampling, for all detections at once
+	if mc_errors:
+		mc_empty = np.empty(len(t_data))
+		mc_empty[:] = np.nan
+		t_data['21 cm SFR (MC 16%)'], t_data['21 cm SFR (MC 84%)'] = mc_empty, mc_empty
+		t_data['21 cm SFR (MC 16%)'].unit = 'solMass/yr'
+		t_data['21 cm SFR (MC 84%)'].unit = 'solMass/yr'
+		mc_idxs = np.where(detections(t_data))[0]
+		mc_sfrs = CalcSFRs.calc_params_mc(t_data['21 cm Flux'][mc_idxs], t_data['21 cm Flux Error'][mc_idxs],
+											t_data['Z'][mc_idxs], t_data['Z_err'][mc_idxs])[1]
+		t_data['21 cm SFR (MC 16%)'][mc_idxs] = np.round(mc_sfrs[:, 0], 1)
+		t_data['21 cm SFR (MC 84%)'][mc_idxs] = np.round(mc_sfrs[:, 2], 1)
+	return t_data
+
+
+# Write out the table in csv and tex format, and as a FITS binary table (table.fits), which keeps the column types and
+# units and is what MakePlots.py reads
+def write_tables(t_data):
+	print(t_data['Name', 'Z', 'IR SFR', 'IR SFR Err', '21 cm Flux', '21 cm Flux Error', 'Luminosity', 'Luminosity Error (stat.)', '21 cm SFR', '21 cm SFR Error (stat.)'])
+
+	t_non_agn = t_data[np.where(t_data['21 cm SFR'] < 1000.)[0]]
+	print(np.median(t_non_agn['21 cm SFR']))
+	print(np.mean(t_non_agn['21 cm SFR']))
+
+	t_data.write('table.csv', format='csv', overwrite=True)
+	t_data.write('table.fits', format='fits', overwrite=True)
+	# write out table in tex format
+	t_data['Name', 'Z', '21 cm Flux', '21 cm Flux Error', 'Luminosity', 'Luminosity Error (stat.)', '21 cm SFR', '21 cm SFR Error (stat.)', 'W3', 'W3_err', 'W4', 'W4_err', 'MySFR', 'MySFR Err'].write('textable', format='aastex', overwrite=True)
 
 
 ####################################################
 # make observation stats table
 ####################################################
-names = GetGalaxyList.return_galaxy_list()
-
-t_obs = Table([t_data['Name']])
-
-c = np.zeros(len(t_obs))
-
-t_obs['rms'], t_obs['Bmaj'], t_obs['Bmin'], t_obs['PA'] = c, c, c, c
+def write_obs_table(t_data, names):
+	t_obs = Table([t_data['Name']])
 
-t_obs['rms'].unit = 'uJy/beam'
-t_obs['Bmaj'].unit = 'arcsec'
-t_obs['Bmin'].unit = 'arcsec'
-t_obs['PA'].unit = 'deg'
+	c = np.zeros(len(t_obs))
 
+	t_obs['rms'], t_obs['Bmaj'], t_obs['Bmin'], t_obs['PA'] = c, c, c, c
 
-for name in names:
-	
-	os.chdir(name)
-	idx = np.where(t_obs['Name'] == name)[0]
-	with open('text/stdev.txt', 'r') as f:
-		std_dev = float(f.readline())  # Jy/beam
+	t_obs['rms'].unit = 'uJy/beam'
+	t_obs['Bmaj'].unit = 'arcsec'
+	t_obs['Bmin'].unit = 'arcsec'
+	t_obs['PA'].unit = 'deg'
 
-	imgname = '%s.cutout.pbcor.fits' % name
-	hdu = fits.open(imgname)
-	bmaj = hdu[0].header['bmaj']
-	bmin = hdu[0].header['bmin']
-	angle = hdu[0].header['bpa']
-	
-
-	std_dev = round((std_dev*(10**6)), 1)
-	bmaj = round((bmaj*3600), 1)
-	bmin = round((bmin*3600), 1)
-	angle = round(angle, 1)
+	for name in names:
+		idx = np.where(t_obs['Name'] == name)[0]
+		t_obs['rms'][idx], t_obs['Bmaj'][idx], t_obs['Bmin'][idx], t_obs['PA'][idx] = obs_stats(name)
 
+	t_obs.write('obs_table.csv', format='csv', overwrite=True)
+	t_obs.write('obs_tex', format='aastex', overwrite=True)
 
 
-	t_obs['rms'][idx] = std_dev
-	t_obs['Bmaj'][idx] = bmaj
-	t_obs['Bmin'][idx] = bmin
-	t_obs['PA'][idx] = angle
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Measure every galaxy and build table.csv and obs_table.csv')
+	parser.add_argument('--jobs', type=int, default=jobs, help='number of worker processes measuring galaxies')
+	parser.add_argument('--threads', type=int, default=threads, help='number of galaxies measured at once in each process')
+	parser.add_argument('--table', default=table_name, help='data table of the sample (default %s)' % table_name)
+	parser.add_argument('--rebuild', action='store_true', help='measure every galaxy, even those that are unchanged')
+	args = parser.parse_args()
 
-	os.chdir('..')
-	
-os.chdir(start_dir)
-t_obs.write('obs_table.csv', format='csv', overwrite=True)
-t_obs.write('obs_tex', format='aastex', overwrite=True)
-	
+	names = GetGalaxyList.return_galaxy_list()
+	t_data = build_table(args.table, names, args.threads, args.jobs, False if args.rebuild else None)
+	write_tables(t_data)
+	write_obs_table(t_data, names)
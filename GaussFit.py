@@ -0,0 +1,153 @@
+#
+# Description: In-process 2-D Gaussian fitting of the central source in each galaxy's *.cutout.pbcor.fits image, as a
+# drop-in for the CASA imfit step (Imfit.py + imfitrun + ReturnImfitPars.py). Supports the same modes as Imfit.py:
+# a beam-shaped source of fixed position and shape ('xyabp', only the amplitude is fit, which is solved linearly),
+# or a fixed position with a free width ('xy'). The position is taken from the center_radio measurement, or from the HST
+# centroid. Errors follow Condon (1997), as imfit's do.
+#
+
+import os
+import numpy as np
+from astropy.table import Table
+from scipy.optimize import curve_fit
+import ImageAccess
+import Measurements
+import GetGalaxyList
+
+#############################################################################
+# parameters
+# fitting region, blc x, blc y, trc x, trc y in pixels (as the box given to imfit)
+box = (85, 85, 115, 115)
+fix_width = True
+find_source = True
+# fit the width of the galaxies in resolved_list even when fix_width is set ('xy' rather than 'xyabp' in imfit). Used
+# by Imfit.py for the CASA imfit scripts as well
+allow_resolved = False
+resolved_list = ['J082733.87', 'J082638.41', 'J110702.87', 'J121955.77', 'J122949.83', 'J134136.79', 'J211824.06',
+                 'J161332.52']
+#############################################################################
+
+fwhm_to_sigma = 1./(2.*np.sqrt(2.*np.log(2.)))
+
+
+# Elliptical Gaussian at pixel offsets (dx, dy) from its center. Widths are FWHMs in pixels, the position angle
+# pa (radians) is measured from north through east, and east_sign is the direction of east along the x axis
+def gaussian_2d(dx, dy, amp, major, minor, pa, east_sign=-1.):
+    along = dx*east_sign*np.sin(pa) + dy*np.cos(pa)
+    across = dx*east_sign*np.cos(pa) - dy*np.sin(pa)
+    return amp*np.exp(-(along**2/(2.*(major*fwhm_to_sigma)**2) + across**2/(2.*(minor*fwhm_to_sigma)**2)))
+
+
+# Condon (1997) signal to noise of a fitted Gaussian parameter, given the FWHMs of the source and the correlated noise
+def condon_snr(amp, rms, major, minor, noise_fwhm, alpha_major, alpha_minor):
+    rho_sq = (major*minor/(4.*noise_fwhm**2))*((1+(noise_fwhm/major)**2)**alpha_major)*\
+             ((1+(noise_fwhm/minor)**2)**alpha_minor)*(amp/rms)**2
+    return np.sqrt(rho_sq)
+
+
+# Pixel position of the source center, from the center_radio measurement or from the centroid of the HST image
+def source_center(name, galaxy_dir):
+    if find_source:
+        center = Measurements.get(name, 'center_radio', galaxy_dir=galaxy_dir)
+        return float(center[0]), float(center[1])
+    else:
+        w_hst = ImageAccess.image_wcs(ImageAccess.hst_path(name, galaxy_dir))
+        ra, dec = w_hst.all_pix2world(1199., 1199., 0)
+        trans = ImageAccess.image_wcs(ImageAccess.cutout_path(name, galaxy_dir)).all_world2pix(ra, dec, 1, 1, 0)
+        return float(trans[0]), float(trans[1])
+
+
+# Fit a Gaussian to an image (Jy/beam) at a fixed pixel position. Beam widths in pixels, pa in degrees.
+# Returns a dictionary with the integrated flux and peak (Jy, Jy/beam) with errors, and the fitted FWHMs (pixels)
+# and position angle (degrees)
+def fit_image(img, x_pix, y_pix, rms, bmaj, bmin, bpa, free_width=False, east_sign=-1., fit_box=box):
+    img = np.squeeze(np.asarray(img, dtype=float))
+    y, x = np.mgrid[fit_box[1]:fit_box[3] + 1, fit_box[0]:fit_box[2] + 1]
+    data = img[fit_box[1]:fit_box[3] + 1, fit_box[0]:fit_box[2] + 1]
+    good = np.isfinite(data)
+    dx, dy, data = (x - x_pix)[good], (y - y_pix)[good], data[good]
+    pa = np.radians(bpa)
+
+    # beam-shaped source: the model is linear in the amplitude
+    beam_model = gaussian_2d(dx, dy, 1., bmaj, bmin, pa, east_sign)
+    amp = np.sum(data*beam_model)/np.sum(beam_model**2)
+    major, minor = bmaj, bmin
+
+    if free_width:
+        def model(coords, a, maj, mino, p):
+            return gaussian_2d(coords[0], coords[1], a, maj, mino, p, east_sign)
+        try:
+            popt = curve_fit(model, np.vstack([dx, dy]), data, p0=[amp, bmaj, bmin, pa])[0]
+            amp, major, minor, pa = popt[0], abs(popt[1]), abs(popt[2]), popt[3]
+            if minor > major:
+                major, minor, pa = minor, major, pa + np.pi/2.
+        except RuntimeError:
+            pass
+
+    noise_fwhm = np.sqrt(bmaj*bmin)
+    amp_frac_err = np.sqrt(2.)/condon_snr(amp, rms, major, minor, noise_fwhm, 1.5, 1.5)
+    flux = amp*major*minor/(bmaj*bmin)
+    if free_width:
+        major_frac_err = np.sqrt(2.)/condon_snr(amp, rms, major, minor, noise_fwhm, 2.5, 0.5)
+        minor_frac_err = np.sqrt(2.)/condon_snr(amp, rms, major, minor, noise_fwhm, 0.5, 2.5)
+        flux_frac_err = np.sqrt(amp_frac_err**2 + (noise_fwhm**2/(major*minor))*(major_frac_err**2 + minor_frac_err**2))
+    else:
+        major_frac_err = minor_frac_err = 0.
+        flux_frac_err = amp_frac_err
+
+    return {'flux': flux, 'flux_err': abs(flux*flux_frac_err), 'peak': amp, 'peak_err': abs(amp*amp_frac_err),
+            'major': major, 'major_err': major*major_frac_err, 'minor': minor, 'minor_err': minor*minor_frac_err,
+            'pa': np.degrees(pa) % 180., 'x': x_pix, 'y': y_pix, 'free_width': free_width}
+
+
+# Whether the width of a galaxy's source is fit, or fixed to the beam
+def fit_width(name):
+    return (not fix_width) or (allow_resolved and name in resolved_list)
+
+
+# Fit the source in one galaxy's directory, the way Imfit.py sets up imfit. Widths are returned in arcsec
+def fit_galaxy(name, galaxy_dir=None, free_width=None):
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(name)
+    if free_width is None:
+        free_width = fit_width(name)
+    image = ImageAccess.cutout_path(name, galaxy_dir)
+    header = ImageAccess.header(image)
+    pix_scale = abs(header['cdelt2'])
+    east_sign = 1. if header['cdelt1'] > 0 else -1.
+    bmaj, bmin, bpa = ImageAccess.beam(image)
+
+    rms = Measurements.get_value(name, 'stdev', galaxy_dir=galaxy_dir)
+    x_pix, y_pix = source_center(name, galaxy_dir)
+
+    result = fit_image(ImageAccess.image_data(image), x_pix, y_pix, rms, bmaj/pix_scale, bmin/pix_scale, bpa,
+                       free_width=free_width, east_sign=east_sign)
+    for key in ['major', 'major_err', 'minor', 'minor_err']:
+        result[key] = result[key]*pix_scale*3600.
+    result['name'] = name
+    return result
+
+
+# Drop-in replacement for ReturnImfitPars.get_imfit: flux, flux error, peak and peak error, also storing the fitted
+# widths as the width measurement
+def get_fit(name, galaxy_dir=None):
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(name)
+    result = fit_galaxy(name, galaxy_dir)
+    Measurements.put(name, 'width', [result['major'], result['minor'], result['pa']], galaxy_dir)
+    return [result['flux'], result['flux_err'], result['peak'], result['peak_err']]
+
+
+# Fit every galaxy in a list, returning an astropy table with one row per galaxy
+def fit_sample(names, data_path=None):
+    if data_path is None:
+        data_path = GetGalaxyList.data_path
+    columns = ['name', 'flux', 'flux_err', 'peak', 'peak_err', 'major', 'major_err', 'minor', 'minor_err', 'pa', 'x',
+               'y', 'free_width']
+    rows = [fit_galaxy(name, os.path.join(data_path, name)) for name in names]
+    t = Table(rows=[[row[col] for col in columns] for row in rows], names=columns) if rows else Table(names=columns)
+    for col, unit in [('flux', 'Jy'), ('flux_err', 'Jy'), ('peak', 'Jy/beam'), ('peak_err', 'Jy/beam'),
+                      ('major', 'arcsec'), ('major_err', 'arcsec'), ('minor', 'arcsec'), ('minor_err', 'arcsec'),
+                      ('pa', 'deg')]:
+        t[col].unit = unit
+    return t
@@ -1,17 +1,24 @@
 import os
 
+#data_path = '/lustre/aoc/students/gpetter/imaging'
+data_path = '/Users/graysonpetter/Desktop/mac_copy'
+
+
 def return_galaxy_list():
-    #data_path = '/lustre/aoc/students/gpetter/imaging'
-    data_path = '/Users/graysonpetter/Desktop/mac_copy'
     flag_list = ['J090133.42']
 
-    # Go to directory, get list of galaxies
-    names = os.listdir(data_path)
-    os.chdir(data_path)
-    sorted_names = sorted([f for f in os.listdir(data_path) if not f.startswith('.')], key=lambda f: f.lower())
+    # Get list of galaxies (one directory each, skipping files such as the measurement store)
+    sorted_names = sorted([f for f in os.listdir(data_path) if not f.startswith('.') and
+                           os.path.isdir(os.path.join(data_path, f))], key=lambda f: f.lower())
 
     for x in range(len(flag_list)):
         if flag_list[x] in sorted_names:
             sorted_names.remove(flag_list[x])
 
     return sorted_names
+
+
+# Path to a galaxy's directory. Scripts work with these paths rather than changing into each directory, so galaxies
+# can be processed concurrently
+def galaxy_dir(name):
+    return os.path.join(data_path, name)
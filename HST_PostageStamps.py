@@ -4,11 +4,12 @@ import os
 from astropy.io import fits
 import GetGalaxyList
 reload(GetGalaxyList)
+import ImageAccess
+import Measurements
 
 
-current_dir = os.getcwd()
-
 names = GetGalaxyList.return_galaxy_list()
+Measurements.import_sample(names)
 
 # Sort by RA
 stripped_names = []
@@ -43,7 +44,7 @@ x_iter = 0
 y_iter = 0
 
 for z in range(len(sorted_names)):
-    os.chdir(sorted_names[z])
+    gal_dir = GetGalaxyList.galaxy_dir(sorted_names[z])
 
     if z % cols == 0 and z != 0:
         x_iter = 0
@@ -54,29 +55,24 @@ for z in range(len(sorted_names)):
 
     x_iter = x_iter + x_size + x_start
 
-    with open('text/detect.txt', 'r') as f:
-        truth = f.readline()
+    truth = Measurements.get_value(sorted_names[z], 'detect')
 
     if int(truth) == 1:
         weighting = 'bold'
     else:
         weighting = 'normal'
 
-    HST_name = sorted_names[z][:5] + '_HST.fits'
+    HST_name = ImageAccess.hst_path(sorted_names[z], gal_dir)
 
-    imgname = '%s.cutout.pbcor.fits' % sorted_names[z]
+    imgname = ImageAccess.cutout_path(sorted_names[z], gal_dir)
 
-    with open('text/center_HST.txt', 'r') as f_center:
-        lines = f_center.readlines()
-        HST_ra = float(lines[0])
-        HST_dec = float(lines[1])
-    with open('text/stdev.txt', 'r') as f_rms:
-	rms = float(f_rms.readline())
+    HST_ra, HST_dec = Measurements.get(sorted_names[z], 'center_HST')
+    rms = Measurements.get_value(sorted_names[z], 'stdev')
 
-    f = aplpy.FITSFigure(HST_name, figure=fig, subplot=[x, y, x_size, y_size])
+    f = aplpy.FITSFigure(ImageAccess.open_image(HST_name)[0], figure=fig, subplot=[x, y, x_size, y_size])
 
     f.show_grayscale()
-    f.show_contour(imgname, levels=[(2.*rms), (3.*rms), (6*rms), (12*rms)], alpha=1, linewidths=4., colors='cyan')
+    f.show_contour(ImageAccess.open_image(imgname)[0], levels=[(2.*rms), (3.*rms), (6*rms), (12*rms)], alpha=1, linewidths=4., colors='cyan')
     f.recenter(HST_ra, HST_dec, width=15./3600, height=15./3600)
  
     #f.add_scalebar(5./3600.)
@@ -92,9 +88,6 @@ for z in range(len(sorted_names)):
     f.add_label(0.2, 0.9, ('%s' % sorted_names[z])[:5], relative=True, weight=weighting, color='orange', size=50)
     f.set_theme('publication')
 
-    os.chdir('..')
-
-os.chdir(current_dir)
 plt.savefig('HST_Stamps.png', bbox_inches='tight', pad_inches=0)
 plt.clf()
 plt.close()
@@ -0,0 +1,105 @@
+#
+# Description: Shared access to the FITS images used throughout the pipeline (the *.cutout.pbcor.fits radio cutouts
+# and the 2400x2400 *_HST.fits images). Each file is opened once, memory mapped, and kept open in a least recently
+# used cache, so repeated requests for the same image hand out views of the same array instead of reading the file
+# again. Values derived from the headers (beam, WCS) are cached alongside. A file is reopened if it changes on disk.
+#
+
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from astropy.io import fits
+from astropy import wcs
+import GetGalaxyList
+
+#############################################################################
+# parameters
+# maximum number of files kept open at once
+max_open = 64
+#############################################################################
+
+# open files, keyed by absolute path: (modification time, HDU list, dictionary of derived values), and the process
+# they were opened in (a forked worker process reopens files rather than sharing file handles with its parent)
+_cache = OrderedDict()
+_cache_pid = os.getpid()
+_lock = threading.RLock()
+
+
+# Path to a galaxy's primary beam corrected radio cutout, in its directory (by default the one in the data directory)
+def cutout_path(name, galaxy_dir=None):
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(name)
+    return os.path.join(galaxy_dir, '%s.cutout.pbcor.fits' % name)
+
+
+# Path to the HST image in a galaxy's directory
+def hst_path(name, galaxy_dir=None):
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(name)
+    return os.path.join(galaxy_dir, '%s_HST.fits' % name[:5])
+
+
+# Cache entry of a file, opening it if it isn't open yet or has changed since
+def _entry(path):
+    global _cache_pid
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    with _lock:
+        if _cache_pid != os.getpid():
+            _cache.clear()
+            _cache_pid = os.getpid()
+        if path in _cache:
+            entry = _cache.pop(path)
+            if entry[0] == mtime:
+                _cache[path] = entry
+                return entry
+            entry[1].close()
+        entry = (mtime, fits.open(path, memmap=True), {})
+        _cache[path] = entry
+        while len(_cache) > max_open:
+            _cache.popitem(last=False)[1][1].close()
+        return entry
+
+
+# The HDU list of a file (do not close it, it is shared)
+def open_image(path):
+    return _entry(path)[1]
+
+
+def header(path, ext=0):
+    return _entry(path)[1][ext].header
+
+
+# Image data of a file, without copying it. With squeeze, the length one (Stokes, frequency) axes of the radio images
+# are dropped, giving a 2-D view
+def image_data(path, ext=0, squeeze=True):
+    data = _entry(path)[1][ext].data
+    return np.squeeze(data) if squeeze else data
+
+
+# Derived value of a file, computed by func(hdulist) the first time it is asked for
+def _derived(path, key, func):
+    mtime, hdulist, derived = _entry(path)
+    with _lock:
+        if key not in derived:
+            derived[key] = func(hdulist)
+        return derived[key]
+
+
+# Restoring beam major and minor axes and position angle, in degrees
+def beam(path):
+    return _derived(path, 'beam', lambda hdulist: (hdulist[0].header['bmaj'], hdulist[0].header['bmin'],
+                                                   hdulist[0].header['bpa']))
+
+
+# WCS of the primary HDU
+def image_wcs(path):
+    return _derived(path, 'wcs', lambda hdulist: wcs.WCS(hdulist[0]))
+
+
+# Close every open file
+def close_all():
+    with _lock:
+        while _cache:
+            _cache.popitem(last=False)[1][1].close()
@@ -0,0 +1,102 @@
+#
+# Description: Per-galaxy imaging parameters for the scripts written by generate_cleans.py, read from
+# imaging_params.csv. The 'default' row gives every parameter; other rows are named after a galaxy and override the
+# parameters they give, leaving the rest blank. The table is validated once when it is loaded, and reloaded only if
+# the file changes.
+#
+#     imsize             image size in pixels (0.2 arcsec pixels)
+#     sidelobethreshold  sidelobe threshold of the auto-multithresh masking
+#     noisethreshold     noise threshold of the auto-multithresh masking
+#     niter              maximum number of clean iterations
+#     scales             multi-scale clean scales in pixels, comma separated
+#     cutout_size        size in pixels of the cutout around the image center
+#
+
+import os
+import csv
+
+#############################################################################
+# parameters
+params_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imaging_params.csv')
+#############################################################################
+
+
+# Parsing function of each parameter
+def _scales(value):
+    return [int(scale) for scale in value.replace(' ', '').split(',') if scale != '']
+
+
+columns = [('imsize', int), ('sidelobethreshold', float), ('noisethreshold', float), ('niter', int),
+           ('scales', _scales), ('cutout_size', int)]
+
+# loaded tables, keyed by file path, along with the modification time they were loaded at
+_tables = {}
+
+
+# Check the parameters of one galaxy make sense, raising a ValueError if not
+def _validate(name, params):
+    if params['imsize'] <= 0 or params['cutout_size'] <= 0 or params['niter'] < 0:
+        raise ValueError('%s: imsize, cutout_size must be positive and niter non-negative' % name)
+    if params['cutout_size'] > params['imsize']:
+        raise ValueError('%s: cutout of %s pixels is larger than the %s pixel image' % (name, params['cutout_size'],
+                                                                                        params['imsize']))
+    if params['sidelobethreshold'] <= 0 or params['noisethreshold'] <= 0:
+        raise ValueError('%s: masking thresholds must be positive' % name)
+    if len(params['scales']) == 0 or min(params['scales']) < 0:
+        raise ValueError('%s: scales must be a list of non-negative pixel sizes' % name)
+
+
+# Read and validate a parameter table, returning a dictionary of the complete parameters of every galaxy in it,
+# keyed by name, with the defaults under 'default'
+def read_params(path):
+    with open(path, 'r') as f:
+        rows = [row for row in csv.DictReader(f) if row.get('name', '').strip()]
+    missing = [col for col, parse in columns if col not in (rows[0] if rows else {})]
+    if missing:
+        raise ValueError('%s is missing columns %s' % (path, ', '.join(missing)))
+
+    raw = {}
+    for line, row in enumerate(rows):
+        name = row['name'].strip()
+        if name in raw:
+            raise ValueError('%s: %s is listed twice' % (path, name))
+        parsed = {}
+        for col, parse in columns:
+            value = (row.get(col) or '').strip()
+            if value:
+                try:
+                    parsed[col] = parse(value)
+                except ValueError:
+                    raise ValueError('%s, row %s: bad value %r for %s of %s' % (path, line + 2, value, col, name))
+        raw[name] = parsed
+
+    if 'default' not in raw or len(raw['default']) != len(columns):
+        raise ValueError('%s needs a default row giving every parameter' % path)
+
+    table = {}
+    for name, overrides in raw.items():
+        params = dict(raw['default'])
+        params.update(overrides)
+        _validate(name, params)
+        table[name] = params
+    return table
+
+
+# The parameter table, loaded the first time it is needed and whenever the file has changed since
+def load_params(path=None):
+    if path is None:
+        path = params_file
+    mtime = os.path.getmtime(path)
+    if path not in _tables or _tables[path][0] != mtime:
+        _tables[path] = (mtime, read_params(path))
+    return _tables[path][1]
+
+
+# Imaging parameters of a galaxy (the defaults, unless it has a row of its own), along with the pixel bounds
+# 'cutout_frame' of the cutout around the image center
+def galaxy_params(name, path=None):
+    table = load_params(path)
+    params = dict(table.get(name, table['default']))
+    params['cutout_frame'] = [params['imsize']//2 - params['cutout_size']//2,
+                              params['imsize']//2 + params['cutout_size']//2]
+    return params
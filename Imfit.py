@@ -3,101 +3,100 @@ from astropy.io import fits
 from astropy import wcs
 import GetGalaxyList
 reload(GetGalaxyList)
+import GaussFit
+reload(GaussFit)
+import ImageAccess
+import Measurements
 
-current_dir = os.getcwd()
 
 ##########################################################################################
 # parameters
 fix_width = True
 find_source = True
-allow_resolved = False
-if allow_resolved:
-    resolved_list = ['J082733.87', 'J082638.41', 'J110702.87', 'J121955.77', 'J122949.83', 'J134136.79', 'J211824.06',
-            'J161332.52']
-else:
-    resolved_list = []
+# fit the sources in-process with GaussFit instead of writing CASA imfit scripts
+native_fit = False
+# (the galaxies fit with a free width when resolved sources are allowed are GaussFit.resolved_list, switched on by
+# GaussFit.allow_resolved, so that both fitters treat them the same)
 ##########################################################################################
 
+GaussFit.fix_width = fix_width
+GaussFit.find_source = find_source
+
 # Go to directory, get list of galaxies
 names = GetGalaxyList.return_galaxy_list()
+# pick up the noise measurements CASA has written since the last run
+Measurements.import_sample(names)
 paths_to_files, paths_to_dirs = [], []
 
 
+# Write the CASA imfit script of one galaxy into its directory, returning the paths to the directory and script
+def imfit_script(name, galaxy_dir=None):
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(name)
+    cutout = ImageAccess.cutout_path(name, galaxy_dir)
+
+    if find_source:
+        x_pix, y_pix = Measurements.get(name, 'center_radio', galaxy_dir=galaxy_dir)
+        w = ImageAccess.image_wcs(cutout)
+        trans = w.all_pix2world(x_pix, y_pix, 1, 1, 0)
+        Measurements.put(name, 'center_radio_wcs', [trans[0], trans[1]], galaxy_dir)
+    else:
+        # Get sky coordinates of centroid of HST image
+        w_hst = ImageAccess.image_wcs(ImageAccess.hst_path(name, galaxy_dir))
+        trans_hst = w_hst.all_pix2world(1199., 1199., 0)
+        ra, dec = trans_hst[0], trans_hst[1]
+
+        # Save centroid RA, Dec to file
+        Measurements.put(name, 'center_HST', [ra, dec], galaxy_dir)
+
+        # get pixel coordinates corresponding to HST centroid
+        w = ImageAccess.image_wcs(cutout)
+        trans = w.all_world2pix(ra, dec, 1, 1, 0)
+        x_pix, y_pix = trans[0], trans[1]
+
+    # Get beam size
+    bmaj, bmin, pa = ImageAccess.beam(cutout)
+
+    # Retrieve max and rms to feed as estimates to imfit
+    maximum = Measurements.get_value(name, 'max', galaxy_dir=galaxy_dir)
+    rms = Measurements.get_value(name, 'stdev', galaxy_dir=galaxy_dir)
+
+    if not GaussFit.fit_width(name):
+        fix_str = 'xyabp'
+        summary_str = 'fixed_summary.log'
+    else:
+        fix_str = 'xy'
+        summary_str = 'summary.log'
+
+    Measurements.put(name, 'estimates', '%s, %s, %s, %sdeg, %sdeg, %sdeg, %s' % (maximum, x_pix, y_pix, bmaj, bmin, pa,
+                                                                                fix_str), galaxy_dir)
+
+    script_path = os.path.join(galaxy_dir, 'run_imfit.py')
+    with open(script_path, 'w') as f:
+        f.write("""imfit(imagename='%s.cutout.pbcor', box='85,85,115,115', estimates = 'text/estimates.txt', 
+        logfile = 'imfit.log', append=False, residual='test_residual', 
+        model='test_model', dooff=False, rms='%sJy/beam', summary='summary.log')""" % (name, rms))
+
+    return os.path.realpath(galaxy_dir), os.path.realpath(script_path)
+
+
 def new_imfit():
 
     for name in names:
-        os.chdir(name)
-	
-	
-	if find_source:
-		with open('text/center_radio.txt', 'r') as f_center:
-			lines = f_center.readlines()
-			x_pix = float(lines[0])
-			y_pix = float(lines[1])
-		hdu_vla = fits.open('%s.cutout.pbcor.fits' % name)
-		w = wcs.WCS(hdu_vla[0])
-		trans = w.all_pix2world(x_pix, y_pix, 1, 1, 0)
-		with open('text/center_radio_wcs.txt', 'w') as f:
-			f.write('%s\n' % trans[0])
-			f.write('%s\n' % trans[1])
-	else:
-		# Get sky coordinates of centroid of HST image
-		hdu_hst = fits.open('%s_HST.fits' % name[:5])
-		w_hst = wcs.WCS(hdu_hst[0])
-		trans_hst = w_hst.all_pix2world(1199., 1199., 0)
-		ra, dec = trans_hst[0], trans_hst[1]
-
-		# Save centroid RA, Dec to file
-		with open('text/center_HST.txt', 'w') as f_center:
-		    f_center.write('%s\n' % ra)
-		    f_center.write('%s\n' % dec)
-
-		# get pixel coordinates corresponding to HST centroid
-		hdu = fits.open('%s.cutout.pbcor.fits' % name)
-		w = wcs.WCS(hdu[0])
-		trans = w.all_world2pix(ra, dec, 1, 1, 0)
-		x_pix, y_pix = trans[0], trans[1]
-
-	hdu = fits.open('%s.cutout.pbcor.fits' % name)
-
-        # Get beam size
-        bmaj = hdu[0].header['bmaj']
-        bmin = hdu[0].header['bmin']
-	pa = hdu[0].header['bpa']
-
-        # Retrieve max and rms to feed as estimates to imfit
-        with open('text/max.txt', 'r') as f_max:
-            maximum = f_max.readline()
-        with open('text/stdev.txt', 'r') as f_rms:
-            rms = f_rms.readline()
-
-        if fix_width and (name not in resolved_list):
-            fix_str = 'xyabp'
-            summary_str = 'fixed_summary.log'
-        else:
-            fix_str = 'xy'
-            summary_str = 'summary.log'
-
-        with open('text/estimates.txt', 'w') as f_est:
-            f_est.write('%s, %s, %s, %sdeg, %sdeg, %sdeg, %s' % (maximum, x_pix, y_pix, bmaj, bmin, pa, fix_str))
-
-        with open('run_imfit.py', 'w') as f:
-            paths_to_dirs.append(os.getcwd())
-            paths_to_files.append(os.path.realpath(f.name))
-
-            f.write("""imfit(imagename='%s.cutout.pbcor', box='85,85,115,115', estimates = 'text/estimates.txt', 
-            logfile = 'imfit.log', append=False, residual='test_residual', 
-            model='test_model', dooff=False, rms='%sJy/beam', summary='summary.log')""" % (name, rms))
-
-        os.chdir('..')
-
-
-new_imfit()
-
-os.chdir(current_dir)
-with open('imfitrun', 'w') as f:
-    for x in range(len(paths_to_files)):
-        f.write("""cd %s; xvfb-run -d casa -r 5.3.0-143 --nogui -c %s\n""" % (paths_to_dirs[x], paths_to_files[x]))
-
-st = os.stat('imfitrun')
-os.chmod('imfitrun', st.st_mode | 0111)
+        gal_dir, script_path = imfit_script(name)
+        paths_to_dirs.append(gal_dir)
+        paths_to_files.append(script_path)
+
+
+if native_fit:
+    fit_results = GaussFit.fit_sample(names)
+    fit_results.write('gaussfit_results.csv', format='csv', overwrite=True)
+else:
+    new_imfit()
+
+    with open('imfitrun', 'w') as f:
+        for x in range(len(paths_to_files)):
+            f.write("""cd %s; xvfb-run -d casa -r 5.3.0-143 --nogui -c %s\n""" % (paths_to_dirs[x], paths_to_files[x]))
+
+    st = os.stat('imfitrun')
+    os.chmod('imfitrun', st.st_mode | 0111)
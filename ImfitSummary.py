@@ -0,0 +1,189 @@
+#
+# Description: Parser for the summary files written by CASA imfit (summary.log in each galaxy's directory). Columns
+# are found by name from the header row rather than by position, so a change of spacing or column order can't
+# silently hand back the wrong numbers. Every fitted component is read, values are converted to Jy, Jy/beam, arcsec
+# and degrees, and checked before they are returned. A file without a recognizable header falls back to the fixed
+# positions ReturnImfitPars.py used to read.
+#
+# parse_summary reads one file, iter_components streams the components of a file one line at a time (for very large
+# logs), and read_summaries parses every galaxy's summary into one table.
+#
+
+import os
+import re
+import warnings
+import numpy as np
+from astropy.table import Table
+import GetGalaxyList
+
+#############################################################################
+# parameters
+# names the columns may go by in the header (compared ignoring case, punctuation and a trailing unit in brackets)
+column_names = {'flux': ['i', 'flux', 'fluxdensity', 'integratedflux', 'totalflux'],
+                'flux_err': ['ierr', 'errori', 'fluxerr', 'fluxerror', 'fluxdensityerr', 'integratedfluxerr'],
+                'peak': ['peak', 'peakflux', 'peakintensity', 'ipeak'],
+                'peak_err': ['peakerr', 'peakerror', 'peakfluxerr', 'peakintensityerr', 'ipeakerr'],
+                'major': ['major', 'maj', 'majoraxis', 'convolvedmajor', 'convmaj'],
+                'minor': ['minor', 'min', 'minoraxis', 'convolvedminor', 'convmin'],
+                'pa': ['pa', 'positionangle', 'convolvedpa', 'convpa']}
+# units assumed for columns which don't give one
+default_units = {'flux': 'Jy', 'flux_err': 'Jy', 'peak': 'Jy/beam', 'peak_err': 'Jy/beam', 'major': 'arcsec',
+                 'minor': 'arcsec', 'pa': 'deg'}
+# positions of the values in a data line split on single spaces, for summaries without a header
+legacy_columns = {'flux': 8, 'flux_err': 9, 'peak': 10, 'peak_err': 11, 'major': 16, 'minor': 17, 'pa': 18}
+#############################################################################
+
+fields = ['flux', 'flux_err', 'peak', 'peak_err', 'major', 'minor', 'pa']
+
+# factors converting each unit to the one the pipeline uses for that kind of quantity
+unit_factors = {'jy': 1., 'mjy': 1e-3, 'ujy': 1e-6, 'jy/beam': 1., 'mjy/beam': 1e-3, 'ujy/beam': 1e-6,
+                'arcsec': 1., 'arcmin': 60., 'deg': 3600., 'rad': 180.*3600./np.pi, 'mas': 1e-3}
+angle_factors = {'deg': 1., 'rad': 180./np.pi, 'arcsec': 1./3600., 'arcmin': 1./60.}
+
+
+class ImfitParseError(ValueError):
+    pass
+
+
+def _normalize(name):
+    return re.sub(r'[^a-z0-9]', '', name.split('(')[0].split('[')[0].lower())
+
+
+# Unit given in brackets after a column name, e.g. I(mJy) or Major[arcsec]
+def _bracket_unit(name):
+    match = re.search(r'[\(\[]([^\)\]]+)[\)\]]', name)
+    return match.group(1) if match else None
+
+
+def _factor(field, unit, path):
+    unit = unit.strip().lower()
+    factors = angle_factors if field == 'pa' else unit_factors
+    if unit not in factors:
+        raise ImfitParseError('%s: unknown unit %s for %s' % (path, unit, field))
+    return factors[unit]
+
+
+# Work out where each field is in a data line from the comment lines before it: the last one with as many names as
+# the line has values is the header, and a comment line after it with the same number of entries gives units.
+# Returns a dictionary of field: (position, conversion factor), or None if there is no usable header
+def _schema(comments, n_values, path):
+    candidates = [i for i, line in enumerate(comments) if len(line.split()) == n_values]
+    header_idx = None
+    for i in reversed(candidates):
+        names = [_normalize(name) for name in comments[i].split()]
+        if any(name in column_names['flux'] for name in names):
+            header_idx = i
+            break
+    if header_idx is None:
+        return None
+
+    header = comments[header_idx].split()
+    units = None
+    if header_idx + 1 < len(comments) and len(comments[header_idx + 1].split()) == n_values:
+        units = comments[header_idx + 1].split()
+
+    schema = {}
+    for field, aliases in column_names.items():
+        matches = [i for i, name in enumerate(header) if _normalize(name) in aliases]
+        if not matches:
+            continue
+        col = matches[0]
+        unit = _bracket_unit(header[col]) or (units[col] if units is not None else default_units[field])
+        schema[field] = (col, _factor(field, unit, path))
+    missing = [field for field in fields if field not in schema]
+    if missing:
+        raise ImfitParseError('%s: header has no %s column' % (path, ', '.join(missing)))
+    return schema
+
+
+def _number(value, field, path, line_num):
+    try:
+        return float(value)
+    except ValueError:
+        raise ImfitParseError('%s, line %s: %r is not a number (%s)' % (path, line_num, value, field))
+
+
+# Check the values of a component make sense, raising an ImfitParseError if not
+def _validate(component, path, line_num):
+    for field in fields:
+        if not np.isfinite(component[field]):
+            raise ImfitParseError('%s, line %s: %s is %s' % (path, line_num, field, component[field]))
+    for field in ['flux_err', 'peak_err']:
+        if component[field] <= 0:
+            raise ImfitParseError('%s, line %s: %s must be positive' % (path, line_num, field))
+    if component['major'] <= 0 or component['minor'] <= 0:
+        raise ImfitParseError('%s, line %s: component sizes must be positive' % (path, line_num))
+
+
+# Components of a summary file, one dictionary per fitted component (in Jy, Jy/beam, arcsec and degrees), read one
+# line at a time
+def iter_components(path):
+    comments = []
+    schema = None
+    legacy = False
+    component = 0
+    with open(path, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            stripped = line.strip()
+            if stripped == '':
+                continue
+            if stripped.startswith('#'):
+                comments.append(stripped.lstrip('#'))
+                continue
+
+            values = stripped.split()
+            if schema is None:
+                schema = _schema(comments, len(values), path)
+                if schema is None:
+                    warnings.warn('%s has no recognizable header, reading values by position' % path)
+                    schema = dict((field, (legacy_columns[field], 1.)) for field in legacy_columns)
+                    legacy = True
+            if legacy:
+                # the positions count the fields of the line split on single spaces
+                values = line.rstrip('\n').split(' ')
+
+            result = {'component': component}
+            for field, (col, factor) in schema.items():
+                if col >= len(values):
+                    raise ImfitParseError('%s, line %s: no value for %s' % (path, line_num, field))
+                result[field] = _number(values[col], field, path, line_num)*factor
+            _validate(result, path, line_num)
+            component += 1
+            yield result
+
+
+# List of the components of a summary file
+def parse_summary(path):
+    components = list(iter_components(path))
+    if not components:
+        raise ImfitParseError('%s has no fitted components' % path)
+    return components
+
+
+def summary_path(name, galaxy_dir=None):
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(name)
+    return os.path.join(galaxy_dir, 'summary.log')
+
+
+# Parse the summaries of a list of galaxies into one table, with a row for each component of each galaxy. Galaxies
+# whose summary is missing or can't be parsed get a row of NaNs with the reason in the 'error' column, unless strict,
+# in which case the error is raised
+def read_summaries(names, data_path=None, strict=False):
+    if data_path is None:
+        data_path = GetGalaxyList.data_path
+    rows = []
+    for name in names:
+        try:
+            for component in iter_components(summary_path(name, os.path.join(data_path, name))):
+                rows.append([name, component['component']] + [component[field] for field in fields] + [''])
+        except (IOError, ImfitParseError) as e:
+            if strict:
+                raise
+            rows.append([name, -1] + [np.nan]*len(fields) + [str(e)])
+
+    t = Table(rows=rows if rows else None, names=['name', 'component'] + fields + ['error'],
+              dtype=['U32', int] + [float]*len(fields) + ['U256'])
+    for field in fields:
+        t[field].unit = default_units[field]
+    return t
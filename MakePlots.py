@@ -3,38 +3,29 @@ import matplotlib.colors as matcol
 import matplotlib as mpl
 import matplotlib.patches as mpatches
 from matplotlib.lines import Line2D
-import seaborn as sns
 from astropy.table import Table
 import os
-import aplpy
+import ast
 import glob
-import pandas as pd
+import json
+import time
+import inspect
+import argparse
+import traceback
+import multiprocessing
+from collections import OrderedDict
 import matplotlib.transforms as tf
-from astropy.table import Table
-from astropy.io import fits
-from astropy.stats import biweight_midvariance
-from astropy.cosmology import FlatLambdaCDM
-from photutils import CircularAperture
-from photutils import aperture_photometry
-from photutils import Background2D
 import numpy as np
-from lifelines import KaplanMeierFitter
-from lifelines.utils import median_survival_times
-from scipy.optimize import curve_fit
-from scipy.interpolate import UnivariateSpline
-import scipy.stats as st
-import astropy.units as u
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 import CalcSFRs
 reload(CalcSFRs)
 import WISE
 reload(WISE)
 import GetGalaxyList
 reload(GetGalaxyList)
-import Templates
-reload(Templates)
-
-kmf = KaplanMeierFitter(alpha=0.16)
+import Distances
+import ImageAccess
+import Measurements
+import Cache
 
 ####################################################################################
 # parameters
@@ -45,51 +36,164 @@ use_imfit = True
 label_points = False
 
 marker_size = 10
+
+# Directory of the templates, WISE bandpasses and SOFIA photometry used by wise_colors()
+project_dir = '/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs'
+
+# Science table written by ConstructTable.py. The binary copy keeps the column types and units and is much quicker to
+# read; the csv copy is read instead if it is newer (e.g. after editing it by hand) or the binary one doesn't exist
+table_file = 'table.fits'
+csv_table_file = 'table.csv'
+
+# Figures rendered by 'python MakePlots.py' when none are named
+default_figures = ['ratio_to_size', 'ratio_age']
+# Number of figures rendered at once, each in its own process
+jobs = 4
 ####################################################################################
 
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+# science tables read so far, keyed by path: (modification time, astropy table, pandas data frame)
+_tables = {}
+
+
+def _table_path():
+    if not os.path.exists(table_file) or (os.path.exists(csv_table_file) and
+                                          os.path.getmtime(csv_table_file) > os.path.getmtime(table_file)):
+        return csv_table_file
+    return table_file
+
 
+# Cache entry of the science table, reading it the first time it is needed and again only if its file changes
+def _table_entry():
+    path = _table_path()
+    mtime = os.path.getmtime(path)
+    if path not in _tables or _tables[path][0] != mtime:
+        if path.endswith('.csv'):
+            table = Table.read(path, format='csv')
+        else:
+            table = Table.read(path)
+        _tables[path] = (mtime, table, None)
+    return path, _tables[path]
+
+
+# The science table as an astropy table. It is shared by every plot, so copy it before modifying it
+def load_table():
+    return _table_entry()[1][1]
+
+
+# The science table as a pandas data frame, as pd.read_csv('table.csv') gives it (missing values are NaN). Each call
+# returns a new copy, which can be modified
+def table_frame():
+    import pandas as pd
+    path, (mtime, table, frame) = _table_entry()
+    if frame is None:
+        columns = []
+        for col in table.colnames:
+            values = table[col]
+            if hasattr(values, 'mask') and values.dtype.kind in 'iuf':
+                values = values.astype(float).filled(np.nan)
+            columns.append((col, np.array(values)))
+        frame = pd.DataFrame(dict(columns), columns=table.colnames)
+        _tables[path] = (mtime, table, frame)
+    return frame.copy()
 
 
 
-# Read in astropy table
-t = Table.read('table.csv')
-# read in Smolcic 2017 COSMOS data
-t_survey_raw = Table.read('smolcic.fit')
 
-if use_imfit:
-    correlation = t['detect']
-else:
-    correlation = np.multiply(t['detect_pix'], t['detect_aper'])
 
-# Table containing detections only
-t_detect = t[np.where(correlation == 1)[0]]
+# Attribute computed by the decorated method the first time it is accessed, and kept on the instance after that
+class lazy_property(object):
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
 
-# Filter table into 3 separate tables, one for detections, non-detections, and flagged sources (AGN)
-t_nondetect = t[np.where(correlation == 0)[0]]
-t_ok = t_detect[np.where(t_detect['21 cm SFR'] < 1000)[0]]
-t_bad = t_detect[np.where(t_detect['21 cm SFR'] > 1000)[0]]
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
 
-t_color = t[np.where(~np.isnan(t['w3-w4']))[0]]
 
-t_shift = t_color[np.where(t_color['IR SFR'] > (1.5 * t_color['21 cm SFR']))[0]]
-t_else = t_color[np.where((t_color['IR SFR'] < (1.5 * t_color['21 cm SFR'])) & (t_color['21 cm SFR'] < 1000))[0]]
+# The tables the plots are made from. Each is read or filtered the first time a plot uses it, so importing this module
+# or making one plot only reads what that plot needs. Call reset() to read everything again (e.g. after rebuilding the
+# science table)
+class PlotData(object):
+
+    def reset(self):
+        self.__dict__.clear()
+
+    # Read in astropy table
+    @lazy_property
+    def t(self):
+        return load_table()
+
+    @lazy_property
+    def correlation(self):
+        if use_imfit:
+            return self.t['detect']
+        else:
+            return np.multiply(self.t['detect_pix'], self.t['detect_aper'])
 
-# survey data to plot on top of SFR comparison plot
-surv_redshift = np.array(t_survey_raw['zbest'])
-surv_rad_lum = np.array(t_survey_raw['logL21cm'])
-surv_ir_lum = np.array(t_survey_raw['logLTIRSF'])
+    # Table containing detections only
+    @lazy_property
+    def t_detect(self):
+        return self.t[np.where(self.correlation == 1)[0]]
 
-# multiplying columns, so we can eliminate data points which don't have all 3 (redshift, radio luminosity, and IR luminosity)
-multed = np.multiply(np.multiply(surv_redshift, surv_rad_lum), surv_ir_lum)
-t_survey_data = t_survey_raw[np.where(multed > 0)[0]]
+    # Filter table into 3 separate tables, one for detections, non-detections, and flagged sources (AGN)
+    @lazy_property
+    def t_nondetect(self):
+        return self.t[np.where(self.correlation == 0)[0]]
 
-# applying redshift cut similar to our sample
-surv_z = np.array(t_survey_data['zbest'])
-t_survey = t_survey_data[np.where((surv_z > 0.4) & (surv_z < 0.75))]
+    @lazy_property
+    def t_ok(self):
+        return self.t_detect[np.where(self.t_detect['21 cm SFR'] < 1000)[0]]
+
+    @lazy_property
+    def t_bad(self):
+        return self.t_detect[np.where(self.t_detect['21 cm SFR'] > 1000)[0]]
+
+    @lazy_property
+    def t_color(self):
+        return self.t[np.where(~np.isnan(self.t['w3-w4']))[0]]
+
+    @lazy_property
+    def t_shift(self):
+        return self.t_color[np.where(self.t_color['IR SFR'] > (1.5 * self.t_color['21 cm SFR']))[0]]
+
+    @lazy_property
+    def t_else(self):
+        return self.t_color[np.where((self.t_color['IR SFR'] < (1.5 * self.t_color['21 cm SFR'])) &
+                                     (self.t_color['21 cm SFR'] < 1000))[0]]
+
+    # read in Smolcic 2017 COSMOS data
+    @lazy_property
+    def t_survey_raw(self):
+        return Table.read('smolcic.fit')
+
+    # survey data to plot on top of SFR comparison plot
+    @lazy_property
+    def t_survey(self):
+        surv_redshift = np.array(self.t_survey_raw['zbest'])
+        surv_rad_lum = np.array(self.t_survey_raw['logL21cm'])
+        surv_ir_lum = np.array(self.t_survey_raw['logLTIRSF'])
+
+        # multiplying columns, so we can eliminate data points which don't have all 3 (redshift, radio luminosity, and
+        # IR luminosity)
+        multed = np.multiply(np.multiply(surv_redshift, surv_rad_lum), surv_ir_lum)
+        t_survey_data = self.t_survey_raw[np.where(multed > 0)[0]]
+
+        # applying redshift cut similar to our sample
+        surv_z = np.array(t_survey_data['zbest'])
+        return t_survey_data[np.where((surv_z > 0.4) & (surv_z < 0.75))]
+
+
+plot_data = PlotData()
 
 
 # Do two weighted linear fits to detections only. Fix the second fit to have a y-intercept of zero
 def linear_fit(x_vals, y_vals, x_err, y_err):
+    from scipy.optimize import curve_fit
     # Do first fit with just y errors
     tmp_fit = np.polyfit(x_vals, y_vals, 1, w=1. / y_err)
     tmp_fit_fn = np.poly1d(tmp_fit)
@@ -130,6 +234,7 @@ err_to_use = 'MySFR Err'
 # main plot for paper
 # comparing SFRs derived from radio & IR, plus extra axes for comparing luminosities in radio & IR
 def plot_all_SFRs():
+    t_ok, t_nondetect = plot_data.t_ok, plot_data.t_nondetect
 
     x_axis_lim = 600
     y_axis_lim = 600
@@ -358,6 +463,8 @@ def plot_all_SFRs():
 
 # compare sfr derived from radio vs outflow speed (exclude J0827, the radio loud AGN)
 def sfr_v_speed():
+    import scipy.stats as st
+    t, t_ok, t_nondetect = plot_data.t, plot_data.t_ok, plot_data.t_nondetect
     t_fine = t[np.where((t['21 cm SFR'] < 1000))[0]]
 
     radsfrs = np.log10(np.array(t_fine['21 cm SFR'])/(np.pi * np.square(np.array(t_fine['Re']))))
@@ -486,6 +593,8 @@ def sfr_v_speed():
 
 
 def plot_lum_vs_z():
+    import scipy.stats as st
+    t_ok, t_nondetect, t_bad = plot_data.t_ok, plot_data.t_nondetect, plot_data.t_bad
     es_to_W = 10 ** 7
 
     lum_ok = np.array(t_ok['Luminosity']) / es_to_W
@@ -545,6 +654,7 @@ def plot_lum_vs_z():
 
 
 def Lum_hist():
+    t_ok, t_nondetect = plot_data.t_ok, plot_data.t_nondetect
     plt.clf()
     plt.cla()
     plt.close()
@@ -576,6 +686,8 @@ def Lum_hist():
 
 
 def wise_colors():
+    import Templates
+    t, t_ok, t_nondetect = plot_data.t, plot_data.t_ok, plot_data.t_nondetect
 
     """"# w1-w2 vs w3-w4
     y_shift = np.array(t_shift['w1-w2']).astype(float)
@@ -620,10 +732,9 @@ def wise_colors():
     #
 
     Template_colors = True
-    templates = sorted(
-        glob.glob('/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs/Comprehensive_library/*.txt'))
+    templates = sorted(glob.glob(os.path.join(project_dir, 'Comprehensive_library', '*.txt')))
     # wise bandpasses
-    bandpass = sorted(glob.glob('/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs/bandpass/*.txt'))
+    bandpass = sorted(glob.glob(os.path.join(project_dir, 'bandpass', '*.txt')))
     template_names = []
     # corrections to go from AB mags to WISE Vega mags. first entry is 0 so that W1 correction corresponds to 1st index
     wise_corr = [0, 2.699, 3.339, 5.174, 6.620]
@@ -943,6 +1054,7 @@ def wise_colors():
 
 
 def sed():
+    t = plot_data.t
 
     # separate galaxies which lie significantly to the right of 1-to-1 line from remainder of sample
     t_shift = t[np.where(t[sfr_to_use] > (1.5 * t['21 cm SFR']))[0]]
@@ -1074,7 +1186,7 @@ def sed():
 
 
 def radio_to_ir():
-    tot_table = pd.read_csv('table.csv')
+    tot_table = table_frame()
     idxs = np.where(np.array(tot_table['21 cm SFR']) > 1000.)[0]
     tot_table.drop(idxs, inplace=True)
     tot_table.reset_index(drop=True, inplace=True)
@@ -1123,7 +1235,13 @@ def radio_to_ir():
 
 
 def ratio_to_size():
-    tot_table = pd.read_csv('table.csv')
+    from astropy.stats import biweight_midvariance
+    from photutils import CircularAperture, aperture_photometry, Background2D
+    from scipy.optimize import curve_fit
+    from scipy.interpolate import UnivariateSpline
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+    t_ok, t_nondetect = plot_data.t_ok, plot_data.t_nondetect
+    tot_table = table_frame()
     idxs = np.where(np.array(tot_table['21 cm SFR']) > 1000.)[0]
     tot_table.drop(idxs, inplace=True)
     tot_table.reset_index(drop=True, inplace=True)
@@ -1162,17 +1280,17 @@ def ratio_to_size():
 
     half_detect = False
     compactness_detect, compact_err_detect = [], []
-    location = '/Users/graysonpetter/Desktop/mac_copy/'
+    # kpc/arcsec for every galaxy at once from the distance lookup table
+    ang_scales_detect = Distances.kpc_per_arcsec(zs_detect)
     for x in range(len(gal_names_detect)):
-        data = fits.open(location+gal_names_detect[x]+'/'+gal_names_detect[x][:5]+'_HST.fits')[0].data
+        data = ImageAccess.image_data(ImageAccess.hst_path(gal_names_detect[x]))
         cleaned = data[~np.isnan(data)]
         rms = biweight_midvariance(cleaned)
 
         background = Background2D(data, (500, 500))
 
-        cosmo = FlatLambdaCDM(H0=70., Om0=0.3)
         pix_scale = 0.025   # arcsec/pix
-        ang_scale = cosmo.kpc_proper_per_arcmin(zs_detect[x]).value/60.  # kpc/arcsec
+        ang_scale = ang_scales_detect[x]  # kpc/arcsec
         size_scale = ang_scale*pix_scale    # kpc/pixel
         ap_radii_phys = [0.5, 1.0, 5.]   # kpc
         ap_radii_pix = list(np.array(ap_radii_phys)/size_scale)     # pix
@@ -1194,17 +1312,16 @@ def ratio_to_size():
 
     half_non = False
     compactness_non, compact_err_non = [], []
-    location = '/Users/graysonpetter/Desktop/mac_copy/'
+    ang_scales_non = Distances.kpc_per_arcsec(zs_non)
     for x in range(len(gal_names_non)):
-        data = fits.open(location + gal_names_non[x] + '/' + gal_names_non[x][:5] + '_HST.fits')[0].data
+        data = ImageAccess.image_data(ImageAccess.hst_path(gal_names_non[x]))
         cleaned = data[~np.isnan(data)]
         rms = biweight_midvariance(cleaned)
 
         background = Background2D(data, (500, 500))
 
-        cosmo = FlatLambdaCDM(H0=70., Om0=0.3)
         pix_scale = 0.025  # arcsec/pix
-        ang_scale = cosmo.kpc_proper_per_arcmin(zs_non[x]).value / 60.  # kpc/arcsec
+        ang_scale = ang_scales_non[x]  # kpc/arcsec
         size_scale = ang_scale * pix_scale  # kpc/pixel
         ap_radii_phys = [0.5, 1.0, 5.]  # kpc
         ap_radii_pix = list(np.array(ap_radii_phys) / size_scale)  # pix
@@ -1359,7 +1476,8 @@ def ratio_to_size():
 
 
 def ratio_age():
-    tot_table = pd.read_csv('table.csv')
+    t_ok, t_nondetect = plot_data.t_ok, plot_data.t_nondetect
+    tot_table = table_frame()
     idxs = np.where(np.array(tot_table['21 cm SFR']) > 1000.)[0]
     tot_table.drop(idxs, inplace=True)
     tot_table.reset_index(drop=True, inplace=True)
@@ -1422,7 +1540,7 @@ def ratio_age():
     plt.close('all')
 
 def age_radius():
-    tot_table = pd.read_csv('table.csv')
+    tot_table = table_frame()
     idxs = np.where(np.array(tot_table['21 cm SFR']) > 1000.)[0]
     tot_table.drop(idxs, inplace=True)
     tot_table.reset_index(drop=True, inplace=True)
@@ -1437,7 +1555,9 @@ def age_radius():
     plt.savefig('R_v_age.png', overwrite=True, dpi=300, bbox_inches='tight')
 
 def ratio_to_size_condon():
-    tot_table = pd.read_csv('table.csv')
+    from astropy.io import fits
+    import astropy.units as u
+    tot_table = table_frame()
     idxs = np.where(np.array(tot_table['21 cm SFR']) > 1000.)[0]
     tot_table.drop(idxs, inplace=True)
     tot_table.reset_index(drop=True, inplace=True)
@@ -1549,7 +1669,9 @@ def ratio_to_size_condon():
     plt.close()
 
 def q_histogram():
-    tot_table = pd.read_csv('table.csv')
+    from lifelines import KaplanMeierFitter
+    kmf = KaplanMeierFitter(alpha=0.16)
+    tot_table = table_frame()
     idxs = np.where(np.array(tot_table['21 cm SFR']) > 1000.)[0]
     tot_table.drop(idxs, inplace=True)
     tot_table.reset_index(drop=True, inplace=True)
@@ -1601,6 +1723,7 @@ def q_histogram():
     plt.close()
 
 def postageStamps():
+    import aplpy
 
 
     #####################################################################################
@@ -1610,9 +1733,8 @@ def postageStamps():
     vertical = False
     #####################################################################################
 
-    current_dir = os.getcwd()
-
     sorted_names = GetGalaxyList.return_galaxy_list()
+    Measurements.import_sample(sorted_names)
 
     num_gals = len(sorted_names)
 
@@ -1642,7 +1764,7 @@ def postageStamps():
     y_iter = 0
 
     for z in range(num_gals):
-        os.chdir(sorted_names[z])
+        gal_dir = GetGalaxyList.galaxy_dir(sorted_names[z])
 
         if z % cols == 0 and z != 0:
             x_iter = 0
@@ -1654,47 +1776,31 @@ def postageStamps():
         x_iter = x_iter + x_size + x_start
 
         # if source was detected, write galaxy name in boldface
-        with open('text/detect.txt', 'r') as f:
-            truth = f.readline()
+        truth = Measurements.get_value(sorted_names[z], 'detect')
         if int(truth) == 1:
             weighting = 'heavy'
         else:
             weighting = 'normal'
 
         # open fits file to get beam stats, rms value
-        imgname = '%s.cutout.pbcor.fits' % sorted_names[z]
-        hdu = fits.open(imgname)
-        bmaj = hdu[0].header['bmaj']
-        bmin = hdu[0].header['bmin']
-        angle = hdu[0].header['bpa']
-        rms = np.std(hdu[0].data)
+        imgname = ImageAccess.cutout_path(sorted_names[z], gal_dir)
+        bmaj, bmin, angle = ImageAccess.beam(imgname)
+        rms = np.std(ImageAccess.image_data(imgname, squeeze=False))
 
-        f = aplpy.FITSFigure(imgname, figure=fig, subplot=[x, y, x_size, y_size], rasterize=True)
+        f = aplpy.FITSFigure(ImageAccess.open_image(imgname)[0], figure=fig, subplot=[x, y, x_size, y_size],
+                             rasterize=True)
 
         # hst centroid to center the figure
-        with open('text/center_HST.txt', 'r') as f_H:
-            lines = f_H.readlines()
-            HST_ra = float(lines[0])
-            HST_dec = float(lines[1])
+        HST_ra, HST_dec = Measurements.get(sorted_names[z], 'center_HST')
 
         # set positions of 2D gaussian ellipse
         if found_source:
-            with open('text/center_radio_wcs.txt') as f_rad:
-                lines = f_rad.readlines()
-                ra = float(lines[0])
-                dec = float(lines[1])
+            ra, dec = Measurements.get(sorted_names[z], 'center_radio_wcs')
         else:
-            with open('text/center_HST.txt', 'r') as f_center:
-                lines = f_center.readlines()
-                ra = float(lines[0])
-                dec = float(lines[1])
+            ra, dec = HST_ra, HST_dec
 
         # get beam stats to set size of ellipse
-        with open('text/width.txt', 'r') as f_width:
-            lines = f_width.readlines()
-            maj_width = float(lines[0])
-            min_width = float(lines[1])
-            PA = float(lines[2])
+        maj_width, min_width, PA = Measurements.get(sorted_names[z], 'width')
 
         # show 2D gaussian ellipse
         f.show_ellipses(ra, dec, min_width / 3600., maj_width / 3600., angle=PA, edgecolor='magenta', linewidth=3)
@@ -1750,8 +1856,6 @@ def postageStamps():
         # f.axis_labels.set_ypad(0)
         # f.tick_labels.set_font(size='x-small', weight='medium', stretch='normal', family='sans-serif', style='normal',
         # variant='normal')
-
-        os.chdir('..')
     cbar_ax = fig.add_axes([0.1, 0.15, .8, 0.03])
     #fig.colorbar(f, cax=cbar_ax)
     norm = mpl.colors.Normalize(vmin=-80, vmax=80)
@@ -1760,7 +1864,6 @@ def postageStamps():
     cb.ax.tick_params(labelsize=40)
     cb.set_label('Surface Brightness ($\mu$Jy beam$^{-1}$)', size=40)
 
-    os.chdir(current_dir)
     plt.savefig('Stamps.pdf', bbox_inches='tight')
     plt.clf()
     plt.close()
@@ -1770,14 +1873,14 @@ def postageStamps():
     plt.close('all')
 
 def HST_Stamps():
+    import aplpy
 
     vertical = False
 
-    current_dir = os.getcwd()
-
-    result = pd.read_csv('table.csv', engine='python')
+    result = table_frame()
 
     names = GetGalaxyList.return_galaxy_list()
+    Measurements.import_sample(names)
 
     # Sort by RA
     stripped_names = []
@@ -1826,7 +1929,7 @@ def HST_Stamps():
     y_iter = 0
 
     for z in range(len(sorted_names)):
-        os.chdir(sorted_names[z])
+        gal_dir = GetGalaxyList.galaxy_dir(sorted_names[z])
 
         if z % cols == 0 and z != 0:
             x_iter = 0
@@ -1837,34 +1940,30 @@ def HST_Stamps():
 
         x_iter = x_iter + x_size + x_start
 
-        with open('text/detect.txt', 'r') as f:
-            truth = f.readline()
+        truth = Measurements.get_value(sorted_names[z], 'detect')
 
         if int(truth) == 1:
             weighting = 'bold'
         else:
             weighting = 'normal'
 
-        HST_name = sorted_names[z][:5] + '_HST.fits'
+        HST_name = ImageAccess.hst_path(sorted_names[z], gal_dir)
 
-        imgname = '%s.cutout.pbcor.fits' % sorted_names[z]
+        imgname = ImageAccess.cutout_path(sorted_names[z], gal_dir)
 
-        with open('text/center_HST.txt', 'r') as f_center:
-            lines = f_center.readlines()
-            HST_ra = float(lines[0])
-            HST_dec = float(lines[1])
-        with open('text/stdev.txt', 'r') as f_rms:
-            rms = float(f_rms.readline())
+        HST_ra, HST_dec = Measurements.get(sorted_names[z], 'center_HST')
+        rms = Measurements.get_value(sorted_names[z], 'stdev')
 
-        f = aplpy.FITSFigure(HST_name, figure=fig, subplot=[x, y, x_size, y_size], rasterize=True, downsample=4)
+        f = aplpy.FITSFigure(ImageAccess.open_image(HST_name)[0], figure=fig, subplot=[x, y, x_size, y_size],
+                             rasterize=True, downsample=4)
 
-        fitsimg = fits.open(HST_name)
-        hstrms = np.std(fitsimg[0].data)
+        hst_data = ImageAccess.image_data(HST_name, squeeze=False)
+        hstrms = np.std(hst_data)
         print(hstrms)
-        print(np.max(fitsimg[0].data))
+        print(np.max(hst_data))
 
         f.show_grayscale(vmin=0, vmax=30)
-        f.show_contour(imgname, levels=[(2. * rms), (3. * rms), (6 * rms), (12 * rms)], alpha=1, linewidths=4.,
+        f.show_contour(ImageAccess.open_image(imgname)[0], levels=[(2. * rms), (3. * rms), (6 * rms), (12 * rms)], alpha=1, linewidths=4.,
                        colors='cyan')
         f.recenter(HST_ra, HST_dec, width=15. / 3600, height=15. / 3600)
 
@@ -1881,8 +1980,6 @@ def HST_Stamps():
         f.add_label(0.25, 0.9, ('%s' % sorted_names[z])[:5], relative=True, weight=weighting, color='orange', size=60)
         f.set_theme('publication')
 
-        os.chdir('..')
-
     cbar_ax = fig.add_axes([0.1, 0.15, .8, 0.03])
     #fig.colorbar(f, cax=cbar_ax)
     norm = mpl.colors.Normalize(vmin=0, vmax=50)
@@ -1891,7 +1988,6 @@ def HST_Stamps():
     cb.ax.tick_params(labelsize=40)
     cb.set_label('Brightness (Counts)', size=40)
 
-    os.chdir(current_dir)
     fig.subplots_adjust(right=0.8)
     plt.savefig('HST_Stamps.pdf', bbox_inches='tight', pad_inches=0, dpi=200)
     plt.clf()
@@ -1901,13 +1997,212 @@ def HST_Stamps():
     plt.close('all')
 
 
-#plot_all_SFRs()
-#sfr_v_speed()
-#plot_lum_vs_z()
-#wise_colors()
-ratio_to_size()
-ratio_age()
-#q_histogram()
-#postageStamps()
-#HST_Stamps()
 
+# Figures that can be rendered from the command line, by the name of their plot function, with every file each may
+# write (some of them only when parts of the function that are commented out by default are switched back on)
+figures = OrderedDict([('plot_all_SFRs', ['SFRs.pdf']),
+                       ('sfr_v_speed', ['sigma_vs_speed.pdf', 'lum_vs_speed.png']),
+                       ('plot_lum_vs_z', ['lum_vs_z.pdf']),
+                       ('Lum_hist', ['lum_hist.png']),
+                       ('wise_colors', ['wisecolors.pdf', 'wisecolors.png', 'wisecolors3.png', 'wisecolors4.png',
+                                        'sofia_colors.png', 'sofia_colors2.png', 'sofia_colors3.png']),
+                       ('sed', ['SED.png']),
+                       ('radio_to_ir', ['radio_IR.png']),
+                       ('ratio_to_size', ['ratio_v_compact.pdf', 'ratio_v_sigma.png']),
+                       ('ratio_age', ['ratio_v_age.pdf']),
+                       ('age_radius', ['R_v_age.png']),
+                       ('ratio_to_size_condon', ['ratio_v_size_condon.png', 'LIR_vs_Lrad_hist.pdf']),
+                       ('q_histogram', ['q_hist.pdf']),
+                       ('postageStamps', ['Stamps.pdf']),
+                       ('HST_Stamps', ['HST_Stamps.pdf'])])
+
+
+# Files a figure is made from besides the science table, as glob patterns
+def figure_inputs(name):
+    galaxies = os.path.join(GetGalaxyList.data_path, '*')
+    if name in ('sed', 'radio_to_ir'):
+        return ['unWISE/*.fits', 'SDSS/*.fits']
+    if name == 'wise_colors':
+        import TemplateLibrary
+        return [os.path.join(os.path.dirname(WISE.unwise_path('')), '*.fits'),
+                os.path.join(TemplateLibrary.library_dir, '*.txt'),
+                os.path.join(project_dir, 'Comprehensive_library', '*.txt'),
+                os.path.join(project_dir, 'bandpass', '*.txt'), os.path.join(project_dir, 'SOFIA', '*.csv'),
+                os.path.join(project_dir, 'swire_lib', '*.sed')]
+    if name == 'ratio_to_size':
+        return [os.path.join(galaxies, '*_HST.fits')]
+    if name == 'ratio_to_size_condon':
+        return ['Condon91/*.fit']
+    if name in ('postageStamps', 'HST_Stamps'):
+        return [os.path.join(galaxies, '*.fits'), os.path.join(galaxies, 'text', '*.txt'), Measurements.store_path()]
+    return []
+
+
+def _file_stamp(path):
+    return [path, os.path.getmtime(path), os.path.getsize(path)]
+
+
+# Names a function's code refers to, including in the functions defined inside it
+def _code_names(func):
+    codes = [func.__code__]
+    names = set()
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+    return names
+
+
+# Functions of this module a function calls, including itself and the functions those call
+def _module_functions(func, found=None):
+    if found is None:
+        found = OrderedDict()
+    found[func.__name__] = func
+    for name in sorted(_code_names(func)):
+        value = globals().get(name)
+        if inspect.isfunction(value) and value.__module__ == __name__ and name not in found:
+            _module_functions(value, found)
+    return found
+
+
+# Source files of the modules of this repository among names, and of the repository modules those import
+def _repo_modules(names, found=None):
+    if found is None:
+        found = OrderedDict()
+    for name in sorted(names):
+        path = os.path.join(repo_dir, '%s.py' % name)
+        if name in found or not os.path.exists(path):
+            continue
+        found[name] = path
+        with open(path, 'r') as f:
+            tree = ast.parse(f.read())
+        imported = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imported.update(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                imported.add(node.module.split('.')[0])
+        _repo_modules(imported, found)
+    return found
+
+
+# Fingerprint of everything a figure is made from: the code of its plot function (and the functions it calls), the
+# other modules of this repository it uses, the parameters of this module, the science table and its other input
+# files. A figure whose fingerprint is the same as when it was last rendered doesn't need rendering again
+def figure_fingerprint(name):
+    functions = _module_functions(globals()[name])
+    code = [inspect.getsource(func) for func in functions.values()]
+    if any('plot_data' in source for source in code):
+        code.append(inspect.getsource(PlotData))
+    names = set()
+    for func in functions.values():
+        names.update(_code_names(func))
+    modules = _repo_modules(names)
+    files = [_table_path()] + list(modules.values())
+    for pattern in figure_inputs(name):
+        files.extend(sorted(glob.glob(pattern)))
+    return Cache.config_hash({'code': code, 'settings': [use_imfit, label_points, marker_size, sfr_to_use, err_to_use,
+                                                         project_dir],
+                              'files': [_file_stamp(path) for path in files]})
+
+
+def _load_rendered():
+    cache_file = Cache.cache_path('rendered_figures.json')
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, 'r') as f:
+        return json.load(f)
+
+
+def _save_rendered(rendered):
+    cache_file = Cache.cache_path('rendered_figures.json')
+    tmp_file = '%s.%s.tmp' % (cache_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(rendered, f, indent=1, sort_keys=True)
+    os.rename(tmp_file, cache_file)
+
+
+# Render one figure with the non-interactive Agg backend, returning its name, the time it took, the traceback if it
+# failed, and which of its files it wrote
+def _render(name):
+    plt.switch_backend('Agg')
+    start = time.time()
+    error = None
+    try:
+        globals()[name]()
+    except Exception:
+        error = traceback.format_exc()
+    plt.close('all')
+    # (allowing for file systems which keep modification times to the second)
+    written = [path for path in figures[name] if os.path.exists(path) and os.path.getmtime(path) >= int(start) - 1]
+    return name, time.time() - start, error, written
+
+
+# Whether a figure has to be rendered again: its fingerprint has changed since it was last rendered, or one of the
+# files it wrote then is gone
+def _stale(entry, fingerprint):
+    if not isinstance(entry, dict) or entry.get('fingerprint') != fingerprint:
+        return True
+    return not all(os.path.exists(path) for path in entry['outputs'])
+
+
+# Render a list of figures, n_jobs at a time. Each figure is drawn in a new worker process, so the pyplot state (figure
+# numbers, current axes) of one can't leak into another. Unless force, figures whose fingerprint is unchanged since
+# they were last rendered, and whose files still exist, are skipped. Returns a dictionary of figure name: render time
+# in seconds (None if skipped), and prints the same along with any errors
+def render_figures(names, n_jobs=None, force=False):
+    if n_jobs is None:
+        n_jobs = jobs
+    unknown = [name for name in names if name not in figures]
+    if unknown:
+        raise ValueError('unknown figures %s, choose from %s' % (', '.join(unknown), ', '.join(figures)))
+
+    rendered = _load_rendered()
+    fingerprints = dict((name, figure_fingerprint(name)) for name in names)
+    todo = [name for name in names if force or _stale(rendered.get(name), fingerprints[name])]
+    times = dict((name, None) for name in names)
+    for name in names:
+        if name not in todo:
+            print('%-22s skipped, unchanged' % name)
+
+    if todo:
+        # read the science table once, before the workers are started, so that they share it
+        load_table()
+        pool = multiprocessing.Pool(max(1, min(n_jobs, len(todo))), maxtasksperchild=1)
+        try:
+            results = pool.imap_unordered(_render, todo)
+            for name, seconds, error, written in results:
+                times[name] = seconds
+                if error is None:
+                    rendered[name] = {'fingerprint': fingerprints[name], 'outputs': written}
+                    print('%-22s %7.2f s' % (name, seconds))
+                else:
+                    rendered.pop(name, None)
+                    print('%-22s failed after %.2f s\n%s' % (name, seconds, error))
+        finally:
+            pool.close()
+            pool.join()
+        _save_rendered(rendered)
+    return times
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render figures, several at once, skipping those whose inputs are '
+                                                 'unchanged since they were last rendered')
+    parser.add_argument('figures', nargs='*', help='figures to render, or all (default %s)' % ' '.join(default_figures))
+    parser.add_argument('--jobs', type=int, default=jobs, help='number of figures rendered at once')
+    parser.add_argument('--force', action='store_true', help='render the figures even if their inputs are unchanged')
+    parser.add_argument('--list', action='store_true', help='list the figures that can be rendered')
+    args = parser.parse_args()
+
+    if args.list:
+        for name in figures:
+            print('%-22s %s' % (name, ' '.join(figures[name])))
+    else:
+        names = args.figures or default_figures
+        if names == ['all']:
+            names = list(figures)
+        start = time.time()
+        render_figures(names, args.jobs, args.force)
+        print('%-22s %7.2f s' % ('total', time.time() - start))
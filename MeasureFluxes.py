@@ -7,6 +7,7 @@
 #
 
 import os
+import threading
 import numpy as np
 from random import randint
 import matplotlib.pyplot as plt
@@ -25,6 +26,9 @@ from astropy import wcs
 import astropy.units as u
 import CalcSFRs
 reload(CalcSFRs)
+import ImageAccess
+import Measurements
+import GetGalaxyList
 
 
 #############################################################################
@@ -35,34 +39,36 @@ bkgd_subtract = False
 make_growth_curves = False
 #############################################################################
 
+# pyplot isn't thread safe, so curves of growth are drawn one at a time
+_plot_lock = threading.Lock()
+
 
 # If enabled, this function will test many aperture sizes on a given galaxy and determine the optimal one.
-# In the process, a curve of growth plot is generated and saved in each galaxy's directory.
+# In the process, a curve of growth plot is generated and saved in the galaxy's directory, plot_dir.
 # The optimal aperture size is then returned so the photometry() function can use it.
-def find_aperture_size(position, img):
+def find_aperture_size(position, img, plot_dir='.'):
 
 	# list of aperture radii in arcsec
 	ap_rad_list = np.arange(0.1, 20, 0.1)
 	rad_pix = ap_rad_list/cell_size
-	f = []
 
-	# Do photometry with each aperture
-	for x in range(len(ap_rad_list)):
-		ap = CircularAperture(position, r=rad_pix[x])
-		phot = aperture_photometry(img, ap)
-		f.append(phot['aperture_sum'][0])
+	# Do photometry with every aperture in a single call
+	apers = [CircularAperture(position, r=rad_pix[x]) for x in range(len(ap_rad_list))]
+	phot = aperture_photometry(img, apers)
+	f = np.array([phot['aperture_sum_%s' % x][0] for x in range(len(apers))])
 
 	# Make curve of growth plot
-	plt.figure(randint(0, 10000))
-	plt.plot(ap_rad_list, f, 'ro')
-	plt.xlabel('Aperture radius (")')
-	plt.ylabel('Flux Density * pixels per beam')
-	plt.savefig('curveofgrowth.png', overwrite=True)
-	plt.clf()
-	plt.close()
+	with _plot_lock:
+		plt.figure(randint(0, 10000))
+		plt.plot(ap_rad_list, f, 'ro')
+		plt.xlabel('Aperture radius (")')
+		plt.ylabel('Flux Density * pixels per beam')
+		plt.savefig(os.path.join(plot_dir, 'curveofgrowth.png'), overwrite=True)
+		plt.clf()
+		plt.close()
 
 	# Select aperture at which it first reaches 90% of maximum (can tweak this).
-	maximum = max(f)
+	maximum = np.max(f)
 	idxs = np.where(f > 0.9 * maximum)[0]
 	if len(idxs) > 0:
 		return rad_pix[min(idxs)]
@@ -71,26 +77,21 @@ def find_aperture_size(position, img):
 
 
 # Do photometry with a circular aperture
-# Arguments: path to directory of pertinent galaxy
+# Arguments: name of the galaxy, and optionally the path to its directory (by default, in the data directory)
 # Returns: A flux, flux error, image RMS, number of pixels per beam, number of beams in aperture,
 # the maximum pixel in aperture, and the relative errors: flux/error, and max/rms.
-def photometry(gal_name, source_find):
+def photometry(gal_name, source_find, galaxy_dir=None):
 
-	# open fits file as 2D array
-	os.chdir(gal_name)
-	fits_name = '%s.cutout.pbcor.fits' % gal_name
-	hdu = fits.open(fits_name)
-	data = hdu[0].data[0][0]
+	if galaxy_dir is None:
+		galaxy_dir = GetGalaxyList.galaxy_dir(gal_name)
 
-	# open text file containing the scaled MAD and beam area saved by generate_cleans.statistics()
-	with open('text/stdev.txt', 'r') as f:
-		std_dev = float(f.readline())  # Jy/beam
-	with open('text/beamarea.txt', 'r') as f:
-		beamarea = float(f.readline())  # arcsec^2
+	# open fits file as 2D array
+	fits_name = ImageAccess.cutout_path(gal_name, galaxy_dir)
+	data = ImageAccess.image_data(fits_name)
 
-	# create error image to pass to astropy photometry to calculate flux errors
-	ones = np.ones_like(data)
-	error_image = std_dev*ones
+	# scaled MAD and beam area saved by generate_cleans.statistics()
+	std_dev = Measurements.get_value(gal_name, 'stdev', galaxy_dir=galaxy_dir)  # Jy/beam
+	beamarea = Measurements.get_value(gal_name, 'beamarea', galaxy_dir=galaxy_dir)  # arcsec^2
 
 	# Flux density = Sum of pixels in aperture / number of pixels per beam
 	# Pixels per beam = angular area of beam / angular area of one pixel
@@ -102,7 +103,7 @@ def photometry(gal_name, source_find):
 	# number of beams in the aperture
 	beams_per_aper = np.pi*aperture_size**2/beamarea
 
-	# flux error calculation
+	# flux error calculation, from the noise per beam (the same everywhere in the cutout) and the number of beams
 	flux_error = np.sqrt(beams_per_aper)*std_dev/2
 
 
@@ -112,16 +113,18 @@ def photometry(gal_name, source_find):
 
 	# If you don't know proper aperture size, let the function find the optimal one, create aperture object
 	if make_growth_curves:
-		aper_radius = find_aperture_size(positions, data)
+		aper_radius = find_aperture_size(positions, data, galaxy_dir)
 	apertures = CircularAperture(positions, r=aper_radius)
 
-	# make mask image where pixels outside aperture are zero, then find the maximum value in the aperture
-	mask = apertures.to_mask(method='center')[0].to_image((201, 201))
-	masked_data = np.multiply(data, mask)
-	max_val_in_aperture = max(map(max, masked_data))
+	# find the maximum value in the aperture, and where it is, looking only at the pixels in the aperture's bounding
+	# box. Pixels outside the aperture count as zero, so the maximum is never negative
+	mask = apertures.to_mask(method='center')[0]
+	in_aperture = np.where(mask.data > 0, mask.cutout(data, fill_value=0.), 0.)
+	peak = np.argmax(in_aperture)
+	max_val_in_aperture = max(in_aperture.flat[peak], 0.)
+	y_peak, x_peak = np.unravel_index(peak, in_aperture.shape)
 
-	with open('text/stdev.txt', 'r') as f_rms:
-		rms = float(f_rms.readline())
+	rms = std_dev
 
 	# If we are allowing a search for the brightest pixel as center of gaussian fit, check that pixel is not noise spike by verifying it is 3 sigma above noise
 	# Otherwise, just set center to centroid of HST image
@@ -129,15 +132,13 @@ def photometry(gal_name, source_find):
 		if (max_val_in_aperture > 3.*rms):
 			#print(gal_name)
 			# get coordinates of maximum point
-			y_max = np.where(data == max_val_in_aperture)[0][0]
-			x_max = np.where(data == max_val_in_aperture)[1][0]
+			y_max = mask.bbox.iymin + y_peak
+			x_max = mask.bbox.ixmin + x_peak
 			#print(x_max, y_max)
 
 
 			positions = [(x_max, y_max)]
-			with open('text/center_radio.txt', 'w') as f_center:
-				f_center.write('%s\n' % x_max)
-				f_center.write('%s\n' % y_max)
+			Measurements.put(gal_name, 'center_radio', [x_max, y_max], galaxy_dir)
 		else:
 			# Get sky coordinates of centroid of HST image
 			#hdu_hst = fits.open('%s_HST.fits' % gal_name[:5])
@@ -146,23 +147,20 @@ def photometry(gal_name, source_find):
 			#ra_hst, dec_hst = trans_hst[0], trans_hst[1]
 
 			# Save centroid RA, Dec to file
-			with open('text/center_radio.txt', 'w') as f_center:
-				f_center.write('%s\n' % 100)
-				f_center.write('%s\n' % 100)
+			Measurements.put(gal_name, 'center_radio', [100, 100], galaxy_dir)
 
 
 	apertures = CircularAperture(positions, r=aper_radius)
 
 	# Do background subtraction with an annulus if desired
 	if bkgd_subtract:
-		global annuli
 		annuli = CircularAnnulus(positions, r_in=20, r_out=30)
 		apers = [apertures, annuli]
 	else:
 		apers = [apertures]
 
 	# Do the photometry, background subtraction if desired
-	photo_table = aperture_photometry(data, apers, error=error_image)
+	photo_table = aperture_photometry(data, apers)
 
 
 
@@ -187,6 +185,5 @@ def photometry(gal_name, source_find):
 	output.append(max_val_in_aperture/std_dev)
 	output.append(flux/flux_error)
 
-	os.chdir('..')
 	return output
 
@@ -0,0 +1,209 @@
+#
+# Description: Store of the per-galaxy measurements that the pipeline used to keep only as one-value text files in
+# each galaxy's text/ directory (stdev.txt, beamarea.txt, center_radio.txt, ...). They are kept in a single SQLite
+# database, measurements.db, at the top of the data directory, so a script can load the whole sample in one query
+# instead of opening hundreds of small files.
+#
+# Each measurement is the list of values of the lines of its text file (numbers where they parse as one). Writes are
+# atomic: a galaxy's measurements are written in one transaction. The steps which run in CASA still use text files
+# (generate_cleans.py's statistics stage writes stdev, beamarea and threshold, imfit reads estimates), so writing one
+# of the measurements CASA reads also writes its text file, and the scripts which start a step of the pipeline call
+# import_sample() once to pick up the files CASA has written since the last run. Otherwise a read touches no file
+# besides the database, unless the measurement isn't stored yet.
+#
+
+import os
+import json
+import time
+import numbers
+import sqlite3
+import threading
+import GetGalaxyList
+
+#############################################################################
+# parameters
+# database file, measurements.db in the data directory unless set
+store_file = None
+# measurements whose text files are written along with the store, because CASA reads them
+text_keys = ['estimates', 'threshold']
+# before returning a stored value, check whether its text file has since changed (one stat per read). Off by default:
+# call import_sample() instead, once, at the start of a step
+check_text = False
+#############################################################################
+
+# measurements kept in the store, each from text/<key>.txt
+keys = ['stdev', 'beamarea', 'threshold', 'max', 'center_radio', 'center_radio_wcs', 'center_HST', 'width', 'detect',
+        'estimates']
+
+_local = threading.local()
+_missing = object()
+
+
+def store_path():
+    return store_file if store_file is not None else os.path.join(GetGalaxyList.data_path, 'measurements.db')
+
+
+def text_path(name, key, galaxy_dir=None):
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(name)
+    return os.path.join(galaxy_dir, 'text', '%s.txt' % key)
+
+
+# Connection to the database, one per thread (sqlite connections can't be shared between threads, nor with processes
+# forked from this one, so a worker process opens its own)
+def connect():
+    path = os.path.abspath(store_path())
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    if path not in connections:
+        conn = sqlite3.connect(path, timeout=60.)
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS measurements (name TEXT NOT NULL, key TEXT NOT NULL, '
+                         'value TEXT NOT NULL, mtime REAL NOT NULL, PRIMARY KEY (name, key))')
+        connections[path] = conn
+    return connections[path]
+
+
+# Values of the lines of a text file, as numbers where they parse as one
+def parse_lines(text):
+    values = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '':
+            continue
+        for parse in (int, float):
+            try:
+                values.append(parse(line))
+                break
+            except ValueError:
+                pass
+        else:
+            values.append(line)
+    return values
+
+
+def format_values(values):
+    return ''.join('%s\n' % value for value in values)
+
+
+def _write_text(path, values):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = '%s.%s.%s.tmp' % (path, os.getpid(), threading.current_thread().ident)
+    with open(tmp_path, 'w') as f:
+        f.write(format_values(values))
+    os.rename(tmp_path, path)
+    return os.path.getmtime(path)
+
+
+# Python int or float of a (possibly numpy) number, so it can be stored as json. Anything else is kept as a string
+def _plain(value):
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Number):
+        return float(value)
+    return value.strip()
+
+
+def _stored(conn, name, key):
+    row = conn.execute('SELECT value, mtime FROM measurements WHERE name = ? AND key = ?', (name, key)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0]), row[1]
+
+
+# Write measurements of a galaxy, given as a dictionary of key: list of values, in one transaction
+def put_many(name, measurements, galaxy_dir=None):
+    rows = []
+    for key, values in measurements.items():
+        if key not in keys:
+            raise KeyError('%s is not a known measurement' % key)
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        values = [_plain(value) for value in values]
+        if key in text_keys:
+            mtime = _write_text(text_path(name, key, galaxy_dir), values)
+        else:
+            mtime = time.time()
+        rows.append((name, key, json.dumps(values), mtime))
+    conn = connect()
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO measurements (name, key, value, mtime) VALUES (?, ?, ?, ?)', rows)
+
+
+# Write one measurement of a galaxy, a single value or a list of them
+def put(name, key, values, galaxy_dir=None):
+    put_many(name, {key: values}, galaxy_dir)
+
+
+# Import the text files of a galaxy which are newer than (or missing from) the store, returning the keys imported
+def import_text(name, galaxy_dir=None, force=False):
+    conn = connect()
+    stored = dict((row[0], row[1]) for row in
+                  conn.execute('SELECT key, mtime FROM measurements WHERE name = ?', (name,)))
+    rows = []
+    for key in keys:
+        path = text_path(name, key, galaxy_dir)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if force or key not in stored or mtime > stored[key]:
+            with open(path, 'r') as f:
+                rows.append((name, key, json.dumps(parse_lines(f.read())), mtime))
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO measurements (name, key, value, mtime) VALUES (?, ?, ?, ?)', rows)
+    return [row[1] for row in rows]
+
+
+# Import the text directories of a list of galaxies (default, every galaxy in the data directory)
+def import_sample(names=None, data_path=None, force=False):
+    if data_path is None:
+        data_path = GetGalaxyList.data_path
+    if names is None:
+        names = GetGalaxyList.return_galaxy_list()
+    return dict((name, import_text(name, os.path.join(data_path, name), force)) for name in names)
+
+
+# List of values of a measurement of a galaxy. Raises a KeyError if it has never been measured, unless a default is
+# given
+def get(name, key, default=_missing, galaxy_dir=None):
+    conn = connect()
+    stored = _stored(conn, name, key)
+    if check_text or stored is None:
+        path = text_path(name, key, galaxy_dir)
+        if os.path.exists(path) and (stored is None or os.path.getmtime(path) > stored[1]):
+            import_text(name, galaxy_dir)
+            stored = _stored(conn, name, key)
+    if stored is None:
+        if default is _missing:
+            raise KeyError('%s has no %s measurement' % (name, key))
+        return default
+    return stored[0]
+
+
+# First (often only) value of a measurement
+def get_value(name, key, default=_missing, galaxy_dir=None):
+    values = get(name, key, [] if default is _missing else [default], galaxy_dir)
+    if len(values) == 0:
+        raise KeyError('%s has no %s measurement' % (name, key))
+    return values[0]
+
+
+# Every stored measurement, as a dictionary of galaxy name: {key: list of values}, in one read. Pass names to load only
+# those galaxies. Call import_sample first if the text files may have changed.
+def load_sample(names=None):
+    sample = {}
+    for name, key, value in connect().execute('SELECT name, key, value FROM measurements ORDER BY name'):
+        if names is None or name in names:
+            sample.setdefault(name, {})[key] = json.loads(value)
+    return sample
+
+
+if __name__ == '__main__':
+    imported = import_sample()
+    print('Imported %s measurements of %s galaxies into %s' % (sum(len(v) for v in imported.values()), len(imported),
+                                                               store_path()))
@@ -4,6 +4,8 @@ import os
 from astropy.io import fits
 import GetGalaxyList
 reload(GetGalaxyList)
+import ImageAccess
+import Measurements
 
 
 
@@ -11,9 +13,8 @@ reload(GetGalaxyList)
 found_source = True
 #####################################################################################
 
-current_dir = os.getcwd()
-
 sorted_names = GetGalaxyList.return_galaxy_list()
+Measurements.import_sample(sorted_names)
 
 
 
@@ -39,7 +40,7 @@ y_iter = 0
 
 
 for z in range(num_gals):
-    os.chdir(sorted_names[z])
+    gal_dir = GetGalaxyList.galaxy_dir(sorted_names[z])
 
     if z % cols == 0 and z != 0:
         x_iter = 0
@@ -50,46 +51,29 @@ for z in range(num_gals):
 
     x_iter = x_iter + x_size + x_start
 
-    with open('text/detect.txt', 'r') as f:
-        truth = f.readline()
+    truth = Measurements.get_value(sorted_names[z], 'detect')
 
     if int(truth) == 1:
         weighting = 'heavy'
     else:
         weighting = 'normal'
 
-    imgname = '%s.cutout.pbcor.fits' % sorted_names[z]
-    hdu = fits.open(imgname)
-    bmaj = hdu[0].header['bmaj']
-    bmin = hdu[0].header['bmin']
-    angle = hdu[0].header['bpa']
+    imgname = ImageAccess.cutout_path(sorted_names[z], gal_dir)
+    bmaj, bmin, angle = ImageAccess.beam(imgname)
 
-    f = aplpy.FITSFigure(imgname, figure=fig, subplot=[x, y, x_size, y_size])
+    f = aplpy.FITSFigure(ImageAccess.open_image(imgname)[0], figure=fig, subplot=[x, y, x_size, y_size])
 
     #center = f.pixel2world(100, 100)
     #f.show_circles([center[0]], [center[1]], [4.0 / 3600.0], edgecolor='magenta')
 
-    with open('text/center_HST.txt', 'r') as f_H:
-            lines = f_H.readlines()
-            HST_ra = float(lines[0])
-            HST_dec = float(lines[1])
+    HST_ra, HST_dec = Measurements.get(sorted_names[z], 'center_HST')
 
     if found_source:
-        with open('text/center_radio_wcs.txt') as f_rad:
-            lines = f_rad.readlines()
-            ra = float(lines[0])
-            dec = float(lines[1])		
+        ra, dec = Measurements.get(sorted_names[z], 'center_radio_wcs')
     else:
-        with open('text/center_HST.txt', 'r') as f_center:
-            lines = f_center.readlines()
-            ra = float(lines[0])
-            dec = float(lines[1])
+        ra, dec = HST_ra, HST_dec
 
-    with open('text/width.txt', 'r') as f_width:
-        lines = f_width.readlines()
-        maj_width = float(lines[0])
-        min_width = float(lines[1])
-        PA = float(lines[2])
+    maj_width, min_width, PA = Measurements.get(sorted_names[z], 'width')
 
     f.show_ellipses(ra, dec, min_width/3600., maj_width/3600., angle=PA, edgecolor='magenta', linewidth=3)
     #f.show_markers(HST_ra, HST_dec, marker='x', facecolor='c')
@@ -139,9 +123,6 @@ for z in range(num_gals):
     #f.tick_labels.set_font(size='x-small', weight='medium', stretch='normal', family='sans-serif', style='normal',
                         #variant='normal')
 
-    os.chdir('..')
-
-os.chdir(current_dir)
 plt.savefig('Stamps.png', bbox_inches='tight', pad_inches=0)
 plt.clf()
 plt.close()
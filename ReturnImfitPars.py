@@ -1,29 +1,23 @@
-import os
+import Measurements
+import GetGalaxyList
+import ImfitSummary
 
 
-def get_imfit(gal_name):
+# Flux, flux error, peak and peak error of the first component imfit fitted to a galaxy, from its summary.log (see
+# ImfitSummary.py), also storing the fitted widths as the width measurement
+def get_imfit(gal_name, galaxy_dir=None):
 
-    os.chdir(gal_name)
+    if galaxy_dir is None:
+        galaxy_dir = GetGalaxyList.galaxy_dir(gal_name)
 
-    with open('summary.log', 'r') as f:
-        lines = f.readlines()
-        val_line = lines[2].split(' ')
-        flux = val_line[8]
-        flux_err = val_line[9]
-        max_val = val_line[10]
-        max_err = val_line[11]
+    fit = ImfitSummary.parse_summary(ImfitSummary.summary_path(gal_name, galaxy_dir))[0]
 
     output = []
-    output.append(flux)
-    output.append(flux_err)
-    output.append(max_val)
-    output.append(max_err)
+    output.append(fit['flux'])
+    output.append(fit['flux_err'])
+    output.append(fit['peak'])
+    output.append(fit['peak_err'])
 
-    with open('text/width.txt', 'w') as f_new:
-        f_new.write(val_line[16]+'\n')
-        f_new.write(val_line[17]+'\n')
-        f_new.write(val_line[18]+'\n')
+    Measurements.put(gal_name, 'width', [fit['major'], fit['minor'], fit['pa']], galaxy_dir)
 
-    os.chdir('..')
-
-    return output
\ No newline at end of file
+    return output
@@ -0,0 +1,303 @@
+#
+# Description: Runs the per-galaxy jobs in the shell files generated by generate_cleans.py (pipelinerun), Imfit.py
+# (imfitrun) and generate_flagscripts.py (flaggingrun) on a pool of workers instead of one after another. Each line
+# of those files ("cd <galaxy dir>; ... casa ... -c <script>") is one job. The stdout, stderr, exit code and wall time
+# of every job are kept, failed jobs are retried, and a summary report is written next to the run file.
+#
+# The CASA invocation can be swapped for a stub command (e.g. "python" or "cat") to test the runner without CASA:
+#     python RunPipeline.py pipelinerun --workers 4 --stub "cat"
+#
+# Jobs are started longest first, to finish the whole run as early as possible. The cost of a job is estimated from
+# the CASA script it runs (image size, number of measurement sets, w-projection planes and clean iterations of every
+# tclean call), and converted to seconds using the wall times of previous runs, which are kept in
+# <runfile>_history.json under the full path of each job's directory. With --dry-run the predicted schedule is printed and nothing is run:
+#     python RunPipeline.py pipelinerun --workers 4 --dry-run
+#
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import heapq
+import argparse
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+#############################################################################
+# parameters
+# maximum number of jobs at once, by default one per core, further limited by memory
+max_workers = multiprocessing.cpu_count()
+# memory one CASA imaging job needs, in GB
+mem_per_job = 8.
+# number of times to re-run a job which exits with an error
+retries = 1
+# regular expression matching the CASA invocation in the run files, replaced by the stub command if one is given
+casa_pattern = r'(xvfb-run\s+-d\s+)?casa(-pipe)?(\s+-r\s+\S+)?\s+--nogui\s+-c'
+# guess at the wall time (s) of one unit of cost (one tclean of one measurement set to a 12000 pixel image with 128
+# w-projection planes), used until there are previous runs to learn it from
+seconds_per_unit = 1800.
+# number of previous wall times remembered for each job
+history_length = 5
+#############################################################################
+
+
+# Physical memory of this machine in GB, or None if it can't be determined
+def total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')/1e9
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+# Number of workers to use: the number asked for, bounded by the cores and by the memory available to the jobs
+def worker_count(workers=None, job_memory=None):
+    if workers is None:
+        workers = max_workers
+    if job_memory is None:
+        job_memory = mem_per_job
+    workers = min(workers, multiprocessing.cpu_count())
+    memory = total_memory()
+    if memory is not None and job_memory > 0:
+        workers = min(workers, int(memory/job_memory))
+    return max(workers, 1)
+
+
+# Parse a run file into a list of jobs, one per non-empty line. Each job is labelled by the name of the directory it
+# changes to, which names its logs, and keyed by the full path of that directory, which its history is kept under.
+# A label or key which is already taken gets a -2, -3, ... suffix, so jobs never share logs or history
+def parse_runfile(runfile, stub=None):
+    cwd = os.path.dirname(os.path.abspath(runfile))
+    jobs = []
+    seen = {}
+    with open(runfile, 'r') as f:
+        for line in f:
+            original = line.strip()
+            if not original or original.startswith('#'):
+                continue
+            command = original if stub is None else re.sub(casa_pattern, stub, original)
+            match = re.match(r'cd\s+([^;]+);', original)
+            if match:
+                key = os.path.normpath(os.path.join(cwd, match.group(1).strip()))
+                label = os.path.basename(key)
+            else:
+                key = label = 'job%s' % len(jobs)
+            job = {'label': label, 'key': key, 'command': command, 'original': original}
+            for field in ('label', 'key'):
+                seen[(field, job[field])] = seen.get((field, job[field]), 0) + 1
+                if seen[(field, job[field])] > 1:
+                    job[field] = '%s-%s' % (job[field], seen[(field, job[field])])
+            jobs.append(job)
+    return jobs
+
+
+# Path of the script a job runs (the argument following -c in the run file), or None
+def job_script(job, cwd):
+    command = job.get('original', job['command'])
+    match = re.search(r'-c\s+(\S+)', command)
+    if match is None:
+        return None
+    dir_match = re.match(r'cd\s+([^;]+);', command)
+    candidates = [os.path.join(cwd, match.group(1))]
+    if dir_match:
+        candidates.append(os.path.join(cwd, dir_match.group(1).strip(), match.group(1)))
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+# Relative cost of a job, from the tclean calls in the script it runs. Each call costs in proportion to the number of
+# pixels, the number of measurement sets and the number of w-projection planes, and twice as much if it cleans
+# (niter > 0). Jobs without tclean calls cost one unit
+def job_cost(job, cwd):
+    script = job_script(job, cwd)
+    if script is None:
+        return 1.
+    with open(script, 'r') as f:
+        text = f.read()
+    units = 0.
+    for call in re.findall(r'tclean\((.*?)\)\s*\n', text, re.S):
+        imsize = re.search(r'imsize=\[(\d+)', call)
+        wproj = re.search(r'wprojplanes=(\d+)', call)
+        niter = re.search(r'niter=(\d+)', call)
+        vis = re.search(r'vis=(\[[^\]]*\]|\'[^\']*\')', call)
+        n_ms = max(len(re.findall(r"'[^']*'", vis.group(1))), 1) if vis else 1
+        units += ((float(imsize.group(1))/12000.)**2 if imsize else 1.) * n_ms * \
+            (float(wproj.group(1))/128. if wproj else 1.) * (2. if niter and int(niter.group(1)) > 0 else 1.)
+    return units if units > 0 else 1.
+
+
+def load_history(history_path):
+    if os.path.exists(history_path):
+        with open(history_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+# Remember the cost and wall time of every job which succeeded
+def save_history(history, results, costs, history_path):
+    for result, cost in zip(results, costs):
+        if result['exit_code'] == 0:
+            runs = history.get(result['key'], []) + [[cost, result['wall_time']/result['attempts']]]
+            history[result['key']] = runs[-history_length:]
+    tmp_path = '%s.%s.tmp' % (history_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(history, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, history_path)
+
+
+# Predicted wall time (s) of each job. A job run before with the same cost is predicted to take the median of its
+# previous times; otherwise its cost is converted with the median seconds per unit of all previous runs
+def predict_times(jobs, costs, history):
+    rates = [run[1]/run[0] for runs in history.values() for run in runs if run[0] > 0]
+    rate = float(np.median(rates)) if rates else seconds_per_unit
+    predicted = []
+    for job, cost in zip(jobs, costs):
+        same = [run[1] for run in history.get(job['key'], []) if abs(run[0] - cost) <= 1e-6*cost]
+        predicted.append(float(np.median(same)) if same else cost*rate)
+    return predicted
+
+
+# Longest processing time first list scheduling: jobs in order of decreasing predicted time, each started on the
+# first worker to become free. Returns the order to start the jobs in, and the worker, start and end time of each
+def schedule(predicted, n_workers):
+    order = sorted(range(len(predicted)), key=lambda i: -predicted[i])
+    return order, simulate(order, predicted, n_workers)
+
+
+# Worker, start and end time of each job when the jobs are started in the given order on n_workers
+def simulate(order, predicted, n_workers):
+    free = [(0., w) for w in range(n_workers)]
+    slots = {}
+    for i in order:
+        start, worker = heapq.heappop(free)
+        slots[i] = (worker, start, start + predicted[i])
+        heapq.heappush(free, (start + predicted[i], worker))
+    return slots
+
+
+def print_schedule(jobs, predicted, order, slots, n_workers):
+    print('%-24s %6s %10s %10s %10s' % ('job', 'worker', 'start (s)', 'end (s)', 'time (s)'))
+    for i in order:
+        worker, start, end = slots[i]
+        print('%-24s %6s %10.0f %10.0f %10.0f' % (jobs[i]['label'], worker, start, end, predicted[i]))
+    makespan = max([end for worker, start, end in slots.values()] + [0.])
+    in_file_order = simulate(range(len(jobs)), predicted, n_workers)
+    file_makespan = max([end for worker, start, end in in_file_order.values()] + [0.])
+    print('predicted total: %.0f s on %s workers (%.0f s in file order)' % (makespan, n_workers, file_makespan))
+
+
+# Run one job in a shell from the run file's directory, writing its stdout and stderr to log_dir. Retries failures
+def run_job(job, log_dir, cwd, n_retries=retries):
+    out_path = os.path.join(log_dir, '%s.out' % job['label'])
+    err_path = os.path.join(log_dir, '%s.err' % job['label'])
+    attempts = 0
+    start = time.time()
+    while True:
+        attempts += 1
+        with open(out_path, 'w') as f_out, open(err_path, 'w') as f_err:
+            try:
+                exit_code = subprocess.call(job['command'], shell=True, cwd=cwd, stdout=f_out, stderr=f_err)
+            except OSError as e:
+                f_err.write('%s\n' % e)
+                exit_code = -1
+        if exit_code == 0 or attempts > n_retries:
+            break
+
+    return {'label': job['label'], 'key': job['key'], 'command': job['command'], 'exit_code': exit_code,
+            'attempts': attempts, 'wall_time': time.time() - start, 'stdout': out_path, 'stderr': err_path}
+
+
+# Run a list of jobs on a pool of workers, returning one result per job in the order they were given
+def run_jobs(jobs, cwd, log_dir, workers=None, n_retries=retries, verbose=True):
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    n_workers = min(worker_count(workers), max(len(jobs), 1))
+
+    def run(job):
+        result = run_job(job, log_dir, cwd, n_retries)
+        if verbose:
+            status = 'ok' if result['exit_code'] == 0 else 'FAILED (exit code %s)' % result['exit_code']
+            print('%s: %s in %.1f s' % (result['label'], status, result['wall_time']))
+            sys.stdout.flush()
+        return result
+
+    # jobs are handed to the workers in the order given, as workers become free
+    pool = ThreadPool(n_workers)
+    try:
+        results = pool.map(run, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+# Write a csv report of the results and return the number of failed jobs
+def write_report(results, report_path):
+    columns = ['label', 'exit_code', 'attempts', 'wall_time', 'predicted_time', 'stdout', 'stderr', 'command']
+    with open(report_path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for result in results:
+            writer.writerow([result.get(col) for col in columns])
+    return len([r for r in results if r['exit_code'] != 0])
+
+
+# Run every job in a run file, longest predicted first unless by_cost is False, and write the report. With dry_run,
+# only print the predicted schedule. Returns the results, in the order of the run file
+def run_pipeline(runfile, workers=None, n_retries=retries, stub=None, log_dir=None, verbose=True, by_cost=True,
+                 dry_run=False):
+    runfile = os.path.abspath(runfile)
+    cwd = os.path.dirname(runfile)
+    if log_dir is None:
+        log_dir = os.path.join(cwd, 'logs_%s' % os.path.basename(runfile))
+    history_path = '%s_history.json' % runfile
+    jobs = parse_runfile(runfile, stub)
+
+    history = load_history(history_path)
+    costs = [job_cost(job, cwd) for job in jobs]
+    predicted = predict_times(jobs, costs, history)
+    n_workers = min(worker_count(workers), max(len(jobs), 1))
+    if by_cost:
+        order, slots = schedule(predicted, n_workers)
+    else:
+        order = list(range(len(jobs)))
+        slots = simulate(order, predicted, n_workers)
+    if dry_run:
+        print_schedule(jobs, predicted, order, slots, n_workers)
+        return []
+
+    start = time.time()
+    ordered_results = run_jobs([jobs[i] for i in order], cwd, log_dir, n_workers, n_retries, verbose)
+    results = [None]*len(jobs)
+    for i, result in zip(order, ordered_results):
+        result['predicted_time'] = predicted[i]
+        results[i] = result
+    save_history(history, results, costs, history_path)
+    n_failed = write_report(results, '%s_report.csv' % runfile)
+    if verbose:
+        print('%s jobs, %s failed, %.1f s total (%.1f s of job time)' % (len(results), n_failed, time.time() - start,
+                                                                         sum(r['wall_time'] for r in results)))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the jobs in a generated pipeline run file in parallel')
+    parser.add_argument('runfile', help='pipelinerun, imfitrun or flaggingrun')
+    parser.add_argument('--workers', type=int, default=None, help='maximum number of jobs at once')
+    parser.add_argument('--retries', type=int, default=retries, help='times to re-run a failed job')
+    parser.add_argument('--mem-per-job', type=float, default=mem_per_job, help='memory one job needs (GB)')
+    parser.add_argument('--stub', default=None, help='command to run in place of CASA, e.g. "python"')
+    parser.add_argument('--log-dir', default=None, help='directory for per-job stdout/stderr')
+    parser.add_argument('--file-order', action='store_true', help='start jobs in file order instead of longest first')
+    parser.add_argument('--dry-run', action='store_true', help='print the predicted schedule without running anything')
+    args = parser.parse_args()
+
+    mem_per_job = args.mem_per_job
+    results = run_pipeline(args.runfile, args.workers, args.retries, args.stub, args.log_dir,
+                           by_cost=not args.file_order, dry_run=args.dry_run)
+    sys.exit(1 if any(r['exit_code'] != 0 for r in results) else 0)
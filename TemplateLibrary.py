@@ -0,0 +1,160 @@
+#
+# Description: Loads the Kirkpatrick et al. (2015) templates in Comprehensive_library/ and the Chary & Elbaz (2001)
+# save file once, into contiguous 2-D arrays (one row per template, padded with NaN since the templates are not all
+# sampled at the same wavelengths). The arrays are cached on disk in cache/template_library.npz, which is rebuilt
+# whenever any of the template files change. Redshifting is done for all templates and an array of redshifts at once.
+#
+
+import os
+import glob
+import json
+import threading
+import numpy as np
+import Cache
+
+#######################################################################
+# parameters
+library_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Comprehensive_library')
+chary_elbaz_file = '/Users/graysonpetter/Downloads/chary_elbaz_codes/chary_elbaz.save'
+#######################################################################
+
+# bump when the layout of the cache file changes
+cache_version = 1
+
+_library = None
+# held while the library is loaded, so that threads asking for it at once load it only once
+_lock = threading.RLock()
+
+
+# (name, modification time, size) of every file the library is built from, used to invalidate the cache
+def _fingerprint(paths):
+    return [[os.path.basename(p), os.path.getmtime(p), os.path.getsize(p)] for p in paths]
+
+
+# Read a template text file: wavelength (microns), luminosity and luminosity error columns
+def read_template(path):
+    return np.loadtxt(path, usecols=(0, 1, 2), unpack=True)
+
+
+class TemplateLibrary(object):
+
+    def __init__(self):
+        self.paths = sorted(glob.glob(os.path.join(library_dir, '*.txt')))
+        sources = list(self.paths)
+        if os.path.exists(chary_elbaz_file):
+            sources.append(chary_elbaz_file)
+        fingerprint = [cache_version] + _fingerprint(sources)
+
+        cache_file = Cache.cache_path('template_library.npz')
+        stored = None
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                if json.loads(str(data['fingerprint'])) == json.loads(json.dumps(fingerprint)):
+                    stored = dict((key, data[key]) for key in data.files)
+
+        if stored is None:
+            stored = self._build()
+            tmp_file = '%s.%s.%s.tmp.npz' % (cache_file[:-4], os.getpid(), threading.current_thread().ident)
+            np.savez(tmp_file, fingerprint=json.dumps(fingerprint), **stored)
+            os.rename(tmp_file, cache_file)
+
+        self.fingerprint = fingerprint
+        self.names = [os.path.basename(p).split('.txt')[0] for p in self.paths]
+        self.npoints = np.array(stored['npoints'])
+        self.waves = np.ascontiguousarray(stored['waves'])
+        self.lums = np.ascontiguousarray(stored['lums'])
+        self.lum_errs = np.ascontiguousarray(stored['lum_errs'])
+        self.ce_waves = stored['ce_waves'] if len(stored['ce_waves']) else None
+        self.ce_lums = stored['ce_lums'] if len(stored['ce_lums']) else None
+        self.ce_lir = stored['ce_lir'] if len(stored['ce_lir']) else None
+
+        # the store is shared by everything that asks for a spectrum, so protect it from accidental modification
+        for arr in (self.waves, self.lums, self.lum_errs):
+            arr.setflags(write=False)
+
+        self._extra = {}
+
+    # Parse every template file into NaN-padded 2-D arrays
+    def _build(self):
+        spectra = [read_template(p) for p in self.paths]
+        npoints = np.array([len(s[0]) for s in spectra])
+        shape = (len(spectra), npoints.max() if len(spectra) else 0)
+        arrays = {}
+        for i, key in enumerate(['waves', 'lums', 'lum_errs']):
+            arrays[key] = np.full(shape, np.nan)
+            for j, spec in enumerate(spectra):
+                arrays[key][j, :npoints[j]] = spec[i]
+        arrays['npoints'] = npoints
+
+        if os.path.exists(chary_elbaz_file):
+            from scipy.io import readsav
+            char_e = readsav(chary_elbaz_file)
+            arrays['ce_waves'] = np.array(char_e['lambda'], dtype=float)
+            arrays['ce_lums'] = np.transpose(np.array(char_e['nuLnuinLsun'], dtype=float))
+            arrays['ce_lir'] = np.array(char_e['Lir'], dtype=float)
+        else:
+            arrays['ce_waves'], arrays['ce_lums'], arrays['ce_lir'] = np.array([]), np.array([]), np.array([])
+        return arrays
+
+    # Row of a template in the store, given its index, name or path to its file
+    def index(self, template):
+        if isinstance(template, (int, np.integer)):
+            return int(template)
+        name = os.path.basename(str(template)).split('.txt')[0]
+        if name in self.names:
+            return self.names.index(name)
+        return None
+
+    # (name, modification time, size) of the file a template (index, name or path) was read from
+    def file_fingerprint(self, template):
+        idx = self.index(template)
+        if idx is None:
+            return _fingerprint([template])[0]
+        # the fingerprint starts with the cache version, followed by the library files in order
+        return self.fingerprint[idx + 1]
+
+    # Rest-frame wavelengths and luminosities of a template (read-only views of the store). Files outside of the
+    # library directory are read once and remembered
+    def spectrum(self, template):
+        idx = self.index(template)
+        if idx is None:
+            if template not in self._extra:
+                waves, lums = read_template(template)[:2]
+                self._extra[template] = (waves, lums)
+            return self._extra[template]
+        n = self.npoints[idx]
+        return self.waves[idx, :n], self.lums[idx, :n]
+
+    # Observed wavelengths of every template at every redshift, shape (redshifts, templates, wavelengths)
+    def redshift(self, z):
+        z = np.atleast_1d(np.asarray(z, dtype=float))
+        return self.waves[None, :, :]*(1+z)[:, None, None]
+
+    # Luminosity of every template at the rest wavelength which is redshifted closest to an observed wavelength
+    # (e.g. 12 or 22 microns), for an array of redshifts. With trim, only the 8-1000 micron range is considered,
+    # as in Templates.redshift_spectrum. Returns an array of shape (redshifts, templates)
+    def lum_at_observed(self, z, observed_wave, templates=None, trim=False):
+        z = np.atleast_1d(np.asarray(z, dtype=float))
+        rows = range(len(self.names)) if templates is None else [self.index(t) for t in templates]
+        out = np.empty((len(z), len(rows)))
+        target = observed_wave/(1+z)
+        for j, row in enumerate(rows):
+            waves, lums = self.spectrum(row)
+            if trim:
+                keep = np.where((waves >= 8.) & (waves <= 1000.))[0]
+                waves, lums = waves[keep], lums[keep]
+            # nearest wavelength, choosing the shorter one on ties like argmin would
+            right = np.clip(np.searchsorted(waves, target), 1, len(waves) - 1)
+            left = right - 1
+            nearest = np.where(np.abs(target - waves[left]) <= np.abs(waves[right] - target), left, right)
+            out[:, j] = lums[nearest]
+        return out
+
+
+# Return the library, loading it the first time it is needed
+def get_library():
+    global _library
+    with _lock:
+        if _library is None:
+            _library = TemplateLibrary()
+    return _library
@@ -4,12 +4,18 @@
 import numpy as np
 from astropy import units as u
 from astropy import constants as const
+from astropy.table import Table
+import os
+import json
 import math
 import pickle
-from scipy.io import readsav
+import threading
 from scipy.optimize import curve_fit
 import WISE
-from astropy.cosmology import FlatLambdaCDM
+import Distances
+import Cache
+import TemplateLibrary
+import WiseGrid
 import pandas as pd
 import glob
 
@@ -19,31 +25,40 @@ c = 299792458. # m/s
 # path to project
 projpath = '/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs/'
 
-# set cosmology for calculating luminosity distance
-cosmo = FlatLambdaCDM(H0=70, Om0=0.3)
-
 # Read in all templates except for AGN (SFGs and Composite)
 templates = glob.glob(projpath + 'Comprehensive_library/SFG*.txt')
 templates.extend(
     glob.glob(projpath + 'Comprehensive_library/Comp*.txt'))
 
-char_e = readsav('/Users/graysonpetter/Downloads/chary_elbaz_codes/chary_elbaz.save')
-ce_temps = np.transpose(char_e['nuLnuinLsun'])
-ce_waves = char_e['lambda']
-ce_tots = char_e['Lir']
 wise_bandpasses_3_4 = sorted(glob.glob(projpath + 'bandpass/*.txt'))[2:4]
+# look up synthetic WISE photometry in the precomputed (template x redshift x band) grid instead of integrating
+use_wise_grid = True
+
+# bump when the way template totals are computed changes
+totals_version = 1
+
+# template totals, keyed by the fingerprint of the template file, filled in lazily
+_totals = None
+# held while the totals are worked out and saved, so that threads don't integrate or write them at the same time
+_totals_lock = threading.RLock()
+
+
+# Chary & Elbaz (2001) templates (one row per template), their wavelengths and total IR luminosities, read from the
+# save file the first time they are needed
+def chary_elbaz_templates():
+    library = TemplateLibrary.get_library()
+    if library.ce_lums is None:
+        raise IOError('Chary & Elbaz save file %s not found' % TemplateLibrary.chary_elbaz_file)
+    return library.ce_lums, library.ce_waves, library.ce_lir
 
 
 # take in a template and redshift every wavelength
 def redshift_spectrum(z, template, trim, table):
     if table:
-        t = pd.read_csv(template, delim_whitespace=True, engine='python', header=None)
-        #t.columns = ['lambda_e', 'L', 'dL']
-
-        wavelengths = np.array(t.iloc[:, 0])
-        Lums = np.array(t.iloc[:, 1])
+        # parsed once for all templates by the template library
+        wavelengths, Lums = TemplateLibrary.get_library().spectrum(template)
     else:
-        wavelengths = ce_waves
+        wavelengths = chary_elbaz_templates()[1]
         Lums = template
 
 
@@ -64,11 +79,11 @@ def redshift_spectrum(z, template, trim, table):
 
 def interpolate_spec(shifted_spec, model):
     # convert wavelengths in microns to frequencies in Hz
-    nus = (10 ** 6) * c / (shifted_spec[0])
+    nus = (10 ** 6) * c / np.asarray(shifted_spec[0], dtype=float)
 
     # reverse lists so frequencies go from low to high for simplicity
     reversed_nus = np.flipud(nus).flatten()
-    reversed_lums = np.flipud(shifted_spec[1])
+    reversed_lums = np.flipud(np.asarray(shifted_spec[1], dtype=float))
 
     # calculate constant interval to interpolate on
     if model:
@@ -84,39 +99,33 @@ def interpolate_spec(shifted_spec, model):
     span = reversed_nus[len(reversed_nus) - 1] - reversed_nus[0]
     chunks = int(math.floor(span / dx))
 
-    new_nus, new_lums = [], []
-    current_nu = start
-
-    # linearly interpolate to frequencies in dx Hz steps
-    for x in range(chunks):
-        new_nus.append(current_nu)
-        new_lums.append(np.interp(current_nu, reversed_nus, reversed_lums))
-        current_nu += dx
+    # linearly interpolate to frequencies in dx Hz steps, all at once
+    new_nus = start + dx*np.arange(chunks)
+    new_lums = np.interp(new_nus, reversed_nus, reversed_lums)
 
     return new_nus, new_lums, dx
 
 
-# integrate spectrum using trapezoid method (rectangle below
-def integrate_spectrum(freqs, Ls, dx):
-    tot_ir = 0.
-    for x in range(len(freqs) - 1):
-        if Ls[x + 1] > Ls[x]:
-            rect = dx * Ls[x]
-            tri = (dx * (Ls[x + 1] - Ls[x])) / 2.
-
-        else:
-            rect = dx * Ls[x + 1]
-            tri = (dx * (Ls[x] - Ls[x + 1])) / 2.
+# integrate spectrum sampled every dx using the trapezoid method (a rectangle below each step plus the triangle on
+# top of it). Ls can hold many spectra sampled at the same frequencies, integrated along axis
+def integrate_spectrum(freqs, Ls, dx, axis=-1):
+    Ls = np.moveaxis(np.asarray(Ls, dtype=float), axis, -1)
+    return dx * np.sum(Ls[..., 1:] + Ls[..., :-1], axis=-1) / 2.
 
-        tot_ir += (rect + tri)
 
-    return tot_ir
+# integrate spectra directly on their native (non-uniform) wavelength sampling with the trapezoid method in frequency,
+# skipping the resampling step. waves in microns, either one array shared by all spectra or one row per spectrum.
+# NaN padding (as in TemplateLibrary) contributes nothing
+def integrate_native(waves, Ls, axis=-1):
+    nus = np.moveaxis((10 ** 6) * c / np.asarray(waves, dtype=float), axis, -1)
+    Ls = np.moveaxis(np.asarray(Ls, dtype=float), axis, -1)
+    areas = np.abs(np.diff(nus, axis=-1)) * (Ls[..., 1:] + Ls[..., :-1]) / 2.
+    return np.nansum(areas, axis=-1)
 
 
 def test_templates(zz):
     ratio_list = []
-    with open(projpath + 'integrations/kirk.txt', 'rb') as fb:
-        total_ir = np.array(pickle.load(fb))
+    total_ir = template_totals()
 
     for x in range(len(templates)):
         shifted_spectrum = redshift_spectrum(zz, templates[x], True, True)
@@ -159,9 +168,7 @@ def simulate_wise_fluxes_for_colors(z, tems, bands, csv):
             trimmed_L = lumi[cut]
 
             # interpolate template to band wavelengths, multiply by the response at that wavelength
-            inter_lum = []
-            for j in range(len(bandwaves)):
-                inter_lum.append(band_response[j] * (np.interp(bandwaves[j], trimmed_y, trimmed_L)))
+            inter_lum = band_response * np.interp(bandwaves, trimmed_y, trimmed_L)
 
             # crude method
             """sum_lum = np.sum(np.array(inter_lum))
@@ -212,9 +219,7 @@ def simulate_wise_fluxes(z, tem, bands, csv):
         trimmed_L = lumi[cut]
 
         # interpolate template to band wavelengths, multiply by the response at that wavelength
-        inter_lum = []
-        for i in range(len(bandwaves)):
-            inter_lum.append(band_apple[i]  * (np.interp(bandwaves[i], trimmed_y, trimmed_L)))
+        inter_lum = band_apple * np.interp(bandwaves, trimmed_y, trimmed_L)
 
         # crude method
         """sum_lum = np.sum(np.array(inter_lum))
@@ -237,6 +242,7 @@ def simulate_wise_fluxes(z, tem, bands, csv):
 
 
 def chary_elbaz(zz):
+    ce_temps, ce_waves, ce_tots = chary_elbaz_templates()
     ratios = []
     for i in range(len(ce_tots)):
         shifted = redshift_spectrum(zz, ce_temps[i], True, False)
@@ -249,16 +255,41 @@ def chary_elbaz(zz):
     # range_ratios = np.ptp(ratio_list)
     return stdev / averg
 
+# Total 8-1000 micron luminosity of each template, integrated the first time it is needed and remembered both in
+# memory and in the cache directory, where an entry is only used while its template file is unchanged
+def template_totals(tems=None):
+    global _totals
+    if tems is None:
+        tems = templates
+    library = TemplateLibrary.get_library()
+    cache_file = Cache.cache_path('template_totals_v%s.json' % totals_version)
+    keys = [json.dumps(library.file_fingerprint(tem)) for tem in tems]
+    with _totals_lock:
+        if _totals is None:
+            _totals = {}
+            if os.path.exists(cache_file):
+                with open(cache_file, 'r') as f:
+                    _totals = json.load(f)
+
+        missing = [x for x in range(len(tems)) if keys[x] not in _totals]
+        for x in missing:
+            shifted_spectrum = redshift_spectrum(0, tems[x], True, True)
+            interped_spectrum = interpolate_spec(shifted_spectrum, False)
+            _totals[keys[x]] = float(integrate_spectrum(interped_spectrum[0], interped_spectrum[1],
+                                                        interped_spectrum[2]))
+        if len(missing) > 0:
+            tmp_file = '%s.%s.%s.tmp' % (cache_file, os.getpid(), threading.current_thread().ident)
+            with open(tmp_file, 'w') as f:
+                json.dump(_totals, f)
+            os.rename(tmp_file, cache_file)
+
+        return np.array([_totals[key] for key in keys])
+
+
+# write the template totals to integrations/kirk.txt for anything still reading them from there
 def writetotals():
-    totlist = []
-    for x in range(len(templates)):
-        shifted_spectrum = redshift_spectrum(0, templates[x], True, True)
-        interped_spectrum = interpolate_spec(shifted_spectrum, False)
-        total_ir = integrate_spectrum(interped_spectrum[0], interped_spectrum[1], interped_spectrum[2])
-        totlist.append(total_ir)
     with open(projpath + 'integrations/kirk.txt', 'wb') as fb:
-        pickle.dump(totlist, fb)
-writetotals()
+        pickle.dump(list(template_totals()), fb)
 
 
 def Kennicut1998(L_IR, L_ir_err):
@@ -277,7 +308,8 @@ def murphyIRSFR(L_IR, L_ir_err):
 
 def test_SFRs(z, name, table, tems=templates):
 
-    d = cosmo.luminosity_distance(z)
+    # luminosity distance from the shared lookup table (flat LCDM, H0=70, Om0=0.3)
+    d = Distances.luminosity_distance(z)*u.Mpc
     fluxes = WISE.mag_to_flux(name)
     w3_flux = fluxes[0] * u.Jy
     w3_flux_err = fluxes[2] * u.Jy
@@ -296,11 +328,12 @@ def test_SFRs(z, name, table, tems=templates):
         w4_lum_err = ((4*np.pi*d**2)*w4_flux_err).to('W/Hz')
     # which templates to use (kirk = kirkpatrick 2015, chary = chary & elbaz, both= both of them)
     key = 'kirk'
+    if key != 'kirk':
+        ce_temps, ce_waves, ce_tots = chary_elbaz_templates()
 
     SFRs, SFR_errs = [], []
     if key=='both':
-        with open(projpath + 'integrations/kirk.txt', 'rb') as fb:
-            total_ir = np.array(pickle.load(fb))
+        total_ir = template_totals(tems)
         for i, tem in enumerate(tems):
 
             tem_lum = redshift_spectrum(z, tem, True, table)
@@ -346,29 +379,20 @@ def test_SFRs(z, name, table, tems=templates):
             SFRs.append(SFR)
 
     elif key == 'kirk':
-        with open(projpath + 'integrations/kirk.txt', 'rb') as fb:
-            total_ir = np.array(pickle.load(fb))
+        total_ir = template_totals(tems)
         for i, tem in enumerate(tems):
             tem_lum = redshift_spectrum(z, tem, False, table)
 
             if w_four_good:
-                wavelengthsaye = tem_lum[4]
-                maxcutoff = min((np.where(wavelengthsaye > 25.0)[0]))
-                mincutoff = max(np.where(wavelengthsaye < 7.)[0])
-                lums = tem_lum[1][mincutoff:maxcutoff]
-                lams = np.array(tem_lum[4])[mincutoff:maxcutoff]
-
-                fit = np.flipud(np.polyfit(lams, lums, 12))
-
                 lambdas = np.array([float(12.082), float(22.194)])
                 measured_lums = np.array([float(w3_lum.value), float(w4_lum.value)])
                 measured_lum_errs = np.array([float(w3_lum_err.value), float(w4_lum_err.value)])
 
-
-                def func(x, a):
-                    return a * sum((q * x ** j for j, q in enumerate(fit)))
                 if simulate_flux:
-                    simulated = np.array(simulate_wise_fluxes(z, tem, wise_bandpasses_3_4, False))
+                    if use_wise_grid:
+                        simulated = WiseGrid.get_grid(wise_bandpasses_3_4).simulate_wise_fluxes(z, tem)
+                    else:
+                        simulated = np.array(simulate_wise_fluxes(z, tem, wise_bandpasses_3_4, False))
 
                     #def func(a):
                     #    return a*simulated
@@ -376,6 +400,18 @@ def test_SFRs(z, name, table, tems=templates):
                     l_ratio = (measured_lums[0]*simulated[0]/(measured_lum_errs[0])**2 + measured_lums[1]*simulated[1]/(measured_lum_errs[1])**2)/((simulated[0]/measured_lum_errs[0])**2 + (simulated[1]/measured_lum_errs[1])**2)
                     normalization_percent_err = 0
                 else:
+                    # fit a polynomial to the template around the W3 and W4 bands, normalize it to the measurements
+                    wavelengthsaye = tem_lum[4]
+                    maxcutoff = min((np.where(wavelengthsaye > 25.0)[0]))
+                    mincutoff = max(np.where(wavelengthsaye < 7.)[0])
+                    lums = tem_lum[1][mincutoff:maxcutoff]
+                    lams = np.array(tem_lum[4])[mincutoff:maxcutoff]
+
+                    fit = np.flipud(np.polyfit(lams, lums, 12))
+
+                    def func(x, a):
+                        return a * sum((q * x ** j for j, q in enumerate(fit)))
+
                     popt, pcov = curve_fit(func, lambdas, measured_lums, sigma=measured_lum_errs)
                     l_ratio = float(popt)
                     normalization_percent_err = np.sqrt(float(pcov)) / float(popt)
@@ -405,3 +441,67 @@ def test_SFRs(z, name, table, tems=templates):
     return np.average(SFRs), np.std(SFRs), SFR_uncertainty
 
 
+# WISE W3 and W4 spectral luminosities (W/Hz) and errors of galaxies at redshifts zs, given their short names
+def wise_luminosities(zs, names):
+    d = Distances.luminosity_distance(np.asarray(zs, dtype=float))*u.Mpc
+    fluxes = np.array([WISE.mag_to_flux(name) for name in names], dtype=float) * u.Jy
+    area = 4*np.pi*d**2
+    lums = (fluxes*area[:, None]).to('W/Hz').value
+    return lums[:, 0], lums[:, 2], lums[:, 1], lums[:, 3]
+
+
+# Normalize every template to the W3/W4 luminosities (W/Hz) of every galaxy at once, as test_SFRs does with the
+# Kirkpatrick templates one galaxy and template at a time. Galaxies with W4 data use the error-weighted least squares
+# normalization to the synthetic W3/W4 photometry, otherwise the template is scaled to W3 at 12 microns.
+# Returns a table with one row per galaxy: mean total IR luminosity and SFR over the templates, the scatter of the SFR
+# between templates, the uncertainty of the mean SFR, and the SFRs from each template
+def fit_templates(zs, w3_lum, w3_lum_err, w4_lum, w4_lum_err, tems=None):
+    if tems is None:
+        tems = templates
+    zs = np.atleast_1d(np.asarray(zs, dtype=float))
+    w3_lum, w3_lum_err = np.atleast_1d(w3_lum).astype(float), np.atleast_1d(w3_lum_err).astype(float)
+    w4_lum, w4_lum_err = np.atleast_1d(w4_lum).astype(float), np.atleast_1d(w4_lum_err).astype(float)
+    w_four_good = ~np.isnan(w4_lum)
+
+    # normalization of each template to each galaxy, shape (galaxies, templates)
+    l_ratio = np.empty((len(zs), len(tems)))
+    normalization_percent_err = np.zeros((len(zs), len(tems)))
+
+    if np.any(w_four_good):
+        grid = WiseGrid.get_grid(wise_bandpasses_3_4)
+        simulated = np.array([grid.simulate_wise_fluxes(zs[w_four_good], tem) for tem in tems])
+        s3, s4 = simulated[..., 0].T, simulated[..., 1].T
+        m3, e3 = w3_lum[w_four_good][:, None], w3_lum_err[w_four_good][:, None]
+        m4, e4 = w4_lum[w_four_good][:, None], w4_lum_err[w_four_good][:, None]
+        l_ratio[w_four_good] = (m3*s3/e3**2 + m4*s4/e4**2)/((s3/e3)**2 + (s4/e4)**2)
+
+    if np.any(~w_four_good):
+        twelve_mu = TemplateLibrary.get_library().lum_at_observed(zs[~w_four_good], 12., templates=tems)
+        l_ratio[~w_four_good] = w3_lum[~w_four_good][:, None]/twelve_mu
+        normalization_percent_err[~w_four_good] = (w3_lum_err/w3_lum)[~w_four_good][:, None]
+
+    # total IR luminosity in W and SFR (Murphy et al. 2011) for every galaxy and template
+    L_ir_tot = template_totals(tems)[None, :]*l_ratio
+    SFRs = 3.88e-44*(L_ir_tot*u.W).to('erg/s').value
+    SFR_errs = normalization_percent_err*SFRs
+
+    result = Table()
+    result['Z'] = zs
+    result['W4 used'] = w_four_good
+    result['IR Luminosity'] = np.mean(L_ir_tot, axis=1)
+    result['IR Luminosity'].unit = 'W'
+    result['SFR'] = np.mean(SFRs, axis=1)
+    result['SFR scatter'] = np.std(SFRs, axis=1)
+    result['SFR uncertainty'] = np.sqrt(np.sum(np.square(SFR_errs), axis=1))/len(tems)
+    result['Template SFRs'] = SFRs
+    for col in ['SFR', 'SFR scatter', 'SFR uncertainty', 'Template SFRs']:
+        result[col].unit = 'solMass/yr'
+    return result
+
+
+# IR SFR of one galaxy from the Kirkpatrick templates normalized to its WISE photometry: the mean over templates,
+# the scatter between templates and the uncertainty of the mean
+def IR_SFRs(z, name, tems=None):
+    lums = wise_luminosities(np.atleast_1d(z), [name])
+    result = fit_templates(np.atleast_1d(z), lums[0], lums[1], lums[2], lums[3], tems)
+    return result['SFR'][0], result['SFR scatter'][0], result['SFR uncertainty'][0]
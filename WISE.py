@@ -5,11 +5,16 @@ import numpy as np
 from astropy.table import Table
 from os import getcwd
 
+# path to the unWISE photometry table of a galaxy
+def unwise_path(name):
+	return '/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs/unWISE/%s.fits' % name
+
+
 # convert from WISE magnitudes to fluxes in Jy
 def mag_to_flux(name):
 
 
-	WISEdir = '/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs/unWISE/%s.fits' % name
+	WISEdir = unwise_path(name)
 	t = Table.read(WISEdir)
 
 	# constants given at http://wise2.ipac.caltech.edu/docs/release/allsky/expsup/sec4_4h.html#example
@@ -27,7 +32,7 @@ def mag_to_flux(name):
 
 # calculate WISE colors and errors
 def colors(name):
-	pat = '/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs/unWISE/%s.fits' % name
+	pat = unwise_path(name)
 	t = Table.read(pat)
 	# W1-W2
 	one_two = float(t['w1_mag'])-float(t['w2_mag'])
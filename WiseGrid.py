@@ -0,0 +1,134 @@
+#
+# Description: Precomputed synthetic WISE photometry. For every template in the library, every band and a grid of
+# redshifts, computes the response-weighted band average luminosity exactly as Templates.simulate_wise_fluxes does,
+# once, and stores the (template x redshift x band) grid on disk (cache/wise_grid_*.npz). Values at arbitrary
+# redshifts are served by linear interpolation in redshift, so fitting a whole catalog is a table lookup.
+#
+# The resample-and-integrate step of simulate_wise_fluxes is linear in the spectrum, so for each band it reduces to a
+# fixed vector of weights on the bandpass wavelengths, which is worked out once per band.
+#
+# Accuracy: grid points reproduce simulate_wise_fluxes to rounding error; between them, the default redshift step of
+# 5e-4 keeps the interpolation error for the Kirkpatrick templates below ~1e-4 (PAH features set the scale).
+#
+
+import os
+import glob
+import threading
+import numpy as np
+import Cache
+import TemplateLibrary
+
+#######################################################################
+# parameters
+# WISE bands 3 and 4 by default, as in Templates.py
+bandpass_files = sorted(glob.glob('/Users/graysonpetter/Desktop/Dartmouth/HIZEA/hizea-VLA-SFRs/bandpass/*.txt'))[2:4]
+z_min = 0.
+z_max = 2.
+z_step = 0.0005
+#######################################################################
+
+# bump when the way the grid is computed changes
+grid_version = 1
+
+_bandpasses = {}
+_grids = {}
+# held while a grid is built, so that threads asking for the same grid at once build it only once
+_lock = threading.RLock()
+
+
+# Read a bandpass file (wavelength in microns, relative response), once per file
+def read_bandpass(path):
+    if path not in _bandpasses:
+        waves, response = np.loadtxt(path, usecols=(0, 1), unpack=True)
+        _bandpasses[path] = (waves, response)
+    return _bandpasses[path]
+
+
+# Weights w such that integrate_spectrum(*interpolate_spec([bandwaves, L], True)) == np.dot(w, L) for any L
+# sampled at bandwaves
+def band_weights(bandwaves):
+    import Templates
+    new_nus, dummy, dx = Templates.interpolate_spec([bandwaves, np.zeros(len(bandwaves))], True)
+
+    # frequencies ascending, as interpolate_spec works on them
+    nus = np.flipud((10 ** 6) * Templates.c / np.asarray(bandwaves, dtype=float))
+    left = np.clip(np.searchsorted(nus, new_nus, side='right') - 1, 0, len(nus) - 2)
+    frac = np.clip((new_nus - nus[left]) / (nus[left + 1] - nus[left]), 0., 1.)
+
+    # trapezoid weights of the resampled points
+    trap = np.full(len(new_nus), dx)
+    if len(trap):
+        trap[0] = trap[-1] = dx / 2.
+
+    weights = np.zeros(len(nus))
+    np.add.at(weights, left, trap * (1. - frac))
+    np.add.at(weights, left + 1, trap * frac)
+    return np.flipud(weights)
+
+
+class WiseGrid(object):
+
+    # Build (or load from cache) the grid for a list of bandpass files
+    def __init__(self, bands=None):
+        self.bands = list(bandpass_files if bands is None else bands)
+        library = TemplateLibrary.get_library()
+        self.names = list(library.names)
+
+        config = {'version': grid_version, 'library': library.fingerprint, 'z': [z_min, z_max, z_step],
+                  'bands': TemplateLibrary._fingerprint(self.bands)}
+        cache_file = Cache.cache_path('wise_grid_%s.npz' % Cache.config_hash(config))
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                self.z, self.grid = data['z'], data['grid']
+        else:
+            self.z = np.linspace(z_min, z_max, int(round((z_max - z_min) / z_step)) + 1)
+            self.grid = self._build(library)
+            tmp_file = '%s.%s.%s.tmp.npz' % (cache_file[:-4], os.getpid(), threading.current_thread().ident)
+            np.savez(tmp_file, z=self.z, grid=self.grid)
+            os.rename(tmp_file, cache_file)
+
+    # Band averaged luminosity of every template at every grid redshift, shape (templates, redshifts, bands)
+    def _build(self, library):
+        grid = np.empty((len(self.names), len(self.z), len(self.bands)))
+        for b, path in enumerate(self.bands):
+            bandwaves, band_response = read_bandpass(path)
+            band_apple = bandwaves * band_response
+            # integrating template x response, then dividing by the integrated response, is a weighted average
+            effective = band_weights(bandwaves) * band_apple
+            effective /= np.sum(effective)
+            lo_wave, hi_wave = np.min(bandwaves), np.max(bandwaves)
+
+            for t in range(len(self.names)):
+                waves, lumi = library.spectrum(t)
+                for k, z in enumerate(self.z):
+                    # trim template to same wavelength range as WISE band
+                    red_waves = waves * (1 + z)
+                    lo = np.searchsorted(red_waves, lo_wave, side='left')
+                    hi = np.searchsorted(red_waves, hi_wave, side='right')
+                    if hi <= lo:
+                        grid[t, k, b] = np.nan
+                        continue
+                    inter_lum = np.interp(bandwaves, red_waves[lo:hi], lumi[lo:hi])
+                    grid[t, k, b] = np.dot(effective, inter_lum)
+        return grid
+
+    # Band averaged luminosities of a template (index, name or path) at redshift(s) z, equivalent to
+    # Templates.simulate_wise_fluxes. Returns one value per band for a scalar z, or an array of shape (redshifts, bands)
+    def simulate_wise_fluxes(self, z, template):
+        idx = TemplateLibrary.get_library().index(template)
+        if idx is None:
+            raise ValueError('Template %s is not in the library' % template)
+        z_arr = np.asarray(z, dtype=float)
+        if np.any(z_arr < self.z[0]) or np.any(z_arr > self.z[-1]):
+            raise ValueError('Redshift outside of WISE grid range [%g, %g]' % (self.z[0], self.z[-1]))
+        out = np.array([np.interp(z_arr, self.z, self.grid[idx, :, b]) for b in range(len(self.bands))])
+        return np.moveaxis(out, 0, -1)
+
+
+# Return the grid for a list of bandpass files, building it the first time it is needed
+def get_grid(bands=None):
+    key = tuple(bandpass_files if bands is None else bands)
+    with _lock:
+        if key not in _grids:
+            _grids[key] = WiseGrid(list(key))
+    return _grids[key]
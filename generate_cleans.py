@@ -1,326 +1,316 @@
 import os
 import stat
+import Cache
+import ImagingParams
 import GetGalaxyList
 reload(GetGalaxyList)
 
 vises = []
 
-current_dir = os.getcwd()
 names = GetGalaxyList.return_galaxy_list()
 
 
 # for each galaxy, find all .ms files and append to visibilities list
 for name in names:
-    all_dirs = os.listdir(name)
+    all_dirs = os.listdir(GetGalaxyList.galaxy_dir(name))
     only_ms = [y for y in all_dirs if y.endswith('.ms')]
     vises.append(only_ms)
 
 paths_to_files, paths_to_dirs = [], []
-dirty_has_run = False
-clean_has_run = False
-pb_has_run = False
-cutout_has_run = False
-stats_has_run = False
 
 
 ############################################################################
 # parameters
 clean_sigma = 3  # factor to multiply rms by to set threshold to clean down to
-img_size = 12000  # Using a 0.2 arcsec pixel, this is a 40 arcmin frame, should be a bit larger than the primary beam
-cutout_size = 200  # Using 0.2 arcsec pixel, a cutout of 40 arcsec is produced
-cut_frame = [img_size/2-cutout_size/2, img_size/2+cutout_size/2]
+# Image size, masking thresholds, niter, scales and cutout size are set per galaxy in imaging_params.csv (see
+# ImagingParams.py). By default a 12000 pixel image, which using a 0.2 arcsec pixel is a 40 arcmin frame, a bit larger
+# than the primary beam, and a 200 pixel (40 arcsec) cutout. Fields with bright sources off to the side get bigger
+# images, and fields where prominent sidelobes are being burned into the image get higher sidelobe thresholds
+
+# Stages to bring up to date, along with every stage they depend on. Stages whose products are current are skipped
+targets = ['cutout', 'statistics']
+# Stages to redo even if their products are current (e.g. ['clean'] to re-clean every galaxy)
+force = []
+# Take stages whose products exist but which have no stamp file (galaxies imaged before stamps were written) to be
+# current, writing their stamps, instead of imaging them again from scratch
+adopt = True
 ############################################################################
 
 
-# Make image sizes bigger for fields which have bright sources off to the side
-def readjust_size(name):
-    big14k = ['J134136.79', 'J090842.76', 'J010624.25', 'J090133.42', 'J123215.82', 'J211625.14',
-              'J211824.06', 'J110702.87']
-    big15k = ['J112518.89', 'J214000.49']
-    big16k = ['J121955.77']
-    if name in big14k:
-        bigger = 14000
-        return [bigger, [bigger/2-cutout_size/2, bigger/2+cutout_size/2]]
-    elif name in big15k:
-        bigger = 15000
-        return [bigger, [bigger / 2 - cutout_size / 2, bigger / 2 + cutout_size / 2]]
-    elif name in big16k:
-        bigger = 16000
-        return [bigger, [bigger / 2 - cutout_size / 2, bigger / 2 + cutout_size / 2]]
+# Imaging parameters of galaxy x
+def imaging_params(x):
+    return ImagingParams.galaxy_params(names[x])
+
+
+# bump when the commands written for the stages change, so that every stage is redone
+stage_version = 1
+
+# The imaging stages, in the order they run. Each depends on the stages listed with it
+stage_graph = [('dirty', []),
+               ('clean', ['dirty']),
+               ('pbcor', ['clean']),
+               ('cutout', ['pbcor']),
+               ('statistics', ['clean'])]
+
+
+# Products of a stage in a galaxy's directory. A stage is only current if all of them exist
+def stage_outputs(stage, name):
+    outputs = {'dirty': ['%s.psf.tt0', '%s.residual.tt0', 'text/threshold.txt'],
+               'clean': ['%s.image.tt0', '%s.model.tt0'],
+               'pbcor': ['%s.pbcor.image.tt0'],
+               'cutout': ['%s.cutout.pbcor', '%s.cutout.pbcor.fits', '%s.pbcor.fits'],
+               'statistics': ['text/stdev.txt', 'text/beamarea.txt']}
+    return [(out % name) if '%s' in out else out for out in outputs[stage]]
+
+
+# Parameters the commands of a stage depend on for galaxy x. A change in any of them makes the stage out of date
+def stage_params(stage, x):
+    if stage == 'dirty':
+        params = imaging_params(x)
+        return {'vis': vises[x], 'imsize': params['imsize'], 'scales': params['scales'], 'clean_sigma': clean_sigma}
+    elif stage == 'clean':
+        params = imaging_params(x)
+        return {'vis': vises[x], 'imsize': params['imsize'], 'sidelobe': params['sidelobethreshold'],
+                'noise': params['noisethreshold'], 'niter': params['niter'], 'scales': params['scales']}
+    elif stage == 'pbcor':
+        return {'vis': vises[x][0]}
+    elif stage == 'cutout':
+        return {'frame': imaging_params(x)['cutout_frame']}
     else:
-        return [img_size, cut_frame]
-
-
-# Adjust sidelobe threshold in the automasking routine if prominent sidelobes are being burned into image
-def readjust_sidelobe(name):
-    problem_gals = ['J090133.42', 'J124807.15', 'J134136.79', 'J161332.52']
-    special = ['J211824.06']
-    other = ['J123215.82']
-    extra_bad = ['J090133.42', 'J214000.49', 'J134136.79']
-    super_bad = ['J082733.87', 'J094417.84']
-    evil = []
-    vile = ['J112518.89', 'J211625.14']
-    diabolical = ['J010624.25']
-    abhorrent = ['J122949.83']
-    if name in problem_gals:
-        return 5.0
-    if name in special:
-        return 5.1
-    if name in other:
-        return 5.5
-    elif name in extra_bad:
-	return 6.0
-    elif name in super_bad:
-	return 6.5
-    elif name in evil:
-	return 7.0
-    elif name in vile:
-	return 7.5
-    elif name in diabolical:
-	return 8.5
-    elif name in abhorrent:
-	return 9.0
-    else:
-        return 3.0
-
-# Adjust sidelobe threshold in the automasking routine if prominent sidelobes are being burned into image
-def readjust_noise(name):
-    problem_gals = []
-    if name in problem_gals:
-        return 6.0
-    else:
-        return 5.0
-
-
-# Creates a python script in each galaxy's directory
-# This script will construct a dirty image, or a very lightly cleaned image (niter~=100)
+        return {}
+
+
+# Signature of a stage's commands, written to its stamp file by the CASA script once the stage has finished
+def stage_signature(stage, x):
+    return Cache.config_hash([stage_version, stage, stage_params(stage, x)])
+
+
+def stamp_path(stage):
+    return 'text/stage_%s.txt' % stage
+
+
+# Stages which need to run for galaxy x, in order, to bring the targets up to date. A stage is out of date if it is
+# forced, if it has never finished or finished with different parameters, if any of its products are missing, if a
+# stage it depends on is out of date or finished after it did, or (for the dirty image) if the visibilities changed
+def stale_stages(x, stage_targets=None, forced=None):
+    if stage_targets is None:
+        stage_targets = targets
+    if forced is None:
+        forced = force
+    deps = dict(stage_graph)
+    needed = set()
+    to_visit = list(stage_targets)
+    while to_visit:
+        stage = to_visit.pop()
+        if stage not in needed:
+            needed.add(stage)
+            to_visit.extend(deps[stage])
+
+    gal_dir = GetGalaxyList.galaxy_dir(names[x])
+    stale = []
+    for stage, requires in stage_graph:
+        if stage not in needed:
+            continue
+        stamp = os.path.join(gal_dir, stamp_path(stage))
+        if stage in forced or any(dep in stale for dep in requires) or not os.path.exists(stamp):
+            stale.append(stage)
+            continue
+        with open(stamp, 'r') as f:
+            signature = f.read().strip()
+        stamp_time = os.path.getmtime(stamp)
+        inputs = [os.path.join(gal_dir, stamp_path(dep)) for dep in requires]
+        if stage == 'dirty':
+            inputs.extend(os.path.join(gal_dir, vis) for vis in vises[x])
+        if (signature != stage_signature(stage, x) or
+                not all(os.path.exists(os.path.join(gal_dir, out)) for out in stage_outputs(stage, names[x])) or
+                any(os.path.getmtime(path) > stamp_time for path in inputs if os.path.exists(path))):
+            stale.append(stage)
+    return stale
+
+
+# Write the stamps of the stages of galaxy x whose products all exist but which have never been stamped, taking them
+# to have been made with the current parameters (unless forced). A stage is only adopted if the stages it depends on
+# are stamped. Returns the stages adopted
+def adopt_stages(x, forced=None):
+    if forced is None:
+        forced = force
+    gal_dir = GetGalaxyList.galaxy_dir(names[x])
+    adopted = []
+    for stage, requires in stage_graph:
+        stamp = os.path.join(gal_dir, stamp_path(stage))
+        if (stage in forced or os.path.exists(stamp) or
+                not all(os.path.exists(os.path.join(gal_dir, stamp_path(dep))) for dep in requires) or
+                not all(os.path.exists(os.path.join(gal_dir, out)) for out in stage_outputs(stage, names[x]))):
+            continue
+        # written in stage order, so that no stamp is older than those of the stages it depends on
+        with open(stamp, 'w') as f:
+            f.write(stage_signature(stage, x))
+        adopted.append(stage)
+    return adopted
+
+
+# Constructs a dirty image, or a very lightly cleaned image (niter~=100)
 # Measures the MAD of that image, scales it by 1.4826, and multiplies it by some number(3) to set the threshold
 # In the process, a PSF and residual is saved so it does not have to be recalculated when the images are cleaned
-def make_dirty_images():
-
-    global dirty_has_run
-
-    for x in range(len(names)):
-
-        os.chdir(names[x])
-        if not os.path.exists('text'):
-            os.makedirs('text')
-
-        with open('run_tclean_%s.py' %(names[x].split('.')[0]), 'w') as f:
-
-            # adding paths to simplify creating pipeline script later
-            paths_to_dirs.append(os.getcwd())
-            paths_to_files.append(os.path.realpath(f.name))
-
-            # write out dirty tclean command
-            f.write("""tclean(vis=%s, imagename='%s', field='0', datacolumn='data',
-                verbose=True, gridder='wproject', wprojplanes=128, pblimit=-1, robust=0.5, imsize=[%s], 
-                cell='0.2arcsec', specmode='mfs', deconvolver='mtmfs', nterms=2, scales=[0,11,28], 
-                interactive=False, niter=0,
-                weighting='briggs', stokes='I', threshold='0.0Jy', calcpsf=True,
-                calcres=True, savemodel='modelcolumn', restart=False) \n \n""" % (vises[x], names[x],
-                                                                                 readjust_size(names[x])[0]))
-
-            # will call imstat to measure the MAD of each image, scaled by number*1.4826*MAD
-            # saves threshold value to text file for CleanImages() script's access
-            f.write("""stats=imstat('%s.image.tt0')\n""" %(names[x]))
-            f.write("""thresh=%s*1.4826*stats['medabsdevmed'][0]\n""" % clean_sigma)
-            f.write("""print(thresh)\n""")
-            f.write("""with open('text/threshold.txt', 'w') as f:\n""")
-            f.write("""\tf.write('%s' %(thresh))\n \n""")
-
-        os.chdir('..')
-    dirty_has_run = True
-
-
-# Generates a script which will run tclean with the threshold determined in the dirty_image() step
-def clean_images():
-
-    global dirty_has_run, clean_has_run
-
-    if dirty_has_run:
-        edit_mode = 'a'
-    else:
-        edit_mode = 'w'
-
-    for x in range(len(names)):
-
-        os.chdir(names[x])
-
-        with open('run_tclean_%s.py' %(names[x].split('.')[0]), edit_mode) as f:
-            if not dirty_has_run:
-                paths_to_dirs.append(os.getcwd())
-                paths_to_files.append(os.path.realpath(f.name))
-
-            # retrieve previously saved threshold value
-            f.write("""with open('text/threshold.txt', 'r') as f:\n""")
-            f.write("""\tglobal threshold\n""")
-            f.write("""\tlines=f.readlines()\n""")
-            f.write("""\tthreshold=float(lines[0])\n""")
-            f.write("""print(threshold)\n \n""")
-
-	    f.write(("""tclean(vis=%s, imagename='%s', field='0', datacolumn='data',
-                   verbose=True, gridder='wproject', wprojplanes=128, pblimit=-1, robust=0.5, imsize=[%s], 
-                   cell='0.2arcsec', specmode='mfs', deconvolver='mtmfs', nterms=2, scales=[0,11,28], """
-                    % (vises[x], names[x], readjust_size(names[x])[0])) + """ interactive=False, niter=50, weighting='briggs',
-                   usemask='auto-multithresh', sidelobethreshold = %s, noisethreshold = %s,""" % (readjust_sidelobe(names[x]), readjust_noise(names[x])) +
-                    """ stokes='I', threshold='%sJy' %(threshold), minbeamfrac=0.0,
-                   savemodel='modelcolumn', calcres=True, calcpsf=True, restart=False) \n \n""")
-
-            # run tclean with said threshold, high niter value
-            f.write(("""tclean(vis=%s, imagename='%s', field='0', datacolumn='data',
-                   verbose=True, gridder='wproject', wprojplanes=128, pblimit=-1, robust=0.5, imsize=[%s], 
-                   cell='0.2arcsec', specmode='mfs', deconvolver='mtmfs', nterms=2, scales=[0,11,28], """
-                    % (vises[x], names[x], readjust_size(names[x])[0])) + """ interactive=False, niter=20000, weighting='briggs',
-                   usemask='auto-multithresh', sidelobethreshold = %s, noisethreshold = %s,""" % (readjust_sidelobe(names[x]), readjust_noise(names[x])) +
-                    """ stokes='I', threshold='%sJy' %(threshold), minbeamfrac=0.1,
-                   savemodel='modelcolumn', calcres=False, calcpsf=False, restart=True) \n \n""")
-
-        os.chdir('..')
-    clean_has_run = True
+def write_dirty(f, x):
+    params = imaging_params(x)
+    # start over from nothing, as tclean can't reuse images of a different size
+    f.write("""for product in set(glob.glob('%s.*tt*') + glob.glob('%s.alpha*') + glob.glob('%s.pbcor*') + """
+            """glob.glob('%s.cutout*') + glob.glob('%s.mask')):\n""" % ((names[x],) * 5))
+    f.write("""\tshutil.rmtree(product) if os.path.isdir(product) else os.remove(product)\n \n""")
+
+    # write out dirty tclean command
+    f.write("""tclean(vis=%s, imagename='%s', field='0', datacolumn='data',
+        verbose=True, gridder='wproject', wprojplanes=128, pblimit=-1, robust=0.5, imsize=[%s], 
+        cell='0.2arcsec', specmode='mfs', deconvolver='mtmfs', nterms=2, scales=%s, 
+        interactive=False, niter=0,
+        weighting='briggs', stokes='I', threshold='0.0Jy', calcpsf=True,
+        calcres=True, savemodel='modelcolumn', restart=False) \n \n""" % (vises[x], names[x],
+                                                                         params['imsize'], params['scales']))
+
+    # will call imstat to measure the MAD of each image, scaled by number*1.4826*MAD
+    # saves threshold value to text file for the clean stage's access
+    f.write("""stats=imstat('%s.image.tt0')\n""" % (names[x]))
+    f.write("""thresh=%s*1.4826*stats['medabsdevmed'][0]\n""" % clean_sigma)
+    f.write("""print(thresh)\n""")
+    f.write("""with open('text/threshold.txt', 'w') as f:\n""")
+    f.write("""\tf.write('%s' %(thresh))\n \n""")
+
+
+# Runs tclean with the threshold determined in the dirty image stage, reusing the PSF made there
+def write_clean(f, x):
+    params = imaging_params(x)
+    # discard the previous clean, keeping the PSF
+    f.write("""for product in set(glob.glob('%s.model.tt*') + glob.glob('%s.image.tt*') + glob.glob('%s.alpha*') + """
+            """glob.glob('%s.mask')):\n""" % ((names[x],) * 4))
+    f.write("""\tshutil.rmtree(product) if os.path.isdir(product) else os.remove(product)\n \n""")
+
+    # retrieve previously saved threshold value
+    f.write("""with open('text/threshold.txt', 'r') as f:\n""")
+    f.write("""\tglobal threshold\n""")
+    f.write("""\tlines=f.readlines()\n""")
+    f.write("""\tthreshold=float(lines[0])\n""")
+    f.write("""print(threshold)\n \n""")
+
+    f.write(("""tclean(vis=%s, imagename='%s', field='0', datacolumn='data',
+           verbose=True, gridder='wproject', wprojplanes=128, pblimit=-1, robust=0.5, imsize=[%s], 
+           cell='0.2arcsec', specmode='mfs', deconvolver='mtmfs', nterms=2, scales=%s, """
+             % (vises[x], names[x], params['imsize'], params['scales'])) + """ interactive=False, niter=50, weighting='briggs',
+           usemask='auto-multithresh', sidelobethreshold = %s, noisethreshold = %s,""" % (params['sidelobethreshold'], params['noisethreshold']) +
+            """ stokes='I', threshold='%sJy' %(threshold), minbeamfrac=0.0,
+           savemodel='modelcolumn', calcres=True, calcpsf=False, restart=True) \n \n""")
+
+    # run tclean with said threshold, high niter value
+    f.write(("""tclean(vis=%s, imagename='%s', field='0', datacolumn='data',
+           verbose=True, gridder='wproject', wprojplanes=128, pblimit=-1, robust=0.5, imsize=[%s], 
+           cell='0.2arcsec', specmode='mfs', deconvolver='mtmfs', nterms=2, scales=%s, """
+             % (vises[x], names[x], params['imsize'], params['scales'])) + """ interactive=False, niter=%s, weighting='briggs',
+           usemask='auto-multithresh', sidelobethreshold = %s, noisethreshold = %s,""" % (params['niter'], params['sidelobethreshold'], params['noisethreshold']) +
+            """ stokes='I', threshold='%sJy' %(threshold), minbeamfrac=0.1,
+           savemodel='modelcolumn', calcres=False, calcpsf=False, restart=True) \n \n""")
 
 
 # Do a primary beam correction (WARNING!!!! CASA says that the pbcor task will become deprecated soon and merge into
-# tclean task, in which case this function will become useless and clean_images() above will need to be edited
-def pb_cor():
+# tclean task, in which case this stage will become useless and the clean stage above will need to be edited
+def write_pbcor(f, x):
+    # retrieve previously saved threshold value
+    f.write("""with open('text/threshold.txt', 'r') as f:\n""")
+    f.write("""\tglobal threshold\n""")
+    f.write("""\tlines=f.readlines()\n""")
+    f.write("""\tthreshold=float(lines[0])\n""")
+    f.write("""print(threshold)\n \n""")
 
-    global clean_has_run, pb_has_run
-    if clean_has_run:
-        editmode='a'
-    else: editmode='w'
-    for x in range(len(names)):
-        os.chdir(names[x])
-        with open('run_tclean_%s.py' %(names[x].split('.')[0]), editmode) as f:
-            if not clean_has_run:
-                paths_to_dirs.append(os.getcwd())
-                paths_to_files.append(os.path.realpath(f.name))
-	    # retrieve previously saved threshold value
-            f.write("""with open('text/threshold.txt', 'r') as f:\n""")
-            f.write("""\tglobal threshold\n""")
-            f.write("""\tlines=f.readlines()\n""")
-            f.write("""\tthreshold=float(lines[0])\n""")
-            f.write("""print(threshold)\n \n""")
-
-            f.write("""widebandpbcor(vis='%s', imagename='%s',""" %(vises[x][0], names[x]) + """ nterms=2,
-                   threshold='%sJy' %(threshold), action='pbcor', field='0', spwlist=[0,7,15], chanlist=[0,0,0],
-                   weightlist=[1,1,1]) \n \n""")
-
-        os.chdir('..')
-    pb_has_run = True
-
-
-# Makes a small cutout around the center of the image of both the normal and PB-corrected image, stores them each
-# as both a CASA image and a fits file
-def cutout():
-
-    global pb_has_run, cutout_has_run
-
-    if pb_has_run:
-        edit_mode='a'
-    else: edit_mode='w'
-    for x in range(len(names)):
-        os.chdir(names[x])
-
-        with open('run_tclean_%s.py' %(names[x].split('.')[0]), edit_mode) as f:
-            if not pb_has_run:
-                paths_to_dirs.append(os.getcwd())
-                paths_to_files.append(os.path.realpath(f.name))
-
-            # make cutout image
-            frame = readjust_size(names[x])[1]
-            lower_bound, upper_bound = frame[0], frame[1]
+    f.write("""widebandpbcor(vis='%s', imagename='%s',""" % (vises[x][0], names[x]) + """ nterms=2,
+           threshold='%sJy' %(threshold), action='pbcor', field='0', spwlist=[0,7,15], chanlist=[0,0,0],
+           weightlist=[1,1,1]) \n \n""")
 
 
-            f.write("""imsubimage(imagename='%s.pbcor.image.tt0', outfile='%s.cutout.pbcor', overwrite=True,
-                    region='box[[%spix, %spix], [%spix, %spix]]')\n \n""" % (names[x], names[x], lower_bound,
-                                                                             lower_bound, upper_bound, upper_bound))
-            #f.write("""imsubimage(imagename='%s.image.tt0', outfile='%s.cutout', overwrite=True,
-                    #region='box[[%spix, %spix], [%spix, %spix]]')\n \n""" % (names[x], names[x], lower_bound,
-                                                                             #lower_bound, upper_bound, upper_bound))
+# Makes a small cutout around the center of the PB-corrected image, stores it as both a CASA image and a fits file
+def write_cutout(f, x):
+    # make cutout image
+    frame = imaging_params(x)['cutout_frame']
+    lower_bound, upper_bound = frame[0], frame[1]
 
-            f.write("""exportfits(imagename='%s.cutout.pbcor', fitsimage='%s.cutout.pbcor.fits', overwrite=True)\n"""
-                    % (names[x], names[x]))
-            #f.write("""exportfits(imagename='%s.cutout', fitsimage='%s.cutout.fits', overwrite=True)\n"""
-                    #% (names[x], names[x]))
-            f.write("""exportfits(imagename='%s.pbcor.image.tt0', fitsimage='%s.pbcor.fits', overwrite=True)\n"""
-                    % (names[x], names[x]))
-            #f.write("""exportfits(imagename='%s.image.tt0', fitsimage='%s.fits', overwrite=True)\n \n"""
-                    #% (names[x], names[x]))
+    f.write("""imsubimage(imagename='%s.pbcor.image.tt0', outfile='%s.cutout.pbcor', overwrite=True,
+            region='box[[%spix, %spix], [%spix, %spix]]')\n \n""" % (names[x], names[x], lower_bound,
+                                                                     lower_bound, upper_bound, upper_bound))
 
-        os.chdir('..')
-    cutout_has_run = True
+    f.write("""exportfits(imagename='%s.cutout.pbcor', fitsimage='%s.cutout.pbcor.fits', overwrite=True)\n"""
+            % (names[x], names[x]))
+    f.write("""exportfits(imagename='%s.pbcor.image.tt0', fitsimage='%s.pbcor.fits', overwrite=True)\n"""
+            % (names[x], names[x]))
 
 
 # Calculates the RMS of the cleaned image along with the beam area in pixels and saves each to a .txt file
-def statistics():
-    global cutout_has_run
-    global stats_has_run
-
-    if cutout_has_run:
-        edit_mode = 'a'
-    else:
-        edit_mode = 'w'
+def write_statistics(f, x):
+    f.write("""stats=imstat('%s.image.tt0')\n""" % (names[x]))
+    f.write("""stdev=1.4826*stats['medabsdevmed'][0]\n""")
+    f.write("""with open('text/stdev.txt', 'w') as f:\n""")
+    f.write("""\tf.write('%s' %(stdev))\n \n""")
+    f.write("""majoraxis = imhead(imagename='%s.image.tt0', mode='get', hdkey='bmaj')['value']\n"""
+            % (names[x]))
+    f.write("""minoraxis = imhead(imagename='%s.image.tt0', mode='get', hdkey='bmin')['value']\n \n"""
+            % (names[x]))
+    f.write("""beamarea = np.pi*majoraxis*minoraxis/(4*np.log(2))\n""")
+    f.write("""with open('text/beamarea.txt', 'w') as f:\n""")
+    f.write("""\tf.write('%s' %(beamarea))\n \n""")
+
+
+stage_writers = {'dirty': write_dirty, 'clean': write_clean, 'pbcor': write_pbcor, 'cutout': write_cutout,
+                 'statistics': write_statistics}
+
+
+# Creates a python script in each galaxy's directory which runs only the stages that are out of date. Each stage
+# removes its stamp file and products before running and writes the stamp once it has made all of its products, so
+# an interrupted or failed run is picked up where it failed (the script exits with an error at the failed stage).
+# Galaxies which are already up to date get no script
+def write_scripts():
     for x in range(len(names)):
-        os.chdir(names[x])
-
-        with open('run_tclean_%s.py' % (names[x].split('.')[0]), edit_mode) as f:
-            if not cutout_has_run:
-                paths_to_dirs.append(os.getcwd())
-                paths_to_files.append(os.path.realpath(f.name))
-
-            f.write("""stats=imstat('%s.image.tt0')\n""" % (names[x]))
-            f.write("""stdev=1.4826*stats['medabsdevmed'][0]\n""")
-            f.write("""with open('text/stdev.txt', 'w') as f:\n""")
-            f.write("""\tf.write('%s' %(stdev))\n \n""")
-            f.write("""majoraxis = imhead(imagename='%s.image.tt0', mode='get', hdkey='bmaj')['value']\n"""
-                    % (names[x]))
-            f.write("""minoraxis = imhead(imagename='%s.image.tt0', mode='get', hdkey='bmin')['value']\n \n"""
-                    % (names[x]))
-            f.write("""beamarea = np.pi*majoraxis*minoraxis/(4*np.log(2))\n""")
-            f.write("""with open('text/beamarea.txt', 'w') as f:\n""")
-            f.write("""\tf.write('%s' %(beamarea))\n \n""")
-
-        os.chdir('..')
-    stats_has_run = True
-
-
-# can make dirty images, then later clean
-# or can make dirty image and then clean immediately after in one run (suite)
-
-# I typically would run make_dirty_images() once when I first received the data, which would never need to be run again
-# unless changing the image size (WARNING!!! if you change the image size you cannot re-run the dirty image constructor
-# without deleting the previous images)
-# I would then use only run_clean until I got nice images. This way the PSF doesn't need to be calculated every time
-
-run_suite = False
-run_dirty = False
-run_clean = True
-
-if run_suite:
-    make_dirty_images()
-    clean_images()
-    pb_cor()
-    cutout()
-    statistics()
-elif run_dirty:
-    make_dirty_images()
-elif run_clean:
-    #clean_images()
-    pb_cor()
-    cutout()
-    statistics()
-
-restarting = False
+        if adopt:
+            adopted = adopt_stages(x)
+            if adopted:
+                print('%s: adopted existing %s' % (names[x], ', '.join(adopted)))
+        stages = stale_stages(x)
+        print('%s: %s' % (names[x], ', '.join(stages) if stages else 'up to date'))
+        if not stages:
+            continue
+
+        gal_dir = GetGalaxyList.galaxy_dir(names[x])
+        if not os.path.exists(os.path.join(gal_dir, 'text')):
+            os.makedirs(os.path.join(gal_dir, 'text'))
+
+        script_path = os.path.join(gal_dir, 'run_tclean_%s.py' % (names[x].split('.')[0]))
+        with open(script_path, 'w') as f:
+            # adding paths to simplify creating pipeline script later
+            paths_to_dirs.append(os.path.realpath(gal_dir))
+            paths_to_files.append(os.path.realpath(script_path))
+
+            f.write("""import os\nimport sys\nimport time\nimport glob\nimport shutil\n \n""")
+            for stage in stages:
+                outputs = stage_outputs(stage, names[x])
+                f.write("""# stage: %s\n""" % stage)
+                f.write("""if os.path.exists('%s'):\n\tos.remove('%s')\n""" % (stamp_path(stage), stamp_path(stage)))
+                f.write("""stage_start = time.time()\n""")
+                f.write("""for product in %s:\n""" % outputs)
+                f.write("""\tif os.path.exists(product):\n""")
+                f.write("""\t\tshutil.rmtree(product) if os.path.isdir(product) else os.remove(product)\n \n""")
+                stage_writers[stage](f, x)
+                # CASA tasks log their errors and return, so only stamp the stage if it made all of its products
+                f.write("""failed = [product for product in %s if not os.path.exists(product) or """
+                        """os.path.getmtime(product) < int(stage_start) - 1]\n""" % outputs)
+                f.write("""if failed:\n""")
+                f.write("""\tprint('stage %s failed, missing %%s' %% ', '.join(failed))\n""" % stage)
+                f.write("""\tsys.exit(1)\n""")
+                f.write("""with open('%s', 'w') as f:\n""" % stamp_path(stage))
+                f.write("""\tf.write('%s')\n \n""" % stage_signature(stage, x))
+
+
+write_scripts()
 
 # generates the pipeline script
-os.chdir(current_dir)
 with open('pipelinerun', 'w') as f:
-    if restarting == True:
-	for x in range(len(paths_to_files)):
-            f.write("""cd %s; rm -rf *.tt*; rm -rf *.pbcor*; rm -rf *.alpha*; rm -rf *.mask; xvfb-run -d casa -r 5.3.0-143 --nogui -c %s\n""" % (paths_to_dirs[x], paths_to_files[x]))
-    elif restarting == False:
-	for x in range(len(paths_to_files)):
-            f.write("""cd %s; xvfb-run -d casa -r 5.3.0-143 --nogui -c %s\n""" % (paths_to_dirs[x], paths_to_files[x]))
+    for x in range(len(paths_to_files)):
+        f.write("""cd %s; xvfb-run -d casa -r 5.3.0-143 --nogui -c %s\n""" % (paths_to_dirs[x], paths_to_files[x]))
 
 st = os.stat('pipelinerun')
 os.chmod('pipelinerun', st.st_mode | 0111)